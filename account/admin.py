@@ -1,6 +1,6 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
-from .models import CustomUser, PromoCode
+from .models import CustomUser, PromoCode, SMSMessage
 from assessment.models import AssessmentResult
 from django.urls import reverse
 from django.utils.html import format_html
@@ -48,13 +48,24 @@ class CustomUserAdmin(UserAdmin):
     ordering = ('phone_number',)
     
     def get_assessment_count(self, obj):
-        # This counts how many AssessmentResult objects are linked to this user
-        return obj.assessments.count()
+        # Denormalized count of the user's AssessmentResults (see account/ranking.py)
+        return obj.assessment_count
     get_assessment_count.short_description = 'Assessments Taken'
+    get_assessment_count.admin_order_field = 'assessment_count'
     
     
 @admin.register(PromoCode)
 class PromoCodeAdmin(admin.ModelAdmin):
     list_display = ('code', 'discount_percentage', 'fixed_discount_amount', 'is_active', 'created_at')
     search_fields = ('code',)
-    list_filter = ('is_active',)
\ No newline at end of file
+    list_filter = ('is_active',)
+
+
+@admin.register(SMSMessage)
+class SMSMessageAdmin(admin.ModelAdmin):
+    list_display = ('id', 'phone_number', 'status', 'attempts', 'created_at', 'sent_at')
+    list_filter = ('status',)
+    search_fields = ('phone_number',)
+    exclude = ('parameters',)  # OTP codes
+    readonly_fields = ('phone_number', 'template_id', 'status', 'attempts', 'error', 'provider_message_id',
+                       'created_at', 'next_attempt_at', 'expires_at', 'sent_at')
@@ -0,0 +1,39 @@
+# account/management/commands/purge_otps.py
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from account.models import OTP
+
+
+class Command(BaseCommand):
+    help = (
+        "Deletes expired OTP rows in small batches. Use --all once after switching "
+        "to OTP_STORE=cache to clear the legacy table."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help="Delete every row, expired or not.")
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--sleep', type=float, default=0.0, help="Seconds to pause between batches.")
+
+    def handle(self, *args, **options):
+        rows = OTP.objects.all()
+        if not options['all']:
+            rows = rows.filter(created_at__lt=timezone.now() - timedelta(seconds=settings.OTP_TTL))
+
+        deleted = 0
+        while True:
+            # Short transactions: never lock the whole table while users are logging in
+            batch = list(rows.order_by('pk').values_list('pk', flat=True)[:options['batch_size']])
+            if not batch:
+                break
+            deleted += OTP.objects.filter(pk__in=batch).delete()[0]
+            self.stdout.write(f"{deleted} rows deleted...")
+            if options['sleep']:
+                time.sleep(options['sleep'])
+
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} OTP rows."))
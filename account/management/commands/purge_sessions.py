@@ -0,0 +1,37 @@
+# account/management/commands/purge_sessions.py
+import time
+
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+
+class Command(BaseCommand):
+    help = (
+        "Deletes expired sessions from django_session in small batches (unlike "
+        "clearsessions, which does it in one big DELETE). Run it daily from cron."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--sleep', type=float, default=0.0, help="Seconds to pause between batches.")
+
+    def handle(self, *args, **options):
+        if settings.SESSION_ENGINE == 'django.contrib.sessions.backends.cache':
+            self.stdout.write("Sessions live only in the cache, which expires them by itself.")
+            return
+
+        # expire_date is indexed, so every batch is a short range scan
+        expired = Session.objects.filter(expire_date__lt=timezone.now())
+        deleted = 0
+        while True:
+            batch = list(expired.values_list('session_key', flat=True)[:options['batch_size']])
+            if not batch:
+                break
+            deleted += Session.objects.filter(session_key__in=batch).delete()[0]
+            self.stdout.write(f"{deleted} sessions deleted...")
+            if options['sleep']:
+                time.sleep(options['sleep'])
+
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} expired sessions."))
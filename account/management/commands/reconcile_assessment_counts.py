@@ -0,0 +1,15 @@
+# account/management/commands/reconcile_assessment_counts.py
+from django.core.management.base import BaseCommand
+
+from account.ranking import reconcile
+
+
+class Command(BaseCommand):
+    help = (
+        "Recomputes every user's assessment_count from their results and rebuilds "
+        "the rank histogram. Run after bulk imports or deletes that skipped signals."
+    )
+
+    def handle(self, *args, **options):
+        fixed = reconcile()
+        self.stdout.write(self.style.SUCCESS(f"Done, corrected the count of {fixed} users."))
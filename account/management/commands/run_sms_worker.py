@@ -0,0 +1,27 @@
+# account/management/commands/run_sms_worker.py
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from account.sms_outbox import run_workers
+
+
+class Command(BaseCommand):
+    help = "Sends the queued text messages (OTP codes) with a pool of worker threads."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--concurrency', type=int, default=settings.SMS_WORKER_CONCURRENCY,
+            help="Number of messages sent in parallel.",
+        )
+        parser.add_argument(
+            '--poll-interval', type=float, default=settings.SMS_WORKER_POLL_INTERVAL,
+            help="Seconds an idle worker waits before checking the outbox again.",
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"Starting {options['concurrency']} SMS workers (Ctrl+C to stop)...")
+        try:
+            run_workers(concurrency=options['concurrency'], poll_interval=options['poll_interval'])
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(self.style.SUCCESS("SMS workers stopped."))
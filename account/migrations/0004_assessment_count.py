@@ -0,0 +1,48 @@
+# Generated by Django 5.2.7 on 2026-10-18 08:55
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def fill_assessment_counts(apps, schema_editor):
+    CustomUser = apps.get_model('account', 'CustomUser')
+    AssessmentResult = apps.get_model('assessment', 'AssessmentResult')
+    AssessmentCountBucket = apps.get_model('account', 'AssessmentCountBucket')
+
+    CustomUser.objects.update(assessment_count=Coalesce(Subquery(
+        AssessmentResult.objects
+        .filter(user=OuterRef('pk'))
+        .order_by()
+        .values('user')
+        .annotate(n=Count('pk'))
+        .values('n')
+    ), Value(0)))
+    AssessmentCountBucket.objects.bulk_create([
+        AssessmentCountBucket(assessment_count=row['assessment_count'], users=row['users'])
+        for row in CustomUser.objects.order_by().values('assessment_count').annotate(users=Count('pk'))
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('account', '0003_promocode'),
+        ('assessment', '0007_test_questions_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AssessmentCountBucket',
+            fields=[
+                ('assessment_count', models.PositiveIntegerField(primary_key=True, serialize=False)),
+                ('users', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='customuser',
+            name='assessment_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(fill_assessment_counts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.7 on 2026-10-18 08:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('account', '0004_assessment_count'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='otp',
+            index=models.Index(fields=['phone_number', 'created_at'], name='otp_phone_created_idx'),
+        ),
+    ]
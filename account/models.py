@@ -1,6 +1,7 @@
 # accounts/models.py
 from django.contrib.auth.models import AbstractUser, BaseUserManager
 from django.db import models
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
 class CustomUserManager(BaseUserManager):
@@ -29,6 +30,8 @@ class CustomUser(AbstractUser):
     age = models.PositiveIntegerField(null=True, blank=True)
     about_me = models.TextField(blank=True)
     is_premium = models.BooleanField(default=False)
+    # Number of AssessmentResults, kept in sync by account/ranking.py (repair with reconcile_assessment_counts)
+    assessment_count = models.PositiveIntegerField(default=0, editable=False)
     objects = CustomUserManager()
     USERNAME_FIELD = 'phone_number'
     REQUIRED_FIELDS = []
@@ -36,11 +39,31 @@ class CustomUser(AbstractUser):
     def __str__(self):
         return self.phone_number
 
+class AssessmentCountBucket(models.Model):
+    """
+    Histogram of users by assessment_count: `users` users have taken exactly
+    `assessment_count` assessments. The rank API sums buckets instead of
+    counting users.
+    """
+    assessment_count = models.PositiveIntegerField(primary_key=True)
+    users = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.users} users with {self.assessment_count} assessments"
+
 class OTP(models.Model):
+    # Only used with OTP_STORE=db (see account/otp.py)
     phone_number = models.CharField(max_length=15)
     code = models.CharField(max_length=6)
+    attempts = models.PositiveSmallIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # The OTP store reads the newest code of a phone number
+            models.Index(fields=['phone_number', 'created_at'], name='otp_phone_created_idx'),
+        ]
+
     def __str__(self):
         return f"OTP {self.code} for {self.phone_number}"
 
@@ -61,4 +84,41 @@ class PromoCode(models.Model):
                 return self.fixed_discount_amount
             elif self.discount_percentage:
                 return base_price * (self.discount_percentage / 100)
-        return 0
\ No newline at end of file
+        return 0
+
+class SMSMessage(models.Model):
+    """Outbox of text messages, sent by the run_sms_worker command (see account/sms_outbox.py)."""
+    STATUS_PENDING = 'pending'
+    STATUS_SENDING = 'sending'
+    STATUS_SENT = 'sent'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_SENDING, 'Sending'),
+        (STATUS_SENT, 'Sent'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    phone_number = models.CharField(max_length=15)
+    template_id = models.CharField(max_length=50)
+    # Template parameters (e.g. the OTP code); cleared once the message is sent or given up on
+    parameters = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+    provider_message_id = models.CharField(max_length=100, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    # Not sent before this (retry backoff) and not at all after expires_at (a stale OTP is useless)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    expires_at = models.DateTimeField(null=True, blank=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['created_at']
+        indexes = [
+            # The worker claims the oldest due message on every poll
+            models.Index(fields=['status', 'next_attempt_at'], name='sms_status_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"SMS #{self.pk} to {self.phone_number} ({self.status})"
@@ -0,0 +1,153 @@
+# account/otp.py
+"""
+Where login codes live between request_otp and verify_otp.
+
+Codes expire after OTP_TTL seconds, a phone number gets OTP_MAX_ATTEMPTS
+guesses per code and can't ask for a new code more than once per
+OTP_RESEND_COOLDOWN seconds. OTP_STORE picks the backend:
+
+- 'cache' (default with a shared CACHES backend): keys in Django's cache,
+  so checking a code is a couple of O(1) lookups and nothing piles up in
+  the database. With more than one server process the cache must be shared
+  (Redis/Memcached).
+- 'db' (default otherwise): the OTP table, one row per phone number, for
+  setups without a shared cache. Expired rows are removed by
+  `python manage.py purge_otps`.
+"""
+import random
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.crypto import constant_time_compare
+
+from .models import OTP
+
+
+class OTPError(Exception):
+    """The code can't be sent or checked right now."""
+
+
+class OTPCooldownError(OTPError):
+    def __init__(self, retry_after):
+        super().__init__(f"A code was sent recently, try again in {retry_after} seconds.")
+        self.retry_after = retry_after
+
+
+class OTPAttemptsExceededError(OTPError):
+    """Too many wrong guesses; the code is burned and a new one must be requested."""
+
+
+def generate_code():
+    return f'{random.SystemRandom().randint(0, 999999):06d}'
+
+
+class CacheOTPStore:
+    name = 'cache'
+
+    def __init__(self):
+        self.cache = caches[settings.OTP_CACHE_ALIAS]
+
+    def _keys(self, phone_number):
+        return f'otp:code:{phone_number}', f'otp:attempts:{phone_number}', f'otp:cooldown:{phone_number}'
+
+    def issue(self, phone_number, code=None):
+        """Stores a new code for `phone_number` and returns it. Raises OTPCooldownError."""
+        code_key, attempts_key, cooldown_key = self._keys(phone_number)
+        if settings.OTP_RESEND_COOLDOWN:
+            until = time.time() + settings.OTP_RESEND_COOLDOWN
+            # add() is atomic, so two quick requests can't both get past the cooldown
+            if not self.cache.add(cooldown_key, until, timeout=settings.OTP_RESEND_COOLDOWN):
+                retry_after = self.cache.get(cooldown_key, until) - time.time()
+                raise OTPCooldownError(max(1, round(retry_after)))
+
+        code = code or generate_code()
+        self.cache.set_many({code_key: code, attempts_key: 0}, timeout=settings.OTP_TTL)
+        return code
+
+    def verify(self, phone_number, code):
+        """True if `code` is the current code (which is then used up). Raises OTPAttemptsExceededError."""
+        code_key, attempts_key, _ = self._keys(phone_number)
+        expected = self.cache.get(code_key)
+        if expected is None:
+            return False
+
+        try:
+            attempts = self.cache.incr(attempts_key)
+        except ValueError:
+            # The counter expired just before the code did
+            self.cache.set(attempts_key, 1, timeout=settings.OTP_TTL)
+            attempts = 1
+        if attempts > settings.OTP_MAX_ATTEMPTS:
+            self.cache.delete_many([code_key, attempts_key])
+            raise OTPAttemptsExceededError()
+
+        if not constant_time_compare(expected, str(code)):
+            return False
+        self.cache.delete_many([code_key, attempts_key])
+        return True
+
+    def peek(self, phone_number):
+        """The current code, without using it up (tests and load tests only)."""
+        return self.cache.get(self._keys(phone_number)[0])
+
+
+class DatabaseOTPStore:
+    name = 'db'
+
+    def _current(self, phone_number):
+        return OTP.objects.filter(phone_number=phone_number).order_by('-created_at').first()
+
+    def issue(self, phone_number, code=None):
+        with transaction.atomic():
+            current = self._current(phone_number)
+            if current and settings.OTP_RESEND_COOLDOWN:
+                retry_after = (current.created_at + timedelta(seconds=settings.OTP_RESEND_COOLDOWN) - timezone.now()).total_seconds()
+                if retry_after > 0:
+                    raise OTPCooldownError(max(1, round(retry_after)))
+            OTP.objects.filter(phone_number=phone_number).delete()
+            code = code or generate_code()
+            OTP.objects.create(phone_number=phone_number, code=code)
+        return code
+
+    def verify(self, phone_number, code):
+        current = self._current(phone_number)
+        if current is None or current.created_at < timezone.now() - timedelta(seconds=settings.OTP_TTL):
+            return False
+
+        # Counted in the UPDATE itself: concurrent guesses can't all pass on
+        # the same (stale) count read above
+        counted = OTP.objects.filter(pk=current.pk, attempts__lt=settings.OTP_MAX_ATTEMPTS).update(attempts=F('attempts') + 1)
+        if not counted:
+            deleted, _ = OTP.objects.filter(pk=current.pk).delete()
+            if not deleted:
+                # Used up by a concurrent correct guess
+                return False
+            raise OTPAttemptsExceededError()
+
+        if not constant_time_compare(current.code, str(code)):
+            return False
+        current.delete()
+        return True
+
+    def peek(self, phone_number):
+        current = self._current(phone_number)
+        return current.code if current else None
+
+
+STORES = {
+    CacheOTPStore.name: CacheOTPStore,
+    DatabaseOTPStore.name: DatabaseOTPStore,
+}
+
+
+def get_store(name=None):
+    """The OTP store called `name`, by default OTP_STORE."""
+    name = name or settings.OTP_STORE
+    if name not in STORES:
+        raise ValueError(f"Unknown OTP store '{name}', expected one of {sorted(STORES)}")
+    return STORES[name]()
@@ -0,0 +1,107 @@
+# account/ranking.py
+"""
+User rank by number of assessments taken.
+
+Each user's count is denormalized into CustomUser.assessment_count, and
+AssessmentCountBucket keeps how many users have each count. A user's rank
+is 1 + the users in higher buckets, so answering it sums a handful of
+bucket rows instead of counting results for every user.
+
+Both are updated with F() expressions when a result is created or deleted
+and when a user is created or deleted (see the signals in both apps).
+Writes that skip signals (bulk_create, queryset.delete(), raw SQL) make
+them drift; `python manage.py reconcile_assessment_counts` repairs that.
+"""
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+from .models import AssessmentCountBucket, CustomUser
+
+
+def _add_to_bucket(assessment_count, delta):
+    updated = AssessmentCountBucket.objects.filter(assessment_count=assessment_count).update(users=F('users') + delta)
+    if not updated:
+        try:
+            with transaction.atomic():
+                AssessmentCountBucket.objects.create(assessment_count=assessment_count, users=delta)
+        except IntegrityError:
+            # Another request created the bucket first
+            AssessmentCountBucket.objects.filter(assessment_count=assessment_count).update(users=F('users') + delta)
+
+
+def change_assessment_count(user_id, delta):
+    """Adds `delta` (+1 / -1) to the user's assessment_count and moves them to the matching bucket."""
+    with transaction.atomic():
+        # The UPDATE locks the user's row, so concurrent changes for one user are serialized
+        updated = CustomUser.objects.filter(pk=user_id).update(assessment_count=F('assessment_count') + delta)
+        if not updated:
+            return None
+        new_count = CustomUser.objects.filter(pk=user_id).values_list('assessment_count', flat=True).get()
+        _add_to_bucket(new_count - delta, -1)
+        _add_to_bucket(new_count, 1)
+    return new_count
+
+
+def add_user(assessment_count=0):
+    _add_to_bucket(assessment_count, 1)
+
+
+def remove_user(assessment_count):
+    _add_to_bucket(assessment_count, -1)
+
+
+def get_rank(assessment_count):
+    """Returns (rank, total_users) for a user with `assessment_count` assessments."""
+    totals = AssessmentCountBucket.objects.aggregate(
+        higher=Coalesce(Sum('users', filter=Q(assessment_count__gt=assessment_count)), 0),
+        total=Coalesce(Sum('users'), 0),
+    )
+    return totals['higher'] + 1, totals['total']
+
+
+def reconcile():
+    """
+    Recomputes every user's assessment_count from the results table (plus
+    their archived results) and rebuilds the histogram. Returns the number of
+    users whose count was wrong.
+    """
+    from assessment.archive import archived_result_counts
+    from assessment.models import AssessmentResult
+
+    real_count = Coalesce(Subquery(
+        AssessmentResult.objects
+        .filter(user=OuterRef('pk'), is_draft=False)
+        .order_by()
+        .values('user')
+        .annotate(n=Count('pk'))
+        .values('n')
+    ), Value(0))
+
+    # Archived results still count; group users by how many they have, one UPDATE per group
+    archived = {}
+    for user_id, n in archived_result_counts().items():
+        archived.setdefault(n, []).append(user_id)
+
+    with transaction.atomic():
+        if not archived:
+            drifted = (CustomUser.objects
+                       .annotate(real_count=real_count)
+                       .exclude(assessment_count=F('real_count')))
+            fixed = drifted.count()
+            if fixed:
+                CustomUser.objects.update(assessment_count=real_count)
+        else:
+            before = dict(CustomUser.objects.values_list('pk', 'assessment_count'))
+            CustomUser.objects.update(assessment_count=real_count)
+            for n, user_ids in archived.items():
+                for offset in range(0, len(user_ids), 1000):
+                    CustomUser.objects.filter(pk__in=user_ids[offset:offset + 1000]).update(assessment_count=F('assessment_count') + n)
+            fixed = sum(1 for pk, count in CustomUser.objects.values_list('pk', 'assessment_count') if before.get(pk) != count)
+
+        AssessmentCountBucket.objects.all().delete()
+        AssessmentCountBucket.objects.bulk_create([
+            AssessmentCountBucket(assessment_count=row['assessment_count'], users=row['users'])
+            for row in CustomUser.objects.order_by().values('assessment_count').annotate(users=Count('pk'))
+        ])
+    return fixed
@@ -0,0 +1,29 @@
+# account/signals.py
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from . import ranking
+from .models import CustomUser
+
+
+@receiver(post_save, sender=CustomUser)
+def add_user_to_rank(sender, instance, created, **kwargs):
+    if created:
+        ranking.add_user(instance.assessment_count)
+
+
+@receiver(pre_delete, sender=CustomUser)
+def remember_rank_bucket(sender, instance, using, **kwargs):
+    # The user's results are deleted next (cascade), each moving them one
+    # bucket down. Archived results are gone already and stay counted, so
+    # they end up in the bucket of their archived count, not necessarily 0
+    from assessment.models import AssessmentResult
+
+    count = CustomUser.objects.using(using).filter(pk=instance.pk).values_list('assessment_count', flat=True).first() or 0
+    live = AssessmentResult.objects.using(using).filter(user_id=instance.pk, is_draft=False).count()
+    instance._rank_bucket = max(count - live, 0)
+
+
+@receiver(post_delete, sender=CustomUser)
+def remove_user_from_rank(sender, instance, **kwargs):
+    ranking.remove_user(getattr(instance, '_rank_bucket', 0))
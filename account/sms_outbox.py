@@ -0,0 +1,159 @@
+# account/sms_outbox.py
+"""
+A database-backed outbox for text messages, the same way assessment/jobs.py
+queues AI analyses.
+
+Views only call `send_otp_sms`, which writes an SMSMessage row; the
+`run_sms_worker` management command delivers the rows with a pool of
+threads sharing one keep-alive HTTP session. Temporary gateway errors are
+retried with exponential backoff up to SMS_MAX_ATTEMPTS times.
+"""
+import logging
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import F
+from django.utils import timezone
+
+from core.metrics import timed
+
+from .models import SMSMessage
+from .sms_service import TEMPLATE_ID, SMSTemporaryError, get_provider
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue_sms(phone_number, template_id, parameters, expires_at=None):
+    message = SMSMessage.objects.create(
+        phone_number=phone_number, template_id=template_id, parameters=parameters, expires_at=expires_at,
+    )
+    if settings.SMS_QUEUE_EAGER:
+        # Local development and tests: no worker process needed
+        if _claim(message.pk):
+            message.refresh_from_db()
+            deliver(message)
+    return message
+
+
+def send_otp_sms(phone_number, code):
+    """Queues the OTP message. It isn't sent once the code has expired, nobody could use it anymore."""
+    return enqueue_sms(
+        phone_number, TEMPLATE_ID, {'CODE': code},
+        expires_at=timezone.now() + timedelta(seconds=settings.OTP_TTL),
+    )
+
+
+def _claim(message_pk):
+    """Compare-and-set pending -> sending, so two workers never send the same message."""
+    return SMSMessage.objects.filter(pk=message_pk, status=SMSMessage.STATUS_PENDING).update(
+        status=SMSMessage.STATUS_SENDING,
+        attempts=F('attempts') + 1,
+        next_attempt_at=timezone.now(),
+    ) == 1
+
+
+def claim_next_message():
+    """Returns the oldest message that is due, after marking it sending, or None."""
+    candidates = (SMSMessage.objects
+                  .filter(status=SMSMessage.STATUS_PENDING, next_attempt_at__lte=timezone.now())
+                  .order_by('next_attempt_at')
+                  .values_list('pk', flat=True)[:10])
+
+    for message_pk in candidates:
+        if _claim(message_pk):
+            return SMSMessage.objects.get(pk=message_pk)
+    return None
+
+
+def _retry_delay(attempts):
+    return min(settings.SMS_RETRY_BASE_DELAY * 2 ** (attempts - 1), settings.SMS_RETRY_MAX_DELAY)
+
+
+def deliver(message):
+    """Sends one claimed message and records the outcome."""
+    now = timezone.now()
+    if message.expires_at and message.expires_at <= now:
+        message.status = SMSMessage.STATUS_FAILED
+        message.error = message.error or 'Expired before it could be sent.'
+    else:
+        try:
+            provider = get_provider()
+            with timed('sms', provider.name):
+                message.provider_message_id = provider.send(message.phone_number, message.template_id, message.parameters)
+        except SMSTemporaryError as e:
+            logger.warning("SMS %s to %s failed (attempt %s): %s", message.pk, message.phone_number, message.attempts, e)
+            message.error = str(e)
+            if message.attempts < settings.SMS_MAX_ATTEMPTS:
+                message.status = SMSMessage.STATUS_PENDING
+                message.next_attempt_at = now + timedelta(seconds=_retry_delay(message.attempts))
+            else:
+                message.status = SMSMessage.STATUS_FAILED
+        except Exception as e:
+            logger.exception("SMS %s to %s failed", message.pk, message.phone_number)
+            message.error = str(e)
+            message.status = SMSMessage.STATUS_FAILED
+        else:
+            message.status = SMSMessage.STATUS_SENT
+            message.error = ''
+            message.sent_at = timezone.now()
+
+    if message.status != SMSMessage.STATUS_PENDING:
+        message.parameters = {}  # Don't keep codes around once they are no use
+    message.save(update_fields=['status', 'error', 'provider_message_id', 'parameters', 'next_attempt_at', 'sent_at'])
+    return message
+
+
+def requeue_stale_messages():
+    """Puts messages back in the outbox whose worker died while sending them."""
+    cutoff = timezone.now() - timedelta(seconds=settings.SMS_SEND_TIMEOUT)
+    return SMSMessage.objects.filter(
+        status=SMSMessage.STATUS_SENDING, next_attempt_at__lt=cutoff
+    ).update(status=SMSMessage.STATUS_PENDING)
+
+
+def _worker_loop(stop_event, poll_interval):
+    while not stop_event.is_set():
+        try:
+            close_old_connections()
+            message = claim_next_message()
+            if message is None:
+                stop_event.wait(poll_interval)
+                continue
+            deliver(message)
+        except Exception:
+            # A lost connection or a lock timeout mustn't end the thread; a message
+            # left "sending" is requeued by requeue_stale_messages
+            logger.exception("SMS worker error")
+            close_old_connections()
+            stop_event.wait(poll_interval)
+    close_old_connections()
+
+
+def run_workers(concurrency=None, poll_interval=None, stop_event=None):
+    """
+    Starts `concurrency` sender threads and blocks until `stop_event` is set.
+    They share the provider's HTTP connection pool (SMS_POOL_SIZE).
+    """
+    concurrency = concurrency or settings.SMS_WORKER_CONCURRENCY
+    poll_interval = poll_interval or settings.SMS_WORKER_POLL_INTERVAL
+    stop_event = stop_event or threading.Event()
+
+    requeue_stale_messages()
+
+    threads = [
+        threading.Thread(target=_worker_loop, args=(stop_event, poll_interval), name=f"sms-worker-{i}", daemon=True)
+        for i in range(concurrency)
+    ]
+    for thread in threads:
+        thread.start()
+
+    try:
+        while not stop_event.is_set():
+            stop_event.wait(settings.SMS_SEND_TIMEOUT)
+            requeue_stale_messages()
+    finally:
+        stop_event.set()
+        for thread in threads:
+            thread.join()
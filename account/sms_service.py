@@ -1,7 +1,21 @@
 # accounts/sms_service.py
+"""
+SMS gateways. Views don't call these directly: they put messages in the
+outbox and the run_sms_worker command delivers them (see
+account/sms_outbox.py), so a slow gateway never holds up a login.
+
+SMS_BACKEND picks the provider: 'smsir' sends real messages through the
+sms.ir verification API, 'fake' only records and logs them.
+"""
+import itertools
+import logging
+import threading
+from collections import deque
+
 import requests
-import json
 from decouple import config
+from django.conf import settings
+from requests.adapters import HTTPAdapter
 
 # 1. Load your secret credentials from the .env file
 API_KEY = config('SMS_IR_API_KEY')
@@ -10,39 +24,96 @@ TEMPLATE_ID = config('SMS_IR_TEMPLATE_ID')
 # 2. Define the API endpoint
 API_URL = "https://api.sms.ir/v1/send/verify"
 
-def send_otp_sms(phone_number, code):
+logger = logging.getLogger(__name__)
+
+
+class SMSError(Exception):
+    """The gateway refused the message; sending it again won't help."""
+
+
+class SMSTemporaryError(SMSError):
+    """Timeout, connection problem, rate limit or server error; worth retrying."""
+
+
+class SmsIrProvider:
+    name = 'smsir'
+
+    def __init__(self):
+        # One session per process: connections to sms.ir are kept alive and reused
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=settings.SMS_POOL_SIZE, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.headers.update({
+            'Content-Type': 'application/json',
+            'Accept': 'text/plain',
+            'x-api-key': API_KEY,
+        })
+
+    def send(self, phone_number, template_id, parameters):
+        """Sends one templated message and returns the gateway's message id."""
+        # This structure matches the API documentation.
+        payload = {
+            "mobile": phone_number,
+            "templateId": template_id,
+            # The parameter names must match what you defined in your sms.ir template
+            "parameters": [{"name": name, "value": value} for name, value in parameters.items()],
+        }
+        try:
+            response = self.session.post(
+                API_URL, json=payload, timeout=(settings.SMS_CONNECT_TIMEOUT, settings.SMS_READ_TIMEOUT)
+            )
+        except requests.RequestException as e:
+            raise SMSTemporaryError(f"{type(e).__name__}: {e}") from e
+
+        if response.status_code == 429 or response.status_code >= 500:
+            raise SMSTemporaryError(f"HTTP {response.status_code}: {response.text[:200]}")
+        if response.status_code != 200:
+            raise SMSError(f"HTTP {response.status_code}: {response.text[:200]}")
+        try:
+            body = response.json()
+        except ValueError:
+            raise SMSError(f"Unexpected response: {response.text[:200]}")
+        if body.get('status') != 1:
+            raise SMSError(f"sms.ir status {body.get('status')}: {body.get('message')}")
+        return str((body.get('data') or {}).get('messageId', ''))
+
+
+class FakeProvider:
     """
-    Sends a real OTP SMS using the sms.ir verification API.
+    Sends nothing; keeps the last SMS_FAKE_KEEP messages in `sent`
+    (development, tests, load tests) and logs each one at INFO.
     """
-    # 3. Prepare the data payload dynamically
-    # This structure matches the API documentation.
-    payload = {
-        "mobile": phone_number,
-        "templateId": TEMPLATE_ID,
-        "parameters": [
-            {
-                "name": "CODE",  # The parameter name must match what you defined in your sms.ir template
-                "value": code
-            }
-        ]
-    }
-
-    # 4. Prepare the required headers
-    headers = {
-        'Content-Type': 'application/json',
-        'Accept': 'text/plain',
-        'x-api-key': API_KEY
-    }
-
-    try:
-        # 5. Make the API call using the 'requests' library
-        response = requests.post(API_URL, json=payload, headers=headers)
-
-        # 6. Check for errors and log the response for debugging
-        if response.status_code == 200:
-            print(f"Successfully sent OTP to {phone_number}. Response: {response.text}")
-        else:
-            print(f"Error sending OTP to {phone_number}. Status: {response.status_code}, Response: {response.text}")
-    
-    except Exception as e:
-        print(f"An exception occurred while trying to send SMS: {e}")
\ No newline at end of file
+    name = 'fake'
+
+    def __init__(self):
+        self.sent = deque(maxlen=settings.SMS_FAKE_KEEP)
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def send(self, phone_number, template_id, parameters):
+        with self._lock:
+            self.sent.append({'phone_number': phone_number, 'template_id': template_id, 'parameters': parameters})
+            message_id = f'fake-{next(self._ids)}'
+        logger.info("Fake SMS %s to %s: %s", message_id, phone_number, parameters)
+        return message_id
+
+
+PROVIDERS = {
+    SmsIrProvider.name: SmsIrProvider,
+    FakeProvider.name: FakeProvider,
+}
+
+_instances = {}
+_instances_lock = threading.Lock()
+
+
+def get_provider(name=None):
+    """Returns the (process-wide) SMS provider called `name`, by default SMS_BACKEND."""
+    name = name or settings.SMS_BACKEND
+    with _instances_lock:
+        if name not in _instances:
+            if name not in PROVIDERS:
+                raise ValueError(f"Unknown SMS backend '{name}', expected one of {sorted(PROVIDERS)}")
+            _instances[name] = PROVIDERS[name]()
+        return _instances[name]
+
@@ -1,3 +1,295 @@
-from django.test import TestCase
+# account/tests.py
+import tempfile
+import threading
+from datetime import timedelta
+from io import StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.contrib.sessions.backends.db import SessionStore
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import OperationalError, connection
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from assessment.tests import PERF_SEED_SIZE, QUERY_PLAN_SEED_SIZE, Endpoint, EndpointBudgetMixin, QueryPlanAssertions, seed_perf_fixtures
+from assessment.models import AssessmentResult, Test
+from . import ranking, sms_outbox, sms_service
+from .models import OTP, AssessmentCountBucket, CustomUser, PromoCode, SMSMessage
+from .otp import OTPAttemptsExceededError, OTPCooldownError, get_store
+from .sms_outbox import claim_next_message, deliver, send_otp_sms
+
+
+@skipUnless(connection.vendor in ('sqlite', 'postgresql'), "Query plans are only checked on SQLite and PostgreSQL.")
+class OTPIndexTests(QueryPlanAssertions, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        phone_count = max(QUERY_PLAN_SEED_SIZE // 10, 10)
+        OTP.objects.bulk_create([
+            OTP(phone_number=f'09{i % phone_count:09d}', code=f'{i % 1000000:06d}') for i in range(QUERY_PLAN_SEED_SIZE)
+        ])
+        cls.analyze()
+
+    def test_latest_code_of_phone_number(self):
+        # The database OTP store
+        queryset = OTP.objects.filter(phone_number='09000000007').order_by('-created_at')[:1]
+        self.assertUsesIndex(queryset, 'account_otp', 'otp_phone_created_idx')
+
+
+@override_settings(OTP_STORE='cache', OTP_RESEND_COOLDOWN=0, SMS_BACKEND='fake', SMS_QUEUE_EAGER=False)
+class AccountEndpointBudgetTests(EndpointBudgetMixin, TestCase):
+    endpoints = [
+        # Codes live in the cache (OTP_STORE=cache); the only write is the SMS outbox row
+        Endpoint('api_request_otp', 'post', '/api/request-otp/', max_queries=1,
+                 data={'phone_number': '09121111111'}, login=None),
+        Endpoint('api_verify_otp', 'post', '/api/verify-otp/', max_queries=9,
+                 data={'phone_number': '09121111111', 'code': '123456', 'full_name': 'New User'}, login=None, before=lambda t: t.new_otp()),
+        Endpoint('api_profile_get', 'get', '/api/profile/', max_queries=2),
+        Endpoint('api_profile_post', 'post', '/api/profile/', max_queries=3,
+                 data={'full_name': 'Perf User', 'address': 'Tehran', 'age': '30', 'about_me': ''}),
+        Endpoint('logout', 'get', '/logout/', max_queries=4, status=302),
+        Endpoint('api_redeem_code', 'post', '/api/redeem-code/', max_queries=3, data={'code': 'KAFNA_VIP'}),
+        Endpoint('api_user_rank', 'get', '/api/user-rank/', max_queries=3),
+        Endpoint('api_request_payment', 'post', '/api/request-payment/', max_queries=3, data={'amount': 100000}),
+        Endpoint('api_validate_promo_code', 'post', '/api/validate-promo-code/', max_queries=3,
+                 data={'code': 'PERF', 'base_price': 100000}),
+        # Used to run one COUNT per row for the assessments column
+        Endpoint('admin_customuser_changelist', 'get', '/admin/account/customuser/', max_queries=6,
+                 login='admin'),
+    ]
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user, _ = seed_perf_fixtures(PERF_SEED_SIZE)
+        cls.admin = CustomUser.objects.create_superuser(phone_number='09129999999', password='x')
+        PromoCode.objects.create(code='PERF', discount_percentage=10)
+
+    def new_otp(self):
+        get_store().issue('09121111111', code='123456')
+
+
+@override_settings(OTP_TTL=60, OTP_MAX_ATTEMPTS=3, OTP_RESEND_COOLDOWN=30)
+class OTPStoreTests(TestCase):
+    phone_number = '09121111111'
+
+    def setUp(self):
+        cache.clear()
+
+    def check_store(self, store):
+        code = store.issue(self.phone_number)
+        with self.assertRaises(OTPCooldownError):
+            store.issue(self.phone_number)
+
+        self.assertFalse(store.verify(self.phone_number, '000000' if code != '000000' else '111111'))
+        self.assertTrue(store.verify(self.phone_number, code))
+        # Single use
+        self.assertFalse(store.verify(self.phone_number, code))
+
+        with override_settings(OTP_RESEND_COOLDOWN=0):
+            code = store.issue(self.phone_number)
+        for _ in range(3):
+            self.assertFalse(store.verify(self.phone_number, 'wrong!'))
+        with self.assertRaises(OTPAttemptsExceededError):
+            store.verify(self.phone_number, code)
+        self.assertIsNone(store.peek(self.phone_number))
+
+    def test_cache_store(self):
+        self.check_store(get_store('cache'))
+        self.assertFalse(OTP.objects.exists())
+
+    def test_db_store(self):
+        self.check_store(get_store('db'))
+
+    def test_db_store_counts_attempts_atomically(self):
+        store = get_store('db')
+        code = store.issue(self.phone_number)
+        stale = OTP.objects.get()
+        # Other requests used up the attempts after this one read the row
+        OTP.objects.update(attempts=3)
+        with mock.patch.object(store, '_current', return_value=stale):
+            with self.assertRaises(OTPAttemptsExceededError):
+                store.verify(self.phone_number, code)
+        self.assertFalse(OTP.objects.exists())
+
+    def test_db_store_codes_expire(self):
+        store = get_store('db')
+        code = store.issue(self.phone_number)
+        OTP.objects.update(created_at=timezone.now() - timedelta(seconds=61))
+        self.assertFalse(store.verify(self.phone_number, code))
+
+    def test_request_otp_cooldown(self):
+        with mock.patch('account.views.send_otp_sms') as send:
+            first = self.client.post('/api/request-otp/', {'phone_number': self.phone_number}, content_type='application/json')
+            second = self.client.post('/api/request-otp/', {'phone_number': self.phone_number}, content_type='application/json')
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(second.status_code, 429)
+        self.assertEqual(send.call_count, 1)
+
+
+@override_settings(SMS_BACKEND='fake', SMS_QUEUE_EAGER=False, SMS_MAX_ATTEMPTS=2, SMS_RETRY_BASE_DELAY=10, OTP_TTL=120)
+class SMSOutboxTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.provider = sms_service.get_provider('fake')
+        self.provider.sent.clear()
+
+    def test_request_otp_only_queues_the_message(self):
+        response = self.client.post('/api/request-otp/', {'phone_number': '09121111111'}, content_type='application/json')
+
+        self.assertEqual(response.status_code, 200)
+        message = SMSMessage.objects.get()
+        self.assertEqual(message.status, SMSMessage.STATUS_PENDING)
+        self.assertEqual(message.parameters, {'CODE': get_store().peek('09121111111')})
+        self.assertEqual(list(self.provider.sent), [])
+
+    def test_worker_delivers_and_forgets_the_code(self):
+        send_otp_sms('09121111111', '123456')
+        message = deliver(claim_next_message())
+
+        self.assertEqual(message.status, SMSMessage.STATUS_SENT)
+        self.assertEqual(self.provider.sent[0]['parameters'], {'CODE': '123456'})
+        self.assertEqual(SMSMessage.objects.get().parameters, {})
+        self.assertIsNone(claim_next_message())
+
+    def test_temporary_errors_are_retried_then_given_up(self):
+        send_otp_sms('09121111111', '123456')
+        with mock.patch.object(self.provider, 'send', side_effect=sms_service.SMSTemporaryError('timeout')):
+            message = deliver(claim_next_message())
+            self.assertEqual(message.status, SMSMessage.STATUS_PENDING)
+            # Backed off: not due yet
+            self.assertIsNone(claim_next_message())
+
+            SMSMessage.objects.update(next_attempt_at=timezone.now())
+            message = deliver(claim_next_message())
+        self.assertEqual(message.status, SMSMessage.STATUS_FAILED)
+        self.assertEqual(message.attempts, 2)
+
+    def test_expired_codes_are_not_sent(self):
+        send_otp_sms('09121111111', '123456')
+        SMSMessage.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+
+        message = deliver(claim_next_message())
+        self.assertEqual(message.status, SMSMessage.STATUS_FAILED)
+        self.assertEqual(list(self.provider.sent), [])
+
+    def test_worker_survives_database_errors(self):
+        stop = threading.Event()
+        message = send_otp_sms('09121111111', '123456')
+
+        def claim():
+            if not claim.calls:
+                claim.calls += 1
+                raise OperationalError('database is locked')
+            stop.set()
+            return message
+        claim.calls = 0
+
+        with mock.patch.object(sms_outbox, 'claim_next_message', claim), \
+                mock.patch.object(sms_outbox, 'deliver') as deliver_message, \
+                mock.patch.object(sms_outbox, 'close_old_connections'), self.assertLogs('account.sms_outbox', 'ERROR'):
+            sms_outbox._worker_loop(stop, poll_interval=0)
+        deliver_message.assert_called_once_with(message)
+
+    @override_settings(SMS_FAKE_KEEP=2)
+    def test_fake_provider_keeps_only_the_last_messages(self):
+        provider = sms_service.FakeProvider()
+        with self.assertLogs('account.sms_service', 'INFO'):
+            ids = [provider.send('09121111111', 1, {'CODE': code}) for code in ('1', '2', '3')]
+
+        self.assertEqual(ids, ['fake-1', 'fake-2', 'fake-3'])
+        self.assertEqual([message['parameters'] for message in provider.sent], [{'CODE': '2'}, {'CODE': '3'}])
+
+
+class SessionTests(TestCase):
+    @override_settings(SESSION_ENGINE='django.contrib.sessions.backends.cached_db')
+    def test_cached_db_sessions_skip_the_database(self):
+        user = CustomUser.objects.create_user(phone_number='09121111111')
+        self.client.force_login(user)
+
+        # Only the user itself is loaded
+        with self.assertNumQueries(1):
+            self.client.get('/api/profile/')
+
+    def test_purge_sessions_deletes_only_expired_ones_in_batches(self):
+        for i in range(5):
+            store = SessionStore()
+            store.set_expiry(-60 if i < 3 else 60)
+            store.create()
+
+        call_command('purge_sessions', batch_size=2, stdout=StringIO())
+        self.assertEqual(Session.objects.count(), 2)
+        self.assertFalse(Session.objects.filter(expire_date__lt=timezone.now()).exists())
+
+
+class RankingTests(TestCase):
+    def setUp(self):
+        archive_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(archive_dir.cleanup)
+        archive_settings = override_settings(RESULTS_ARCHIVE_DIR=archive_dir.name)
+        archive_settings.enable()
+        self.addCleanup(archive_settings.disable)
+
+        self.test = Test.objects.create(name='Test', questions=[])
+        self.users = [CustomUser.objects.create_user(phone_number=f'0912111111{i}') for i in range(3)]
+
+    def buckets(self):
+        return dict(AssessmentCountBucket.objects.filter(users__gt=0).values_list('assessment_count', 'users'))
+
+    def submit(self, user, **kwargs):
+        return AssessmentResult.objects.create(user=user, test=self.test, answers={}, **kwargs)
+
+    def test_results_move_users_between_buckets(self):
+        self.assertEqual(self.buckets(), {0: 3})
+
+        first = self.submit(self.users[0])
+        self.submit(self.users[0])
+        self.submit(self.users[1])
+        self.submit(self.users[2], is_draft=True)
+        self.assertEqual(self.buckets(), {0: 1, 1: 1, 2: 1})
+        self.assertEqual(ranking.get_rank(2), (1, 3))
+        self.assertEqual(ranking.get_rank(1), (2, 3))
+        self.assertEqual(ranking.get_rank(0), (3, 3))
+
+        first.delete()
+        self.assertEqual(self.buckets(), {0: 1, 1: 2})
+        self.users[0].refresh_from_db()
+        self.assertEqual(self.users[0].assessment_count, 1)
+
+    def test_deleting_a_user_empties_their_bucket(self):
+        self.submit(self.users[0])
+        CustomUser.objects.get(pk=self.users[0].pk).delete()
+        self.assertEqual(self.buckets(), {0: 2})
+
+    def test_deleting_a_user_with_archived_results(self):
+        self.submit(self.users[0])
+        with mock.patch('assessment.archive.archived_result_counts', return_value={self.users[0].pk: 3}):
+            ranking.reconcile()
+        self.assertEqual(self.buckets(), {0: 2, 4: 1})
+
+        CustomUser.objects.get(pk=self.users[0].pk).delete()
+        self.assertEqual(self.buckets(), {0: 2})
+
+    def test_change_assessment_count_of_a_missing_user(self):
+        self.assertIsNone(ranking.change_assessment_count(0, 1))
+        self.assertEqual(self.buckets(), {0: 3})
+
+    def test_reconcile_repairs_counts_and_buckets(self):
+        # bulk_create skips the signals
+        AssessmentResult.objects.bulk_create([AssessmentResult(user=self.users[0], test=self.test, answers={})] * 2)
+        self.submit(self.users[1])
+        CustomUser.objects.filter(pk=self.users[2].pk).update(assessment_count=5)
+
+        self.assertEqual(ranking.reconcile(), 2)
+        self.assertEqual(dict(CustomUser.objects.values_list('pk', 'assessment_count')),
+                         {self.users[0].pk: 2, self.users[1].pk: 1, self.users[2].pk: 0})
+        self.assertEqual(self.buckets(), {0: 1, 1: 1, 2: 1})
+        self.assertEqual(ranking.reconcile(), 0)
+
+    def test_reconcile_counts_archived_results(self):
+        self.submit(self.users[0])
+        with mock.patch('assessment.archive.archived_result_counts', return_value={self.users[0].pk: 3, self.users[1].pk: 1}):
+            self.assertEqual(ranking.reconcile(), 2)
+        self.assertEqual(dict(CustomUser.objects.values_list('pk', 'assessment_count')),
+                         {self.users[0].pk: 4, self.users[1].pk: 1, self.users[2].pk: 0})
+        self.assertEqual(self.buckets(), {0: 1, 1: 1, 4: 1})
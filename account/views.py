@@ -1,24 +1,24 @@
 import re
 from django.shortcuts import render
 import json
-import random
 from django.http import JsonResponse
 from django.contrib.auth import login
-from .models import CustomUser, OTP, PromoCode
-from .sms_service import send_otp_sms
+from .models import CustomUser, PromoCode
+from .otp import OTPAttemptsExceededError, OTPCooldownError, get_store
+from .sms_outbox import send_otp_sms
+from .ranking import get_rank
 from django.contrib.auth.decorators import login_required
+from core.db_router import use_replica
 from django.views.decorators.http import require_http_methods
 from django.contrib.auth import logout
 from django.shortcuts import redirect
-from django.db.models import Count, F
-from django.db.models.functions import Coalesce
-from pyexpat.errors import messages
+from django.contrib import messages
 
 
 def request_otp_view(request):
     """
-    Receives a phone number, generates an OTP, saves it,
-    and "sends" it via our mock SMS service.
+    Receives a phone number, generates an OTP, saves it in the OTP store
+    and sends it by SMS. At most one code per OTP_RESEND_COOLDOWN.
     """
     if request.method == 'POST':
         data = json.loads(request.body)
@@ -30,8 +30,12 @@ def request_otp_view(request):
         if not re.match(r'^09\d{9}$', phone_number):
             return JsonResponse({'status': 'error', 'message': 'Invalid phone number format.'}, status=400)
         
-        code = str(random.randint(100000, 999999))
-        OTP.objects.create(phone_number=phone_number, code=code)
+        try:
+            code = get_store().issue(phone_number)
+        except OTPCooldownError as e:
+            response = JsonResponse({'status': 'error', 'message': str(e), 'retry_after': e.retry_after}, status=429)
+            response['Retry-After'] = str(e.retry_after)
+            return response
         send_otp_sms(phone_number, code)
 
         return JsonResponse({'status': 'success', 'message': 'OTP sent successfully.'})
@@ -48,16 +52,18 @@ def verify_otp_view(request):
         if not phone_number or not code or not full_name: # Changed
             return JsonResponse({'status': 'error', 'message': 'All fields are required.'}, status=400)
 
-        otp_entry = OTP.objects.filter(phone_number=phone_number).order_by('-created_at').first()
+        try:
+            valid = get_store().verify(phone_number, code)
+        except OTPAttemptsExceededError:
+            return JsonResponse({'status': 'error', 'message': 'Too many wrong codes. Please request a new code.'}, status=429)
 
-        if otp_entry and otp_entry.code == code:
+        if valid:
             user, created = CustomUser.objects.get_or_create(phone_number=phone_number)
             if created:
                 user.full_name = full_name # Changed
                 user.save()
             
             login(request, user)
-            otp_entry.delete()
             
             request.session['just_logged_in'] = True
              
@@ -158,36 +164,20 @@ def redeem_code_view(request):
 
 
 @login_required
+@use_replica
 def get_user_rank_api(request):
     """
     Calculates the rank of the current user based on the number of assessments taken.
     """
-    user = request.user
-    
-    # 1. Annotate all users with the count of their assessments
-    # 'Coalesce' ensures that users with zero assessments are counted as 0 instead of None
-    all_users_with_counts = CustomUser.objects.annotate(
-        assessment_count=Coalesce(Count('assessments'), 0)
-    )
-    
-    # 2. Get the current user's assessment count
-    try:
-        current_user_data = all_users_with_counts.get(pk=user.pk)
-        current_user_assessment_count = current_user_data.assessment_count
-    except CustomUser.DoesNotExist:
-        return JsonResponse({'status': 'error', 'message': 'User not found.'}, status=404)
-
-    # 3. Calculate the rank by counting how many users have MORE assessments
-    rank = all_users_with_counts.filter(assessment_count__gt=current_user_assessment_count).count() + 1
-    
-    # Get the total number of users for context
-    total_users = all_users_with_counts.count()
+    # request.user is loaded fresh on every request, so its denormalized count is current
+    assessment_count = request.user.assessment_count
+    rank, total_users = get_rank(assessment_count)
 
     return JsonResponse({
         'status': 'success',
         'rank': rank,
         'total_users': total_users,
-        'assessment_count': current_user_assessment_count,
+        'assessment_count': assessment_count,
     })
     
     
@@ -1,6 +1,11 @@
 # assessment/admin.py
+from django.conf import settings
 from django.contrib import admin
-from .models import Job, Test, AssessmentResult
+from django.core.exceptions import PermissionDenied
+from django.template.response import TemplateResponse
+from django.urls import path
+from .models import Job, Test, TestVersion, AssessmentResult, AnalysisJob, AnalysisUsage
+from .usage import usage_report
 from django.utils.html import format_html
 import json
 
@@ -9,18 +14,31 @@ class JobAdmin(admin.ModelAdmin):
     list_display = ('name', 'description')
     search_fields = ('name',)
 
+class TestVersionInline(admin.TabularInline):
+    # Versions are snapshots made by Test.save(); results point to them, so they stay read-only
+    model = TestVersion
+    fields = ('number', 'created_at', 'content_hash')
+    readonly_fields = fields
+    extra = 0
+    can_delete = False
+    show_change_link = False
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
 @admin.register(Test)
 class TestAdmin(admin.ModelAdmin):
     list_display = ('name', 'is_primary_assessment', 'related_job', 'order')
     list_filter = ('is_primary_assessment', 'related_job')
     search_fields = ('name',)
     ordering = ('order',)
+    inlines = [TestVersionInline]
 
 @admin.register(AssessmentResult)
 class AssessmentResultAdmin(admin.ModelAdmin):
     list_display = ('get_user_display', 'test', 'created_at', 'has_ai_analysis')
     list_filter = ('test', 'user')
-    readonly_fields = ('user', 'test', 'pretty_answers', 'pretty_ai_analysis', 'created_at')
+    readonly_fields = ('user', 'test', 'test_version', 'pretty_answers', 'pretty_ai_analysis', 'created_at')
     exclude = ('answers', 'ai_analysis')
 
     def get_user_display(self, obj):
@@ -33,7 +51,7 @@ class AssessmentResultAdmin(admin.ModelAdmin):
     get_user_display.short_description = 'User'
 
     def pretty_answers(self, instance):
-        data = instance.answers
+        data = instance.rich_answers
         pretty = json.dumps(data, indent=4, ensure_ascii=False)
         return format_html('<pre>{}</pre>', pretty)
     pretty_answers.short_description = 'User Answers'
@@ -48,4 +66,50 @@ class AssessmentResultAdmin(admin.ModelAdmin):
     def has_ai_analysis(self, obj):
         return bool(obj.ai_analysis)
     has_ai_analysis.boolean = True
-    has_ai_analysis.short_description = 'Has Analysis'
\ No newline at end of file
+    has_ai_analysis.short_description = 'Has Analysis'
+
+
+@admin.register(AnalysisJob)
+class AnalysisJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'result', 'status', 'attempts', 'created_at', 'finished_at')
+    list_filter = ('status',)
+    list_select_related = ('result__user', 'result__test')
+    readonly_fields = ('result', 'attempts', 'error', 'created_at', 'started_at', 'finished_at')
+
+
+@admin.register(AnalysisUsage)
+class AnalysisUsageAdmin(admin.ModelAdmin):
+    # Written by the analysis code only; the report is at report/
+    list_display = ('created_at', 'test', 'model_name', 'latency_ms', 'prompt_tokens', 'completion_tokens',
+                    'retries', 'cache_hit', 'succeeded', 'cost')
+    list_filter = ('test', 'model_name', 'cache_hit', 'succeeded', 'streamed', 'hedged')
+    list_select_related = ('test',)
+    date_hierarchy = 'created_at'
+    report_days = (1, 7, 30, 90)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def get_urls(self):
+        report = path('report/', self.admin_site.admin_view(self.report_view), name='assessment_analysisusage_report')
+        return [report, *super().get_urls()]
+
+    def report_view(self, request):
+        if not self.has_view_permission(request):
+            raise PermissionDenied
+        try:
+            days = int(request.GET['days'])
+        except (KeyError, ValueError):
+            days = None
+        context = {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'title': 'AI latency and tokens per test',
+            'days': days or settings.AI_USAGE_REPORT_DAYS,
+            'day_options': self.report_days,
+            'rows': usage_report(days),
+        }
+        return TemplateResponse(request, 'admin/assessment/analysisusage/report.html', context)
@@ -1,10 +1,21 @@
 # assessment/ai_processor.py
-import google.generativeai as genai
 import json
-from decouple import config
+import logging
+import time
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from core.metrics import timed
+from .ai_cache import make_cache_key, get_cached_analysis, store_analysis, record_bypass
+from .providers import Usage, get_provider, get_hedge_provider
+from .resilience import AIAnalysisError, ahedged_call, hedged_call
 
-# 1. Configure the Google AI client with your secret key
-genai.configure(api_key=config('GOOGLE_API_KEY'))
+logger = logging.getLogger(__name__)
+
+# 1. The provider (Gemini, OpenAI-compatible or the local stub) is chosen
+# with the AI_PROVIDER setting, see assessment/providers.py
+
+# Older versions of get_ai_analysis saved this placeholder type when the AI call failed
+AI_ERROR_TYPE = "خطا"
 
 # 2. Define the structure of our AI's brain (the System Prompt)
 # This is almost identical to the OpenAI version.
@@ -31,40 +42,288 @@ genai.configure(api_key=config('GOOGLE_API_KEY'))
 # }
 # """
 
-def get_ai_analysis(rich_answers_data, system_prompt):
+def simplify_answers(rich_answers_data):
+    """
+    Extracts just the ID and Answer for the AI.
+    The AI already knows the questions from the System Prompt.
+    """
+    # Handle cases where data might be old format vs new format
+    if 'responses' in rich_answers_data:
+        return {item['question_id']: item['answer'] for item in rich_answers_data['responses']}
+    # Fallback for old data format
+    return rich_answers_data
+
+def is_failed_analysis(analysis):
+    """True for the error placeholder that older versions saved instead of a real analysis."""
+    return isinstance(analysis, dict) and (analysis.get('mbti') or {}).get('type') == AI_ERROR_TYPE
+
+def _lookup_cache(system_prompt, model_name, simple_answers, use_cache):
+    """Returns (cache_key, cached_analysis). The key is None when the cache is bypassed."""
+    if not (use_cache and settings.AI_CACHE_ENABLED):
+        record_bypass()
+        return None, None
+    cache_key = make_cache_key(system_prompt, model_name, simple_answers)
+    return cache_key, get_cached_analysis(cache_key)
+
+def _build_user_message(simple_answers):
+    answers_json_string = json.dumps(simple_answers, indent=2, ensure_ascii=False)
+    return f"Analyze the following user answers:\n\n{answers_json_string}"
+
+def parse_ai_response(text):
+    return json.loads(text.strip().replace('```json', '').replace('```', ''))
+
+class AICallStats:
+    """
+    What one get_ai_analysis / stream_ai_analysis call took: pass one in as
+    `stats` and it is filled in, also when the call fails. Token counts stay
+    None when the provider didn't report them (and for cache hits).
+    """
+
+    def __init__(self, provider='', model_name=''):
+        self.provider = provider
+        self.model_name = model_name
+        self.latency = 0.0  # seconds, including retries and the cache lookup
+        self.prompt_tokens = None
+        self.completion_tokens = None
+        self.retries = 0
+        self.cache_hit = False
+        self.streamed = False
+        self.succeeded = False
+        self.sent = False  # a request actually went out
+        # Hedged requests that were sent (and paid for) but didn't answer
+        self.unused_calls = []
+
+    @property
+    def hedged(self):
+        return bool(self.unused_calls)
+
+    def record_completion(self, usage):
+        if usage:
+            self.prompt_tokens, self.completion_tokens = usage.prompt_tokens, usage.completion_tokens
+
+    def take_provider_call(self, call, *raced):
+        """
+        Copies what the provider call that answered (or failed) reported.
+        `raced` are all the calls of a hedged race; the other ones that were
+        sent are kept in unused_calls. Their token counts may still be
+        missing: a losing sync request finishes in the background.
+        """
+        self.provider, self.model_name = call.provider, call.model_name
+        self.prompt_tokens, self.completion_tokens = call.prompt_tokens, call.completion_tokens
+        self.retries = call.retries
+        self.unused_calls = [other for other in raced if other is not None and other is not call and other.sent]
+
+
+def _counting_attempts(call, send):
+    """Wraps send(timeout) so every attempt after the first counts as a retry in `call`."""
+    attempts = 0
+
+    def attempt(timeout):
+        nonlocal attempts
+        call.sent = True
+        call.retries = attempts
+        attempts += 1
+        return send(timeout)
+    return attempt
+
+def _generate(provider, system_prompt, user_message, call):
+    """One guarded request to `provider`. Only a response that parses as JSON counts. Returns (analysis, call)."""
+    started = time.monotonic()
+    completion = provider.guard.call(_counting_attempts(call, lambda timeout: provider.generate(system_prompt, user_message, timeout)))
+    analysis = parse_ai_response(completion.text)
+    provider.latency.record(time.monotonic() - started)
+    call.record_completion(completion.usage)
+    return analysis, call
+
+async def _agenerate(provider, system_prompt, user_message, call):
+    started = time.monotonic()
+    completion = await provider.guard.acall(_counting_attempts(call, lambda timeout: provider.agenerate(system_prompt, user_message, timeout)))
+    analysis = parse_ai_response(completion.text)
+    provider.latency.record(time.monotonic() - started)
+    call.record_completion(completion.usage)
+    return analysis, call
+
+def hedge_delay(provider):
+    """How long to wait for `provider` before racing a hedged request: its p95, within bounds."""
+    p95 = provider.latency.percentile(settings.AI_HEDGE_PERCENTILE)
+    if p95 is None:
+        return settings.AI_HEDGE_DEFAULT_DELAY
+    return max(settings.AI_HEDGE_MIN_DELAY, p95)
+
+def retry_after():
+    """Seconds until some provider accepts requests again (0 if one is available now)."""
+    providers = [get_provider()]
+    hedge = get_hedge_provider()
+    if hedge:
+        providers.append(hedge)
+    return min(provider.guard.breaker.retry_after() for provider in providers)
+
+def get_ai_analysis(rich_answers_data, system_prompt, use_cache=True, stats=None):
     """
     Takes RICH data (questions + answers), converts to SIMPLE data for AI,
     and returns the analysis.
+    Identical (prompt, model, answers) requests are answered from the
+    analysis cache unless `use_cache` is False. With a hedge provider
+    configured, a second request is raced against a slow first one.
+    Pass an AICallStats as `stats` to learn what the call took.
+    Raises AIAnalysisError when no analysis could be produced.
     """
+    provider = get_provider()
+    hedge = get_hedge_provider()
+    stats = stats or AICallStats()
+    stats.provider, stats.model_name = provider.name, provider.model_name
+    started = time.monotonic()
     try:
-        # 1. Extract just the ID and Answer for the AI
-        # The AI already knows the questions from the System Prompt
-        simple_answers = {}
-        
-        # Handle cases where data might be old format vs new format
-        if 'responses' in rich_answers_data:
-            for item in rich_answers_data['responses']:
-                simple_answers[item['question_id']] = item['answer']
-        else:
-            # Fallback for old data format
-            simple_answers = rich_answers_data
-
-        model = genai.GenerativeModel(
-            model_name='gemini-2.5-flash',
-            system_instruction=system_prompt
-        )
-        
-        answers_json_string = json.dumps(simple_answers, indent=2, ensure_ascii=False)
-        user_message = f"Analyze the following user answers:\n\n{answers_json_string}"
-        
-        response = model.generate_content(user_message)
-        ai_response_text = response.text.strip().replace('```json', '').replace('```', '')
-        return json.loads(ai_response_text)
-
-    except Exception as e:
-        print(f"AI Error: {e}")
-        return {
-            "mbti": {"type": "خطا", "description": "عدم دریافت پاسخ از هوش مصنوعی"},
-            "recommended_jobs": [],
-            "development_path": []
-        }
\ No newline at end of file
+        simple_answers = simplify_answers(rich_answers_data)
+
+        # Cached under the primary model even when the hedge answered first
+        cache_key, cached = _lookup_cache(system_prompt, provider.model_name, simple_answers, use_cache)
+        if cached is not None:
+            stats.cache_hit = stats.succeeded = True
+            return cached
+
+        user_message = _build_user_message(simple_answers)
+        primary_call = AICallStats(provider.name, provider.model_name)
+        hedge_call = AICallStats(hedge.name, hedge.model_name) if hedge else None
+        try:
+            with timed('ai', provider.name):
+                if hedge:
+                    analysis, call = hedged_call(
+                        lambda: _generate(provider, system_prompt, user_message, primary_call),
+                        lambda: _generate(hedge, system_prompt, user_message, hedge_call),
+                        hedge_delay(provider),
+                    )
+                else:
+                    analysis, call = _generate(provider, system_prompt, user_message, primary_call)
+        except AIAnalysisError:
+            stats.take_provider_call(primary_call, hedge_call)
+            logger.exception("AI analysis failed")
+            raise
+        except Exception as e:
+            stats.take_provider_call(primary_call, hedge_call)
+            logger.exception("AI analysis failed")
+            raise AIAnalysisError(str(e)) from e
+        stats.take_provider_call(call, primary_call, hedge_call)
+        stats.succeeded = True
+
+        if cache_key:
+            store_analysis(cache_key, provider.model_name, analysis)
+        return analysis
+    finally:
+        stats.latency = time.monotonic() - started
+
+async def aget_ai_analysis(rich_answers_data, system_prompt, use_cache=True, stats=None):
+    """
+    get_ai_analysis for async callers: the provider call is awaited instead
+    of holding a thread for the whole round trip.
+    """
+    provider = get_provider()
+    hedge = get_hedge_provider()
+    stats = stats or AICallStats()
+    stats.provider, stats.model_name = provider.name, provider.model_name
+    started = time.monotonic()
+    try:
+        simple_answers = simplify_answers(rich_answers_data)
+
+        cache_key, cached = await sync_to_async(_lookup_cache)(system_prompt, provider.model_name, simple_answers, use_cache)
+        if cached is not None:
+            stats.cache_hit = stats.succeeded = True
+            return cached
+
+        user_message = _build_user_message(simple_answers)
+        primary_call = AICallStats(provider.name, provider.model_name)
+        hedge_call = AICallStats(hedge.name, hedge.model_name) if hedge else None
+        try:
+            with timed('ai', provider.name):
+                if hedge:
+                    analysis, call = await ahedged_call(
+                        lambda: _agenerate(provider, system_prompt, user_message, primary_call),
+                        lambda: _agenerate(hedge, system_prompt, user_message, hedge_call),
+                        hedge_delay(provider),
+                    )
+                else:
+                    analysis, call = await _agenerate(provider, system_prompt, user_message, primary_call)
+        except AIAnalysisError:
+            stats.take_provider_call(primary_call, hedge_call)
+            logger.exception("AI analysis failed")
+            raise
+        except Exception as e:
+            stats.take_provider_call(primary_call, hedge_call)
+            logger.exception("AI analysis failed")
+            raise AIAnalysisError(str(e)) from e
+        stats.take_provider_call(call, primary_call, hedge_call)
+        stats.succeeded = True
+
+        if cache_key:
+            await sync_to_async(store_analysis)(cache_key, provider.model_name, analysis)
+        return analysis
+    finally:
+        stats.latency = time.monotonic() - started
+
+def stream_ai_analysis(rich_answers_data, system_prompt, use_cache=True, stats=None):
+    """
+    Streaming variant of get_ai_analysis: yields the raw response text
+    chunk by chunk as the provider generates it. A cache hit is yielded as
+    a single chunk. Streams are neither hedged nor retried once started.
+    `stats` is complete once the generator is exhausted.
+    """
+    provider = get_provider()
+    stats = stats or AICallStats()
+    stats.provider, stats.model_name, stats.streamed = provider.name, provider.model_name, True
+    started = time.monotonic()
+    try:
+        simple_answers = simplify_answers(rich_answers_data)
+
+        cache_key, cached = _lookup_cache(system_prompt, provider.model_name, simple_answers, use_cache)
+        if cached is not None:
+            stats.cache_hit = stats.succeeded = True
+            yield json.dumps(cached, ensure_ascii=False)
+            return
+
+        user_message = _build_user_message(simple_answers)
+        chunks = []
+        with timed('ai', provider.name), provider.guard.single_attempt() as timeout:
+            for chunk in provider.stream(system_prompt, user_message, timeout):
+                if isinstance(chunk, Usage):
+                    stats.record_completion(chunk)
+                    continue
+                chunks.append(chunk)
+                yield chunk
+        stats.succeeded = True
+
+        if cache_key:
+            store_analysis(cache_key, provider.model_name, parse_ai_response(''.join(chunks)))
+    finally:
+        stats.latency = time.monotonic() - started
+
+async def astream_ai_analysis(rich_answers_data, system_prompt, use_cache=True, stats=None):
+    """stream_ai_analysis for async callers: an async generator of the response chunks."""
+    provider = get_provider()
+    stats = stats or AICallStats()
+    stats.provider, stats.model_name, stats.streamed = provider.name, provider.model_name, True
+    started = time.monotonic()
+    try:
+        simple_answers = simplify_answers(rich_answers_data)
+
+        cache_key, cached = await sync_to_async(_lookup_cache)(system_prompt, provider.model_name, simple_answers, use_cache)
+        if cached is not None:
+            stats.cache_hit = stats.succeeded = True
+            yield json.dumps(cached, ensure_ascii=False)
+            return
+
+        user_message = _build_user_message(simple_answers)
+        chunks = []
+        with timed('ai', provider.name):
+            async with provider.guard.asingle_attempt() as timeout:
+                async for chunk in provider.astream(system_prompt, user_message, timeout):
+                    if isinstance(chunk, Usage):
+                        stats.record_completion(chunk)
+                        continue
+                    chunks.append(chunk)
+                    yield chunk
+        stats.succeeded = True
+
+        if cache_key:
+            await sync_to_async(store_analysis)(cache_key, provider.model_name, parse_ai_response(''.join(chunks)))
+    finally:
+        stats.latency = time.monotonic() - started
@@ -0,0 +1,101 @@
+# assessment/ai_cache.py
+"""
+Persistent cache of AI analyses.
+
+Entries are content-addressed: the key is a SHA-256 of the test's system
+prompt, the model name and the canonicalized answers, so a retake with the
+same answers (or a double click) is answered from the database instead of
+paying for another Gemini call.
+
+The table is kept under AI_CACHE_MAX_ENTRIES by `prune`, which counts the
+whole table, so it runs on a sample of writes (AI_CACHE_PRUNE_RATE) and from
+the prune_analysis_cache command rather than on every one.
+"""
+import hashlib
+import json
+import random
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+
+from .models import AnalysisCacheEntry
+
+_stats_lock = threading.Lock()
+_stats = {'hits': 0, 'misses': 0, 'bypassed': 0}
+
+
+def _record(counter):
+    with _stats_lock:
+        _stats[counter] += 1
+
+
+def get_stats():
+    """Hit/miss/bypass counters of this process."""
+    with _stats_lock:
+        return dict(_stats)
+
+
+def record_bypass():
+    _record('bypassed')
+
+
+def _canonicalize(value):
+    if isinstance(value, dict):
+        return {str(k): _canonicalize(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_canonicalize(v) for v in value]
+    if isinstance(value, str):
+        # "  Yes " and "Yes" are the same answer to the AI
+        return ' '.join(value.split())
+    return value
+
+
+def make_cache_key(system_prompt, model_name, simple_answers):
+    payload = json.dumps(
+        [system_prompt, model_name, _canonicalize(simple_answers)],
+        sort_keys=True, ensure_ascii=False, separators=(',', ':'),
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def get_cached_analysis(key):
+    """Returns the stored analysis for `key`, or None on a miss or an expired entry."""
+    cutoff = timezone.now() - timedelta(seconds=settings.AI_CACHE_TTL)
+    entry = AnalysisCacheEntry.objects.filter(key=key, created_at__gte=cutoff).only('pk', 'analysis').first()
+    if entry is None:
+        _record('misses')
+        return None
+
+    AnalysisCacheEntry.objects.filter(pk=entry.pk).update(hits=F('hits') + 1, last_used_at=timezone.now())
+    _record('hits')
+    return entry.analysis
+
+
+def store_analysis(key, model_name, analysis):
+    now = timezone.now()
+    AnalysisCacheEntry.objects.update_or_create(
+        key=key,
+        defaults={'model_name': model_name, 'analysis': analysis, 'created_at': now, 'last_used_at': now},
+    )
+    if random.random() < settings.AI_CACHE_PRUNE_RATE:
+        prune()
+
+
+def prune():
+    """
+    Deletes expired entries and, if the table is still over
+    AI_CACHE_MAX_ENTRIES, the least recently used ones.
+    Returns the number of deleted rows.
+    """
+    cutoff = timezone.now() - timedelta(seconds=settings.AI_CACHE_TTL)
+    deleted, _ = AnalysisCacheEntry.objects.filter(created_at__lt=cutoff).delete()
+
+    overflow = AnalysisCacheEntry.objects.count() - settings.AI_CACHE_MAX_ENTRIES
+    if overflow > 0:
+        stale_ids = list(AnalysisCacheEntry.objects.order_by('last_used_at').values_list('pk', flat=True)[:overflow])
+        more, _ = AnalysisCacheEntry.objects.filter(pk__in=stale_ids).delete()
+        deleted += more
+    return deleted
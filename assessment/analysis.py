@@ -0,0 +1,170 @@
+# assessment/analysis.py
+from asgiref.sync import sync_to_async
+from django.db.models import Q
+from . import name_index
+from .models import AssessmentResult, AnalysisJob
+from .ai import AICallStats, aget_ai_analysis, astream_ai_analysis, get_ai_analysis, stream_ai_analysis, AI_ERROR_TYPE
+from .resilience import AIAnalysisError
+from .json_stream import IncrementalJSONParser
+from .recommendations import refresh_recommended_tests
+from .usage import arecord_usage, record_usage
+
+
+def find_related_test_id(job_name):
+    # Zero queries: looked up in the in-memory index of test and job names
+    return name_index.find_related_test_id(job_name)
+
+def link_job(job_item, index=None):
+    job_name = job_item.get('job', '')
+    linked_id = index.find_test_id(job_name) if index else find_related_test_id(job_name)
+    if linked_id:
+        job_item['test_id'] = linked_id
+
+def link_jobs_to_analysis(ai_analysis, index=None):
+    if 'recommended_jobs' in ai_analysis:
+        for job_item in ai_analysis['recommended_jobs']:
+            link_job(job_item, index)
+
+
+def results_needing_analysis():
+    """
+    Results that were never analyzed or only hold the AI error fallback,
+    excluding drafts (still being answered) and the ones a worker is already
+    processing.
+    """
+    return (AssessmentResult.objects
+            .filter(is_draft=False)
+            .filter(Q(ai_analysis__isnull=True) | Q(ai_analysis__mbti__type=AI_ERROR_TYPE))
+            .exclude(analysis_jobs__status__in=[AnalysisJob.STATUS_PENDING, AnalysisJob.STATUS_RUNNING]))
+
+
+def record_analysis_failure(result, error):
+    result.analysis_error = str(error) or error.__class__.__name__
+    result.save(update_fields=['analysis_error'])
+
+
+def save_analysis(result, ai_analysis):
+    result.ai_analysis = ai_analysis
+    result.analysis_error = ''
+    result.save(update_fields=['ai_analysis', 'analysis_error'])
+
+    if result.test.is_primary_assessment:
+        refresh_recommended_tests(result.user_id)
+
+
+async def asave_analysis(result, ai_analysis):
+    result.ai_analysis = ai_analysis
+    result.analysis_error = ''
+    await result.asave(update_fields=['ai_analysis', 'analysis_error'])
+
+    if result.test.is_primary_assessment:
+        await sync_to_async(refresh_recommended_tests)(result.user_id)
+
+
+def analyze_result(result, use_cache=True):
+    """
+    Runs the AI on an already saved AssessmentResult, links the recommended
+    jobs to their tests and stores the analysis on the row.
+    On failure the error is stored instead and AIAnalysisError is raised.
+    Either way the call's latency and token usage are recorded (usage.py).
+    """
+    stats = AICallStats()
+    try:
+        ai_analysis = get_ai_analysis(result.rich_answers, result.system_prompt, use_cache=use_cache, stats=stats)
+    except AIAnalysisError as e:
+        record_analysis_failure(result, e)
+        raise
+    finally:
+        record_usage(result, stats)
+    link_jobs_to_analysis(ai_analysis)
+
+    save_analysis(result, ai_analysis)
+    return ai_analysis
+
+
+async def aanalyze_result(result, use_cache=True):
+    """
+    analyze_result for async callers. `result` must come with its test and
+    test_version loaded (select_related), lazy loading isn't allowed here.
+    """
+    stats = AICallStats()
+    try:
+        ai_analysis = await aget_ai_analysis(result.rich_answers, result.system_prompt, use_cache=use_cache, stats=stats)
+    except AIAnalysisError as e:
+        await sync_to_async(record_analysis_failure)(result, e)
+        raise
+    finally:
+        await arecord_usage(result, stats)
+    # The name index may have to be rebuilt from the catalog, which can query
+    await sync_to_async(link_jobs_to_analysis)(ai_analysis)
+
+    await asave_analysis(result, ai_analysis)
+    return ai_analysis
+
+
+class _StreamLinker:
+    """Feeds streamed chunks to the JSON parser and links recommended jobs as they complete."""
+
+    def __init__(self, index):
+        self.index = index
+        self.parser = IncrementalJSONParser()
+        self.linked_jobs = []
+
+    def feed(self, chunk):
+        for event in self.parser.feed(chunk):
+            if event.key == 'recommended_jobs':
+                if event.kind == 'item' and isinstance(event.value, dict):
+                    link_job(event.value, self.index)
+                    self.linked_jobs.append(event.value)
+                elif event.kind == 'member' and len(self.linked_jobs) == len(event.value or []):
+                    event = event._replace(value=self.linked_jobs)
+            yield event
+
+    def analysis(self):
+        ai_analysis = self.parser.result
+        if self.linked_jobs and len(self.linked_jobs) == len(ai_analysis.get('recommended_jobs') or []):
+            # Reuse the links made while streaming instead of looking them up again
+            ai_analysis['recommended_jobs'] = self.linked_jobs
+        else:
+            link_jobs_to_analysis(ai_analysis, self.index)
+        return ai_analysis
+
+
+def stream_analyze_result(result, use_cache=True):
+    """
+    Streaming variant of analyze_result. Yields JSONEvents as sections of
+    the analysis complete (recommended jobs already linked to their tests)
+    and saves the full analysis on the row once the response is complete.
+    """
+    linker = _StreamLinker(name_index.get_index())
+    stats = AICallStats()
+    try:
+        for chunk in stream_ai_analysis(result.rich_answers, result.system_prompt, use_cache=use_cache, stats=stats):
+            yield from linker.feed(chunk)
+        ai_analysis = linker.analysis()
+    except Exception as e:
+        record_analysis_failure(result, e)
+        raise
+    finally:
+        record_usage(result, stats)
+
+    save_analysis(result, ai_analysis)
+
+
+async def astream_analyze_result(result, use_cache=True):
+    """stream_analyze_result for async callers (an async generator). Same requirements as aanalyze_result."""
+    # Loading the index may query the catalog, which can't happen in the event loop
+    linker = _StreamLinker(await sync_to_async(name_index.get_index)())
+    stats = AICallStats()
+    try:
+        async for chunk in astream_ai_analysis(result.rich_answers, result.system_prompt, use_cache=use_cache, stats=stats):
+            for event in linker.feed(chunk):
+                yield event
+        ai_analysis = linker.analysis()
+    except Exception as e:
+        await sync_to_async(record_analysis_failure)(result, e)
+        raise
+    finally:
+        await arecord_usage(result, stats)
+
+    await asave_analysis(result, ai_analysis)
@@ -0,0 +1,184 @@
+# assessment/archive.py
+"""
+Moves old AssessmentResults out of the database into compressed JSONL files.
+
+Each archived month is a directory under RESULTS_ARCHIVE_DIR. An archive run
+writes the month's rows into RESULTS_ARCHIVE_SHARDS gzip files, sharded by
+user id so reading one user's results opens one small file per month, and
+finishes with a manifest. Only runs with a manifest are read back, so a run
+that crashed halfway is simply ignored (and redone by the next run).
+
+The rows are then removed from the database: on a partitioned PostgreSQL
+table (see partitions.py) the month's partition is detached, elsewhere the
+rows are deleted in batches. Archiving is not deleting as far as the user is
+concerned, so the signals that update assessment counts and recommendations
+are skipped on purpose.
+"""
+import gzip
+import json
+import os
+from collections import Counter
+from pathlib import Path
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections, router, transaction
+from django.utils import timezone
+
+from . import partitions
+from .models import AnalysisJob, AssessmentResult
+
+DELETE_BATCH_SIZE = 1000
+
+
+def _archive_dir():
+    return Path(settings.RESULTS_ARCHIVE_DIR)
+
+
+def _month_dir(start):
+    return _archive_dir() / f'{start:%Y-%m}'
+
+
+def _shard_path(month_dir, run, shard, shards):
+    return month_dir / f'{run}.{shard:02d}-of-{shards:02d}.jsonl.gz'
+
+
+def _manifests(month_dir):
+    for path in sorted(month_dir.glob('*.manifest.json')):
+        with open(path, encoding='utf-8') as f:
+            yield path.name.split('.')[0], json.load(f)
+
+
+def _read_shard(path):
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            yield json.loads(line)
+
+
+def _serialize(result):
+    return {
+        'id': result.pk,
+        'user_id': result.user_id,
+        'test_id': result.test_id,
+        'test_name': result.test.name,
+        'created_at': result.created_at,
+        # Rich form, so the archive doesn't depend on TestVersion rows staying around
+        'answers': result.rich_answers,
+        'ai_analysis': result.ai_analysis,
+        'analysis_error': result.analysis_error,
+        'is_draft': result.is_draft,
+    }
+
+
+def months_to_archive(before):
+    """Month starts of the results created before `before` (itself a month start), oldest first."""
+    months = (AssessmentResult.objects
+              .filter(created_at__lt=before)
+              .dates('created_at', 'month'))
+    return [partitions.month_start(month) for month in months]
+
+
+def _archived_ids(month_dir):
+    """Ids already in a finished archive run of this month (left in the database by a crash)."""
+    ids = set()
+    for run, manifest in _manifests(month_dir):
+        for shard in range(manifest['shards']):
+            ids.update(row['id'] for row in _read_shard(_shard_path(month_dir, run, shard, manifest['shards'])))
+    return ids
+
+
+def _write_run(month_dir, rows, shards):
+    """Writes `rows` into a new sharded run and returns ({user_id: count}, [ids])."""
+    month_dir.mkdir(parents=True, exist_ok=True)
+    run = timezone.now().strftime('%Y%m%dT%H%M%S%f')
+    paths = [_shard_path(month_dir, run, shard, shards) for shard in range(shards)]
+    files = [gzip.open(f'{path}.tmp', 'wt', encoding='utf-8') for path in paths]
+    user_counts, ids = Counter(), []
+    try:
+        for row in rows:
+            files[row['user_id'] % shards].write(json.dumps(row, cls=DjangoJSONEncoder, ensure_ascii=False) + '\n')
+            if not row['is_draft']:
+                user_counts[row['user_id']] += 1
+            ids.append(row['id'])
+    finally:
+        for f in files:
+            f.close()
+
+    if not ids:
+        for path in paths:
+            os.remove(f'{path}.tmp')
+        return user_counts, ids
+    for path in paths:
+        os.replace(f'{path}.tmp', path)
+    manifest_path = month_dir / f'{run}.manifest.json'
+    with open(f'{manifest_path}.tmp', 'w', encoding='utf-8') as f:
+        json.dump({'shards': shards, 'rows': len(ids), 'user_counts': user_counts, 'created_at': timezone.now()},
+                  f, cls=DjangoJSONEncoder)
+    os.replace(f'{manifest_path}.tmp', manifest_path)
+    return user_counts, ids
+
+
+def _delete_results(ids):
+    using = router.db_for_write(AssessmentResult)
+    connection = connections[using]
+    table = connection.ops.quote_name(AssessmentResult._meta.db_table)
+    for offset in range(0, len(ids), DELETE_BATCH_SIZE):
+        batch = ids[offset:offset + DELETE_BATCH_SIZE]
+        with transaction.atomic(using=using):
+            AnalysisJob.objects.using(using).filter(result_id__in=batch).delete()
+            # Plain SQL, so the post_delete signals don't run (see the module docstring)
+            with connection.cursor() as cursor:
+                cursor.execute(f'DELETE FROM {table} WHERE id IN ({", ".join(["%s"] * len(batch))})', batch)
+
+
+def archive_month(start, shards=None, keep_detached=False):
+    """
+    Archives the results of the month starting at `start` and removes them
+    from the database. Returns the number of rows archived.
+    """
+    shards = shards or settings.RESULTS_ARCHIVE_SHARDS
+    end = partitions.next_month(start)
+    month_dir = _month_dir(start)
+    done = _archived_ids(month_dir) if month_dir.exists() else set()
+
+    results = (AssessmentResult.objects
+               .filter(created_at__gte=start, created_at__lt=end)
+               .select_related('test', 'test_version')
+               .order_by('pk'))
+    rows = (_serialize(result) for result in results.iterator(chunk_size=2000) if result.pk not in done)
+    _, ids = _write_run(month_dir, rows, shards)
+
+    partition = partitions.monthly_partitions().get(start) if partitions.is_partitioned() else None
+    if partition:
+        # Nothing references the results table at the database level anymore, so clean up first
+        AnalysisJob.objects.filter(result__created_at__gte=start, result__created_at__lt=end).delete()
+        partitions.detach_partition(partition, drop=not keep_detached)
+    else:
+        _delete_results(ids + sorted(done))
+    return len(ids)
+
+
+def archived_results(user_id):
+    """All archived results of one user, newest first, read from the archive files."""
+    found = {}
+    archive_dir = _archive_dir()
+    if not archive_dir.exists():
+        return []
+    for month_dir in archive_dir.iterdir():
+        for run, manifest in _manifests(month_dir):
+            shards = manifest['shards']
+            for row in _read_shard(_shard_path(month_dir, run, user_id % shards, shards)):
+                if row['user_id'] == user_id:
+                    found[row['id']] = row
+    return sorted(found.values(), key=lambda row: (row['created_at'], row['id']), reverse=True)
+
+
+def archived_result_counts():
+    """{user_id: number of archived results}, from the archive manifests."""
+    counts = Counter()
+    archive_dir = _archive_dir()
+    if archive_dir.exists():
+        for month_dir in archive_dir.iterdir():
+            for _, manifest in _manifests(month_dir):
+                counts.update({int(user_id): n for user_id, n in manifest['user_counts'].items()})
+    return counts
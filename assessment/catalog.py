@@ -0,0 +1,117 @@
+# assessment/catalog.py
+"""
+Cached test catalog: the list of tests (with their related job names) that
+the home page, the tests list and the dashboard are built from.
+
+The catalog is stored in Django's cache framework under a global catalog
+version, so all processes share one copy. Saving or deleting a Test or Job
+bumps the version (see signals.py) and every process rebuilds on its next
+read. In front of the shared cache each process keeps its own copy and only
+re-reads the version every CATALOG_LOCAL_TTL seconds, so in steady state a
+catalog read touches neither the database nor the cache backend.
+
+With a per-process cache (the default LocMemCache) a bump can't reach the
+other processes, so there the version expires after CATALOG_VERSION_TIMEOUT
+seconds and every process rebuilds at least that often.
+"""
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+
+from core.db_router import PRIMARY
+
+from .models import Test
+
+VERSION_KEY = 'assessment:catalog:version'
+
+_local = {'version': None, 'checked_at': 0, 'catalog': None}
+_lock = threading.Lock()
+
+
+def _catalog_key(version):
+    return f'assessment:catalog:{version}'
+
+
+def _build():
+    # Always from the primary: read from a lagging replica right after a bump,
+    # the old catalog would be stored under the new version
+    tests = (Test.objects.using(PRIMARY)
+             .order_by('order', 'id')
+             .values('id', 'name', 'description', 'sources', 'is_primary_assessment', 'related_job__name'))
+    return [{
+        'id': t['id'],
+        'name': t['name'],
+        'description': t['description'],
+        'sources': t['sources'],
+        'is_primary_assessment': t['is_primary_assessment'],
+        'related_job_name': t['related_job__name'],
+    } for t in tests]
+
+
+def _version_timeout():
+    return settings.CATALOG_VERSION_TIMEOUT or None
+
+
+def get_version():
+    """The current catalog version, as seen by this process (at most CATALOG_LOCAL_TTL seconds old)."""
+    now = time.monotonic()
+    with _lock:
+        if _local['version'] is not None and now - _local['checked_at'] < settings.CATALOG_LOCAL_TTL:
+            return _local['version']
+
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        # First process up (or the cache was flushed): whoever adds the key first wins
+        cache.add(VERSION_KEY, uuid.uuid4().hex, timeout=_version_timeout())
+        version = cache.get(VERSION_KEY)
+
+    with _lock:
+        if version != _local['version']:
+            _local['catalog'] = None
+        _local['version'] = version
+        _local['checked_at'] = now
+    return version
+
+
+def bump_version():
+    """Invalidates the catalog in every process. Call after Test/Job changes are committed."""
+    cache.set(VERSION_KEY, uuid.uuid4().hex, timeout=_version_timeout())
+    with _lock:
+        _local['version'] = None
+        _local['catalog'] = None
+
+
+def get_catalog():
+    """All tests in display order, as a list of dicts. Treat it as read-only; it is shared."""
+    version = get_version()
+    with _lock:
+        if _local['catalog'] is not None and _local['version'] == version:
+            return _local['catalog']
+
+    catalog = cache.get(_catalog_key(version))
+    if catalog is None:
+        catalog = _build()
+        cache.set(_catalog_key(version), catalog, timeout=settings.CATALOG_CACHE_TIMEOUT)
+
+    with _lock:
+        if _local['version'] == version:
+            _local['catalog'] = catalog
+    return catalog
+
+
+def get_primary_test_id():
+    for test in get_catalog():
+        if test['is_primary_assessment']:
+            return test['id']
+    return None
+
+
+def get_tests_list():
+    """The optional (non-primary) tests, as shown in the tests list."""
+    return [
+        {'id': t['id'], 'name': t['name'], 'description': t['description'], 'sources': t['sources']}
+        for t in get_catalog() if not t['is_primary_assessment']
+    ]
@@ -0,0 +1,121 @@
+# assessment/drafts.py
+"""
+One draft AssessmentResult per (user, test).
+
+The frontend autosaves while the user answers: `patch_draft` merges just
+the changed answers into the stored ones with a single UPDATE (JSON merge
+in the database), and `save_draft` replaces them all. Asking for an
+analysis turns the draft into a real result (`submit_draft`), and the next
+autosave of that test starts a new draft.
+"""
+from django.db import IntegrityError, transaction
+from django.db.models import F, Func, JSONField, Value
+
+from account import ranking
+
+from .models import AssessmentResult
+
+
+class JSONMerge(Func):
+    """
+    stored JSON object + patch: keys in the patch replace the stored ones and
+    null values remove them (RFC 7396 merge patch).
+    """
+    function = 'JSON_PATCH'
+    output_field = JSONField()
+
+    def as_postgresql(self, compiler, connection, **extra_context):
+        return self.as_sql(compiler, connection, template='jsonb_strip_nulls(%(expressions)s)', arg_joiner=' || ', **extra_context)
+
+    def as_mysql(self, compiler, connection, **extra_context):
+        return self.as_sql(compiler, connection, function='JSON_MERGE_PATCH', **extra_context)
+
+
+def _drafts(user, test):
+    return AssessmentResult.objects.filter(user=user, test=test, is_draft=True).order_by('-created_at', '-pk')
+
+
+def save_draft(user, test, answers_data):
+    """Stores all the answers in the user's draft of `test`, creating it if needed. Returns the draft."""
+    defaults = {'answers': AssessmentResult.compact_answers(answers_data), 'test_version_id': test.current_version_id}
+    try:
+        draft, _ = AssessmentResult.objects.update_or_create(user=user, test=test, is_draft=True, defaults=defaults)
+    except AssessmentResult.MultipleObjectsReturned:
+        # A partitioned results table has no unique index to stop two
+        # concurrent first autosaves; keep the newest draft
+        draft = _drop_duplicate_drafts(user, test)
+        for field, value in defaults.items():
+            setattr(draft, field, value)
+        draft.save(update_fields=['answers', 'test_version'])
+    return draft
+
+
+def _drop_duplicate_drafts(user, test):
+    newest, *duplicates = _drafts(user, test)
+    AssessmentResult.objects.filter(pk__in=[draft.pk for draft in duplicates], is_draft=True).delete()
+    return newest
+
+
+def patch_draft(user, test, patch):
+    """
+    Merges `patch` ({question_id: answer}, null clears an answer) into the
+    user's draft of `test`, creating it if needed. Returns the draft's id.
+    """
+    patch = {str(question_id): answer for question_id, answer in patch.items()}
+    while True:
+        draft_id = _drafts(user, test).values_list('pk', flat=True).first()
+        if draft_id is None:
+            try:
+                with transaction.atomic():
+                    return AssessmentResult.objects.create(
+                        user=user, test=test, is_draft=True, test_version_id=test.current_version_id,
+                        answers={key: answer for key, answer in patch.items() if answer is not None},
+                    ).pk
+            except IntegrityError:
+                # A concurrent autosave created it first; merge into that one
+                continue
+        if _merge_into_draft(draft_id, test, patch):
+            return draft_id
+        # Submitted between the two queries; this autosave starts the next draft
+
+
+def _merge_into_draft(draft_id, test, patch):
+    """False if `draft_id` is no longer a draft, so the submitted result is left alone."""
+    drafts = AssessmentResult.objects.filter(pk=draft_id, is_draft=True)
+    updated = drafts.filter(test_version__isnull=False).update(
+        answers=JSONMerge(F('answers'), Value(patch, output_field=JSONField())),
+        test_version_id=test.current_version_id,
+    )
+    if updated:
+        return True
+    # An old draft still in the rich form; compact it on the way
+    draft = drafts.first()
+    if draft is None:
+        return False
+    answers = AssessmentResult.compact_answers(draft.answers)
+    if 'responses' in answers:
+        # It has more than answers (a user_info), so it stays rich
+        return bool(drafts.update(answers=_patch_rich_answers(answers, patch, test), test_version_id=test.current_version_id))
+    answers = {**answers, **patch}
+    return bool(drafts.update(
+        answers={key: answer for key, answer in answers.items() if answer is not None},
+        test_version_id=test.current_version_id,
+    ))
+
+
+def _patch_rich_answers(answers, patch, test):
+    texts = {str(q.get('id')): q.get('question') for q in test.questions if isinstance(q, dict)}
+    responses = {str(item['question_id']): item for item in answers['responses']}
+    for key, answer in patch.items():
+        if answer is None:
+            responses.pop(key, None)
+        else:
+            responses[key] = {**responses.get(key, {'question_id': key, 'question_text': texts.get(key)}), 'answer': answer}
+    return {**answers, 'responses': list(responses.values())}
+
+
+def submit_draft(result):
+    """Makes a draft a real result, which is when it starts counting towards the user's rank."""
+    if result.is_draft and AssessmentResult.objects.filter(pk=result.pk, is_draft=True).update(is_draft=False):
+        result.is_draft = False
+        ranking.change_assessment_count(result.user_id, 1)
@@ -0,0 +1,213 @@
+# assessment/jobs.py
+"""
+A small database-backed queue for AI analyses.
+
+Views only save the AssessmentResult and call `enqueue_analysis`; the
+`run_analysis_worker` management command drains the queue with a pool of
+threads, so a slow Gemini round trip never holds a web worker.
+
+The async views use `aenqueue_analysis`; in eager mode it runs the analysis
+with the async AI client, so under ASGI a waiting analysis doesn't hold a
+thread either.
+"""
+import logging
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import F
+from django.utils import timezone
+
+from . import ai
+from .analysis import aanalyze_result, analyze_result
+from .models import AnalysisJob
+from .recommendations import run_requested_refresh
+from .resilience import CircuitOpenError
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_STATUSES = [AnalysisJob.STATUS_PENDING, AnalysisJob.STATUS_RUNNING]
+
+
+def enqueue_analysis(result, use_cache=True):
+    """
+    Queues an analysis for `result`. If one is already waiting or running
+    (double submit, client retry) that job is returned instead.
+    Pass use_cache=False to force a fresh AI call.
+    """
+    job = result.analysis_jobs.filter(status__in=ACTIVE_STATUSES).first()
+    if job:
+        return job
+
+    job = AnalysisJob.objects.create(result=result, use_cache=use_cache)
+
+    if settings.ANALYSIS_QUEUE_EAGER:
+        # Handy for local development and tests: no worker process needed
+        if _claim(job.pk):
+            job.refresh_from_db()
+            job.result = result  # already in memory, no need to load it again
+            run_job(job)
+
+    return job
+
+
+async def aenqueue_analysis(result, use_cache=True):
+    """
+    enqueue_analysis for async views. `result` must come with its test and
+    test_version loaded, in case the analysis runs eagerly.
+    """
+    job = await result.analysis_jobs.filter(status__in=ACTIVE_STATUSES).afirst()
+    if job:
+        return job
+
+    job = await AnalysisJob.objects.acreate(result=result, use_cache=use_cache)
+
+    if settings.ANALYSIS_QUEUE_EAGER:
+        if await _claimable(job.pk).aupdate(**_claim_changes()) == 1:
+            await job.arefresh_from_db()
+            job.result = result
+            await arun_job(job)
+
+    return job
+
+
+def _claimable(job_pk):
+    return AnalysisJob.objects.filter(pk=job_pk, status=AnalysisJob.STATUS_PENDING)
+
+
+def _claim_changes():
+    return {'status': AnalysisJob.STATUS_RUNNING, 'started_at': timezone.now(), 'attempts': F('attempts') + 1}
+
+
+def _claim(job_pk):
+    """Compare-and-set pending -> running, so two workers never get the same job."""
+    return _claimable(job_pk).update(**_claim_changes()) == 1
+
+
+def claim_next_job():
+    """Returns the oldest pending job after marking it running, or None if the queue is empty."""
+    candidates = (AnalysisJob.objects
+                  .filter(status=AnalysisJob.STATUS_PENDING)
+                  .order_by('created_at')
+                  .values_list('pk', flat=True)[:10])
+
+    for job_pk in candidates:
+        if _claim(job_pk):
+            return AnalysisJob.objects.select_related('result__test', 'result__test_version').get(pk=job_pk)
+    return None
+
+
+def run_job(job):
+    """Runs one claimed job and records its outcome."""
+    try:
+        analyze_result(job.result, use_cache=job.use_cache)
+    except Exception as e:
+        update_fields = _record_outcome(job, e)
+    else:
+        update_fields = _record_outcome(job)
+    job.save(update_fields=update_fields)
+    return job
+
+
+async def arun_job(job):
+    """run_job for async callers."""
+    try:
+        await aanalyze_result(job.result, use_cache=job.use_cache)
+    except Exception as e:
+        update_fields = _record_outcome(job, e)
+    else:
+        update_fields = _record_outcome(job)
+    await job.asave(update_fields=update_fields)
+    return job
+
+
+def _record_outcome(job, error=None):
+    """Sets the job's status after a run that raised `error` (None on success). Returns the fields to save."""
+    update_fields = ['status', 'error', 'finished_at']
+    if isinstance(error, CircuitOpenError):
+        # The provider was never called, so this doesn't count as an attempt
+        job.status = AnalysisJob.STATUS_PENDING
+        job.error = str(error)
+        job.attempts = F('attempts') - 1
+        update_fields.append('attempts')
+    elif error is not None:
+        logger.error("Analysis job %s failed", job.pk, exc_info=error)
+        job.error = str(error)
+        if job.attempts < settings.ANALYSIS_JOB_MAX_ATTEMPTS:
+            job.status = AnalysisJob.STATUS_PENDING
+        else:
+            job.status = AnalysisJob.STATUS_FAILED
+            job.finished_at = timezone.now()
+    else:
+        job.status = AnalysisJob.STATUS_DONE
+        job.error = ''
+        job.finished_at = timezone.now()
+    return update_fields
+
+
+def requeue_stale_jobs():
+    """Puts jobs back in the queue whose worker died while running them."""
+    cutoff = timezone.now() - timedelta(seconds=settings.ANALYSIS_JOB_TIMEOUT)
+    return AnalysisJob.objects.filter(
+        status=AnalysisJob.STATUS_RUNNING, started_at__lt=cutoff
+    ).update(status=AnalysisJob.STATUS_PENDING)
+
+
+def _worker_loop(stop_event, poll_interval):
+    while not stop_event.is_set():
+        # While the AI circuit breaker is open there is no point in claiming jobs
+        pause = ai.retry_after()
+        if pause:
+            stop_event.wait(pause)
+            continue
+
+        try:
+            close_old_connections()
+            job = claim_next_job()
+            if job is None:
+                stop_event.wait(poll_interval)
+                continue
+            run_job(job)
+        except Exception:
+            # A lost connection or a lock timeout mustn't end the thread; a job
+            # left "running" is requeued by requeue_stale_jobs
+            logger.exception("Analysis worker error")
+            close_old_connections()
+            stop_event.wait(poll_interval)
+    close_old_connections()
+
+
+def run_workers(concurrency=None, poll_interval=None, stop_event=None):
+    """
+    Starts `concurrency` worker threads and blocks until `stop_event` is set.
+    Each thread claims and processes one job at a time. Every
+    ANALYSIS_JOB_TIMEOUT seconds this thread requeues stale jobs and runs a
+    requested recommendation refresh (see recommendations.py).
+    """
+    concurrency = concurrency or settings.ANALYSIS_WORKER_CONCURRENCY
+    poll_interval = poll_interval or settings.ANALYSIS_WORKER_POLL_INTERVAL
+    stop_event = stop_event or threading.Event()
+
+    requeue_stale_jobs()
+
+    threads = [
+        threading.Thread(target=_worker_loop, args=(stop_event, poll_interval), name=f"analysis-worker-{i}", daemon=True)
+        for i in range(concurrency)
+    ]
+    for thread in threads:
+        thread.start()
+
+    try:
+        while not stop_event.is_set():
+            stop_event.wait(settings.ANALYSIS_JOB_TIMEOUT)
+            try:
+                requeue_stale_jobs()
+                run_requested_refresh()
+            except Exception:
+                logger.exception("Analysis queue maintenance failed")
+                close_old_connections()
+    finally:
+        stop_event.set()
+        for thread in threads:
+            thread.join()
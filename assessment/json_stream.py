@@ -0,0 +1,125 @@
+# assessment/json_stream.py
+"""
+Incremental parser for the AI's JSON object.
+
+Text is fed in arbitrary chunks as the model streams it. Whenever a
+top-level member (e.g. "analysis") is complete a `member` event is
+emitted, and every element of a top-level array (e.g. each entry of
+"recommended_jobs") is emitted as an `item` event as soon as it closes,
+long before the whole response has arrived.
+"""
+import json
+from collections import namedtuple
+
+JSONEvent = namedtuple('JSONEvent', ['kind', 'key', 'index', 'value'])
+
+
+class IncrementalJSONParser:
+    def __init__(self):
+        self.buffer = ''
+        self.pos = 0
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.started = False
+        self.finished = False
+        self.members = {}
+
+        # State of the top-level member being read
+        self.key_start = None
+        self.key = None
+        self.value_start = None
+        self.value_is_array = False
+
+        # State of the current element of a top-level array
+        self.item_start = None
+        self.item_index = 0
+
+    def feed(self, text):
+        """Adds a chunk of text and returns the list of events it completed."""
+        self.buffer += text
+        events = []
+
+        while self.pos < len(self.buffer) and not self.finished:
+            char = self.buffer[self.pos]
+
+            if not self.started:
+                # Skip anything before the object, e.g. a ```json fence
+                if char == '{':
+                    self.started = True
+                    self.depth = 1
+                self.pos += 1
+                continue
+
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif char == '\\':
+                    self.escape = True
+                elif char == '"':
+                    self.in_string = False
+                    if self.depth == 1 and self.key_start is not None and self.value_start is None:
+                        self.key = json.loads(self.buffer[self.key_start:self.pos + 1])
+                        self.key_start = None
+                self.pos += 1
+                continue
+
+            if char == '"':
+                self.in_string = True
+                if self.depth == 1 and self.value_start is None and self.key is None:
+                    self.key_start = self.pos
+                elif self.depth == 2 and self.value_is_array and self.item_start is None:
+                    self.item_start = self.pos
+            elif char == ':' and self.depth == 1 and self.value_start is None:
+                self.value_start = self.pos + 1
+            elif char in '{[':
+                if self.depth == 1 and self.value_start is not None and char == '[' and not self.buffer[self.value_start:self.pos].strip():
+                    self.value_is_array = True
+                    self.item_index = 0
+                elif self.depth == 2 and self.value_is_array and self.item_start is None:
+                    self.item_start = self.pos
+                self.depth += 1
+            elif char in '}]':
+                self.depth -= 1
+                if self.depth == 1 and self.value_is_array and char == ']':
+                    self._close_item(events, self.pos)
+                elif self.depth == 0:
+                    self._close_member(events, self.pos)
+                    self.finished = True
+            elif char == ',':
+                if self.depth == 1:
+                    self._close_member(events, self.pos)
+                elif self.depth == 2 and self.value_is_array:
+                    self._close_item(events, self.pos)
+            elif not char.isspace() and self.depth == 2 and self.value_is_array and self.item_start is None:
+                # Start of a number / true / false / null element
+                self.item_start = self.pos
+
+            self.pos += 1
+
+        return events
+
+    def _close_item(self, events, end):
+        if self.item_start is not None:
+            value = json.loads(self.buffer[self.item_start:end])
+            events.append(JSONEvent('item', self.key, self.item_index, value))
+            self.item_index += 1
+        self.item_start = None
+
+    def _close_member(self, events, end):
+        if self.key is not None and self.value_start is not None:
+            value = json.loads(self.buffer[self.value_start:end])
+            self.members[self.key] = value
+            events.append(JSONEvent('member', self.key, None, value))
+        self.key = None
+        self.key_start = None
+        self.value_start = None
+        self.value_is_array = False
+        self.item_start = None
+
+    @property
+    def result(self):
+        """The whole object, once the closing brace has been seen."""
+        if not self.finished:
+            raise ValueError("Incomplete JSON response from AI.")
+        return self.members
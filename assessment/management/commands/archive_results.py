@@ -0,0 +1,50 @@
+# assessment/management/commands/archive_results.py
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from assessment import archive, partitions
+
+
+class Command(BaseCommand):
+    help = (
+        "Moves the assessment results of old months into compressed JSONL files under "
+        "RESULTS_ARCHIVE_DIR and removes them from the database. Archived results stay "
+        "readable through the archived history API."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--before', help="Archive months before this one (YYYY-MM). "
+                                             "Defaults to RESULTS_ARCHIVE_AFTER_MONTHS months ago.")
+        parser.add_argument('--dry-run', action='store_true', help="Only list the months that would be archived.")
+        parser.add_argument('--keep-detached', action='store_true',
+                            help="PostgreSQL partitions: detach archived partitions but don't drop them.")
+
+    def handle(self, *args, **options):
+        if options['before']:
+            try:
+                before = partitions.month_start(datetime.strptime(options['before'], '%Y-%m'))
+            except ValueError:
+                raise CommandError("--before must look like 2024-01.")
+        else:
+            before = partitions.month_start(timezone.now())
+            for _ in range(settings.RESULTS_ARCHIVE_AFTER_MONTHS):
+                before = partitions.month_start(before - timedelta(days=1))
+
+        months = archive.months_to_archive(before)
+        if not months:
+            self.stdout.write(f"Nothing to archive before {before:%Y-%m}.")
+            return
+
+        total = 0
+        for start in months:
+            if options['dry_run']:
+                self.stdout.write(f"Would archive {start:%Y-%m}")
+                continue
+            count = archive.archive_month(start, keep_detached=options['keep_detached'])
+            total += count
+            self.stdout.write(f"{start:%Y-%m}: archived {count} results")
+        if not options['dry_run']:
+            self.stdout.write(self.style.SUCCESS(f"Archived {total} results from {len(months)} months."))
@@ -0,0 +1,31 @@
+# assessment/management/commands/backfill_recommended_tests.py
+from django.core.management.base import BaseCommand
+
+from assessment.models import AssessmentResult, RecommendationRefresh
+from assessment.recommendations import refresh_recommended_tests
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuilds the materialized dashboard recommendations of every user with an "
+        "analyzed primary assessment. Run after deploying, or after changing which "
+        "job a test is related to."
+    )
+
+    def handle(self, *args, **options):
+        # This run covers any refresh the worker hasn't got to yet
+        RecommendationRefresh.objects.all().delete()
+        user_ids = (AssessmentResult.objects
+                    .filter(test__is_primary_assessment=True, ai_analysis__isnull=False)
+                    .values_list('user_id', flat=True)
+                    .distinct()
+                    .order_by('user_id'))
+
+        count = 0
+        for user_id in user_ids.iterator(chunk_size=1000):
+            refresh_recommended_tests(user_id)
+            count += 1
+            if count % 1000 == 0:
+                self.stdout.write(f"{count} users done...")
+
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt recommendations for {count} users."))
@@ -0,0 +1,163 @@
+# assessment/management/commands/generate_synthetic_data.py
+import random
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from account.models import CustomUser
+from account.ranking import reconcile
+from assessment.models import AssessmentResult, Job, Test
+
+QUESTION_TYPES = ['multiple', 'slider', 'text']
+OPTIONS = ['کاملا موافقم', 'موافقم', 'نظری ندارم', 'مخالفم', 'کاملا مخالفم']
+
+
+@contextmanager
+def keep_created_at():
+    """bulk_create normally overwrites auto_now_add fields; let the generated dates through."""
+    field = AssessmentResult._meta.get_field('created_at')
+    field.auto_now_add = False
+    try:
+        yield
+    finally:
+        field.auto_now_add = True
+
+
+class Command(BaseCommand):
+    help = (
+        "Bulk-generates synthetic users, jobs, tests and assessment results for "
+        "capacity planning and load tests. Never run this against production."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10000)
+        parser.add_argument('--tests', type=int, default=20)
+        parser.add_argument('--questions', type=int, default=30, help="Questions per test.")
+        parser.add_argument('--results', type=int, default=100000)
+        parser.add_argument('--analyzed', type=float, default=0.9, help="Fraction of results that get an analysis.")
+        parser.add_argument('--days', type=int, default=365, help="Spread result dates over this many past days.")
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--phone-prefix', default='0990', help="Generated phone numbers start with this.")
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        started = time.monotonic()
+
+        tests = self._create_tests(options['tests'], options['questions'])
+        user_ids = self._create_users(options['users'], options['phone_prefix'])
+        self._create_results(options['results'], user_ids, tests, options['analyzed'], options['days'])
+
+        self.stdout.write("Recomputing assessment counts and ranks...")
+        reconcile()
+
+        self.stdout.write(self.style.SUCCESS(f"Done in {time.monotonic() - started:.0f}s."))
+        self.stdout.write("Run backfill_recommended_tests to build the dashboard recommendations.")
+
+    def _create_tests(self, count, question_count):
+        jobs = Job.objects.bulk_create(
+            [Job(name=f'شغل نمونه {i}', description='ساخته شده برای تست بار') for i in range(count)],
+            ignore_conflicts=True,
+        )
+        jobs = list(Job.objects.filter(name__in=[job.name for job in jobs]).order_by('id'))
+        has_primary = Test.objects.filter(is_primary_assessment=True).exists()
+
+        tests, created = [], 0
+        for i, job in enumerate(jobs):
+            # Reused on a rerun, by its name (the oldest one, if earlier runs
+            # made several)
+            name = f'آزمون نمونه {i}'
+            test = Test.objects.filter(name=name).order_by('id').first()
+            if test is None:
+                # save() rather than bulk_create, so questions_version and current_version are filled in
+                test = Test.objects.create(
+                    name=name,
+                    description='آزمون ساخته شده برای تست بار',
+                    questions=self._questions(question_count),
+                    system_prompt='You are a career counselor. Answer in JSON.',
+                    related_job=job,
+                    is_primary_assessment=(i == 0 and not has_primary),
+                    order=1000 + i,
+                )
+                created += 1
+            tests.append(test)
+        self.stdout.write(f"Created {created} tests, reused {len(tests) - created}.")
+        return tests
+
+    def _questions(self, count):
+        questions = []
+        for i in range(1, count + 1):
+            kind = self.random.choice(QUESTION_TYPES)
+            question = {'id': i, 'type': kind, 'question': f'سوال نمونه شماره {i} درباره علاقه‌مندی‌های شغلی شما'}
+            if kind == 'multiple':
+                question['options'] = OPTIONS
+            elif kind == 'slider':
+                question.update(min=1, max=10)
+            questions.append(question)
+        return questions
+
+    def _create_users(self, count, phone_prefix):
+        # One hash for everyone: hashing a password per user would dominate the run
+        password = make_password(None)
+        width = 11 - len(phone_prefix)
+        start = CustomUser.objects.filter(phone_number__startswith=phone_prefix).count()
+
+        for offset in range(0, count, self.batch_size):
+            CustomUser.objects.bulk_create([
+                CustomUser(phone_number=f'{phone_prefix}{start + i:0{width}d}', full_name=f'کاربر نمونه {start + i}', password=password)
+                for i in range(offset, min(count, offset + self.batch_size))
+            ])
+            self.stdout.write(f"{min(count, offset + self.batch_size)}/{count} users...")
+        return list(CustomUser.objects.filter(phone_number__startswith=phone_prefix).values_list('id', flat=True))
+
+    def _answers(self, test):
+        # Compact form, as the views store it against test.current_version
+        answers = {}
+        for q in test.questions:
+            if q['type'] == 'multiple':
+                answer = self.random.choice(q['options'])
+            elif q['type'] == 'slider':
+                answer = self.random.randint(q['min'], q['max'])
+            else:
+                answer = 'پاسخ نمونه'
+            answers[str(q['id'])] = answer
+        return answers
+
+    def _analysis(self, job_names):
+        return {
+            'analysis': 'تحلیل نمونه برای تست بار',
+            'recommended_jobs': [{'job': name, 'reason': 'پیشنهاد نمونه'} for name in self.random.sample(job_names, min(3, len(job_names)))],
+            'development_points': ['مهارت نمونه اول', 'مهارت نمونه دوم'],
+            'career_path': 'مسیر شغلی نمونه',
+        }
+
+    def _create_results(self, count, user_ids, tests, analyzed, days):
+        if not user_ids or not tests:
+            return
+        job_names = [test.related_job.name for test in tests if test.related_job_id]
+        now = timezone.now()
+        started = time.monotonic()
+
+        with keep_created_at():
+            for offset in range(0, count, self.batch_size):
+                batch = []
+                for _ in range(min(self.batch_size, count - offset)):
+                    test = self.random.choice(tests)
+                    batch.append(AssessmentResult(
+                        user_id=self.random.choice(user_ids),
+                        test=test,
+                        test_version_id=test.current_version_id,
+                        answers=self._answers(test),
+                        ai_analysis=self._analysis(job_names) if self.random.random() < analyzed else None,
+                        created_at=now - timedelta(seconds=self.random.randint(0, days * 86400)),
+                    ))
+                AssessmentResult.objects.bulk_create(batch)
+
+                done = offset + len(batch)
+                rate = done / max(time.monotonic() - started, 1e-6)
+                self.stdout.write(f"{done}/{count} results ({rate:.0f}/s)...")
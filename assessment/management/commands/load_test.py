@@ -0,0 +1,155 @@
+# assessment/management/commands/load_test.py
+"""
+Replays the real user flow against a running server with many concurrent
+virtual users and reports throughput and latency percentiles per endpoint.
+
+Start the server with the stub backends and the same database, e.g.:
+
+    AI_PROVIDER=stub SMS_BACKEND=fake OTP_STORE=db OTP_RESEND_COOLDOWN=0 python manage.py runserver
+    python manage.py run_analysis_worker
+    SMS_BACKEND=fake python manage.py run_sms_worker
+    OTP_STORE=db python manage.py load_test --users 50 --flows 5
+
+The OTP codes are read straight from the OTP store, so this command must
+use the same store as the server: OTP_STORE=db with the same database, or
+the cache store with a shared CACHES backend.
+"""
+import asyncio
+import random
+import time
+from collections import defaultdict
+
+from asgiref.sync import sync_to_async
+from django.core.management.base import BaseCommand, CommandError
+
+from account.otp import get_store
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+class FlowError(Exception):
+    pass
+
+
+class LoadTest:
+    def __init__(self, client_class, base_url, poll_timeout):
+        self.client_class = client_class
+        self.base_url = base_url.rstrip('/')
+        self.poll_timeout = poll_timeout
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    async def request(self, client, name, method, path, json=None):
+        headers = {}
+        if method == 'POST':
+            headers['X-CSRFToken'] = client.cookies.get('csrftoken', '')
+        started = time.perf_counter()
+        try:
+            response = await client.request(method, path, json=json, headers=headers)
+        except Exception as e:
+            self.errors[name] += 1
+            raise FlowError(f"{name}: {e}") from e
+        self.latencies[name].append((time.perf_counter() - started) * 1000)
+        if response.status_code >= 400:
+            self.errors[name] += 1
+            raise FlowError(f"{name}: HTTP {response.status_code}")
+        return response
+
+    async def login(self, client, phone_number):
+        await self.request(client, 'home', 'GET', '/')  # sets the CSRF cookie
+        await self.request(client, 'request_otp', 'POST', '/api/request-otp/', json={'phone_number': phone_number})
+        code = await sync_to_async(get_store().peek)(phone_number)
+        if code is None:
+            raise FlowError("request_otp: no code was stored")
+        await self.request(client, 'verify_otp', 'POST', '/api/verify-otp/',
+                           json={'phone_number': phone_number, 'code': code, 'full_name': 'کاربر تست بار'})
+
+    def answers(self, questions):
+        responses = []
+        for q in questions:
+            if q.get('type') == 'multiple' and q.get('options'):
+                answer = random.choice(q['options'])
+            elif q.get('type') == 'slider':
+                answer = random.randint(q.get('min', 1), q.get('max', 10))
+            else:
+                answer = 'پاسخ تست بار'
+            responses.append({'question_id': q['id'], 'question_text': q.get('question'), 'answer': answer})
+        return {'user_info': {}, 'responses': responses}
+
+    async def take_test(self, client):
+        await self.request(client, 'dashboard', 'GET', '/api/dashboard/')
+        tests = (await self.request(client, 'tests_list', 'GET', '/api/tests/list/')).json()['tests']
+        if not tests:
+            raise FlowError("tests_list: no tests to take")
+        test_id = random.choice(tests)['id']
+
+        questions = (await self.request(client, 'questions', 'GET', f'/api/tests/{test_id}/questions/')).json()
+        draft = (await self.request(client, 'save_draft', 'POST', f'/api/tests/{test_id}/save-draft/', json=self.answers(questions))).json()
+        result_id = draft['result_id']
+
+        job = (await self.request(client, 'analyze', 'POST', f'/api/tests/{test_id}/analyze/{result_id}/')).json()['job']
+        deadline = time.monotonic() + self.poll_timeout
+        while job['job_status'] in ('pending', 'running'):
+            if time.monotonic() > deadline:
+                self.errors['analysis_timeout'] += 1
+                break
+            await asyncio.sleep(0.5)
+            job = (await self.request(client, 'job_status', 'GET', f"/api/analysis-jobs/{job['id']}/")).json()['job']
+
+        await self.request(client, 'history', 'GET', '/api/history/')
+        await self.request(client, 'history_detail', 'GET', f'/api/history/{result_id}/')
+
+    async def virtual_user(self, phone_number, flows, semaphore):
+        async with semaphore:
+            async with self.client_class(base_url=self.base_url, timeout=60) as client:
+                try:
+                    await self.login(client, phone_number)
+                    for _ in range(flows):
+                        await self.take_test(client)
+                except FlowError:
+                    pass  # already counted; this virtual user stops here
+
+    async def run(self, phone_numbers, flows, concurrency):
+        semaphore = asyncio.Semaphore(concurrency)
+        await asyncio.gather(*(self.virtual_user(phone, flows, semaphore) for phone in phone_numbers))
+
+
+class Command(BaseCommand):
+    help = "Runs the OTP login -> dashboard -> test -> analysis -> history flow with many concurrent users."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--base-url', default='http://127.0.0.1:8000')
+        parser.add_argument('--users', type=int, default=20, help="Virtual users (each logs in with its own phone number).")
+        parser.add_argument('--flows', type=int, default=3, help="Tests each virtual user takes.")
+        parser.add_argument('--concurrency', type=int, default=20, help="Virtual users active at the same time.")
+        parser.add_argument('--phone-prefix', default='0991')
+        parser.add_argument('--poll-timeout', type=float, default=120, help="Seconds to wait for an analysis.")
+
+    def handle(self, *args, **options):
+        try:
+            import httpx
+        except ImportError:
+            raise CommandError("The load test needs httpx (pip install httpx).")
+
+        width = 11 - len(options['phone_prefix'])
+        phone_numbers = [f"{options['phone_prefix']}{i:0{width}d}" for i in range(options['users'])]
+        load_test = LoadTest(httpx.AsyncClient, options['base_url'], options['poll_timeout'])
+
+        started = time.perf_counter()
+        asyncio.run(load_test.run(phone_numbers, options['flows'], options['concurrency']))
+        elapsed = time.perf_counter() - started
+
+        total = sum(len(samples) for samples in load_test.latencies.values())
+        self.stdout.write(f"{total} requests in {elapsed:.1f}s ({total / elapsed:.1f} req/s)\n")
+        self.stdout.write(f"{'endpoint':<16}{'count':>7}{'errors':>8}{'req/s':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}")
+        for name, samples in load_test.latencies.items():
+            self.stdout.write(
+                f"{name:<16}{len(samples):>7}{load_test.errors.get(name, 0):>8}{len(samples) / elapsed:>8.1f}"
+                f"{percentile(samples, 50):>9.1f}{percentile(samples, 95):>9.1f}{percentile(samples, 99):>9.1f}{max(samples):>9.1f}"
+            )
+        for name, count in load_test.errors.items():
+            if name not in load_test.latencies:
+                self.stdout.write(self.style.WARNING(f"{name}: {count} errors"))
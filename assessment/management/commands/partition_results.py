@@ -0,0 +1,32 @@
+# assessment/management/commands/partition_results.py
+from django.core.management.base import BaseCommand, CommandError
+
+from assessment import partitions
+
+
+class Command(BaseCommand):
+    help = (
+        "PostgreSQL only: partitions the assessment results table by month "
+        "(--convert, once) and creates the partitions of the coming months (from cron)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--convert', action='store_true',
+                            help="Rebuild the existing table as a partitioned one. Locks the table while it copies every row.")
+        parser.add_argument('--months-ahead', type=int, default=3)
+
+    def handle(self, *args, **options):
+        if not partitions.is_supported():
+            raise CommandError("Partitioning is only supported on PostgreSQL.")
+
+        if not partitions.is_partitioned():
+            if not options['convert']:
+                raise CommandError("The results table isn't partitioned yet; run with --convert first.")
+            count = partitions.convert(options['months_ahead'])
+            self.stdout.write(self.style.SUCCESS(f"Converted the results table into {count} monthly partitions."))
+            return
+
+        created = partitions.ensure_partitions(options['months_ahead'])
+        for name in created:
+            self.stdout.write(f"Created {name}")
+        self.stdout.write(self.style.SUCCESS(f"{len(partitions.monthly_partitions())} monthly partitions attached."))
@@ -0,0 +1,25 @@
+# assessment/management/commands/prune_analysis_cache.py
+from django.core.management.base import BaseCommand
+from django.db.models import Count, Sum
+
+from assessment.ai_cache import prune
+from assessment.models import AnalysisCacheEntry
+
+
+class Command(BaseCommand):
+    help = "Evicts expired and least recently used AI analysis cache entries and prints cache statistics."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clear', action='store_true', help="Delete every cache entry.")
+
+    def handle(self, *args, **options):
+        if options['clear']:
+            deleted, _ = AnalysisCacheEntry.objects.all().delete()
+        else:
+            deleted = prune()
+        self.stdout.write(f"Deleted {deleted} cache entries.")
+
+        totals = AnalysisCacheEntry.objects.aggregate(entries=Count('id'), hits=Sum('hits'))
+        self.stdout.write(self.style.SUCCESS(
+            f"{totals['entries']} entries remaining, {totals['hits'] or 0} hits served from them."
+        ))
@@ -0,0 +1,133 @@
+# assessment/management/commands/reanalyze_results.py
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from assessment.ai import AICallStats, get_ai_analysis, retry_after
+from assessment.analysis import link_jobs_to_analysis, results_needing_analysis
+from assessment.models import AssessmentResult
+from assessment.recommendations import refresh_recommended_tests
+from assessment.resilience import AIAnalysisError, TokenBucket
+from assessment.usage import record_usage
+
+
+class Command(BaseCommand):
+    help = (
+        "Re-runs the AI for results with no analysis or with the error fallback. "
+        "Safe to interrupt: finished rows are saved in batches, so running it again "
+        "(or passing --after-id) resumes where it stopped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=4, help="Analyses running in parallel.")
+        parser.add_argument('--rpm', type=int, default=60, help="Maximum AI requests per minute (0 = unlimited).")
+        parser.add_argument('--batch-size', type=int, default=100, help="Rows written per bulk_update.")
+        parser.add_argument('--after-id', type=int, default=0, help="Only process results with a larger id.")
+        parser.add_argument('--test', type=int, help="Only process results of this test id.")
+        parser.add_argument('--limit', type=int, help="Stop after this many results.")
+        parser.add_argument('--no-cache', action='store_true', help="Bypass the analysis cache.")
+        parser.add_argument('--dry-run', action='store_true', help="Only count the matching results.")
+
+    def handle(self, *args, **options):
+        queryset = results_needing_analysis().filter(pk__gt=options['after_id'])
+        if options['test']:
+            queryset = queryset.filter(test_id=options['test'])
+
+        total = queryset.count()
+        if options['limit']:
+            total = min(total, options['limit'])
+        self.stdout.write(f"{total} results need analysis.")
+        if options['dry_run'] or not total:
+            return
+
+        rows = (queryset
+                .select_related('test', 'test_version')
+                .only('id', 'user_id', 'answers', 'ai_analysis', 'test__system_prompt', 'test__is_primary_assessment',
+                      'test_version__questions', 'test_version__system_prompt')
+                .order_by('pk'))
+        if options['limit']:
+            rows = rows[:options['limit']]
+
+        self.limiter = TokenBucket(rate=options['rpm'] / 60, capacity=1)
+        self.use_cache = not options['no_cache']
+        self.total = total
+        self.done = self.failed = 0
+        self.started = time.monotonic()
+        self.last_report = 0
+        pending_updates = []
+        max_in_flight = options['concurrency'] * 2
+
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as executor:
+            in_flight = set()
+            try:
+                for result in rows.iterator(chunk_size=options['batch_size']):
+                    if len(in_flight) >= max_in_flight:
+                        finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                        pending_updates += self._collect(finished)
+                    in_flight.add(executor.submit(self._analyze, result))
+
+                    if len(pending_updates) >= options['batch_size']:
+                        self._flush(pending_updates)
+                        pending_updates = []
+
+                finished, _ = wait(in_flight)
+                pending_updates += self._collect(finished)
+            finally:
+                # Whatever happens, keep the analyses we already paid for
+                self._flush(pending_updates)
+
+        self._report(force=True)
+        self.stdout.write(self.style.SUCCESS(f"Finished: {self.done - self.failed} analyzed, {self.failed} failed."))
+
+    def _analyze(self, result):
+        # Wait out a provider incident instead of failing the whole backlog
+        time.sleep(retry_after())
+        self.limiter.acquire()
+        stats = AICallStats()
+        try:
+            ai_analysis = get_ai_analysis(result.rich_answers, result.system_prompt, use_cache=self.use_cache, stats=stats)
+        except AIAnalysisError as e:
+            result.analysis_error = str(e)
+            return result, None
+        else:
+            link_jobs_to_analysis(ai_analysis)
+            result.ai_analysis = ai_analysis
+            result.analysis_error = ''
+            return result, ai_analysis
+        finally:
+            record_usage(result, stats)
+            close_old_connections()
+
+    def _collect(self, futures):
+        updates = []
+        for future in futures:
+            result, ai_analysis = future.result()
+            self.done += 1
+            if ai_analysis is None:
+                self.failed += 1
+            updates.append(result)
+        self._report()
+        return updates
+
+    def _flush(self, results):
+        if results:
+            AssessmentResult.objects.bulk_update(results, ['ai_analysis', 'analysis_error'])
+            # bulk_update skips analyze_result, so keep the dashboards in sync here
+            for user_id in {r.user_id for r in results if r.test.is_primary_assessment and not r.analysis_error}:
+                refresh_recommended_tests(user_id)
+            self.stdout.write(f"Saved up to result id {max(r.pk for r in results)}.")
+
+    def _report(self, force=False):
+        now = time.monotonic()
+        if not force and now - self.last_report < 5:
+            return
+        self.last_report = now
+        elapsed = max(now - self.started, 1e-6)
+        rate = self.done / elapsed
+        remaining = (self.total - self.done) / rate if rate else 0
+        self.stdout.write(
+            f"{self.done}/{self.total} processed ({self.failed} failed), "
+            f"{rate * 60:.1f}/min, ~{remaining:.0f}s remaining"
+        )
@@ -0,0 +1,27 @@
+# assessment/management/commands/run_analysis_worker.py
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from assessment.jobs import run_workers
+
+
+class Command(BaseCommand):
+    help = "Processes queued AI analysis jobs with a pool of worker threads."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--concurrency', type=int, default=settings.ANALYSIS_WORKER_CONCURRENCY,
+            help="Number of analyses processed in parallel.",
+        )
+        parser.add_argument(
+            '--poll-interval', type=float, default=settings.ANALYSIS_WORKER_POLL_INTERVAL,
+            help="Seconds an idle worker waits before checking the queue again.",
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"Starting {options['concurrency']} analysis workers (Ctrl+C to stop)...")
+        try:
+            run_workers(concurrency=options['concurrency'], poll_interval=options['poll_interval'])
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(self.style.SUCCESS("Analysis workers stopped."))
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.7 on 2026-10-18 08:43
+
+import assessment.models
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('assessment', '0003_analysisjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='analysisjob',
+            name='use_cache',
+            field=models.BooleanField(default=True),
+        ),
+        migrations.CreateModel(
+            name='AnalysisCacheEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=64, unique=True)),
+                ('model_name', models.CharField(max_length=100)),
+                ('analysis', models.JSONField(encoder=assessment.models.UnsafeJSONEncoder)),
+                ('hits', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('last_used_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['last_used_at'], name='assessment__last_us_2bd2dc_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-18 08:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('assessment', '0004_analysis_cache'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='assessmentresult',
+            name='analysis_error',
+            field=models.TextField(blank=True),
+        ),
+    ]
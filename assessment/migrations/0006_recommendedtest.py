@@ -0,0 +1,27 @@
+# Generated by Django 5.2.7 on 2026-10-18 08:50
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('assessment', '0005_assessmentresult_analysis_error'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecommendedTest',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('test', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='recommended_for', to='assessment.test')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='recommended_tests', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('user', 'test'), name='unique_recommended_test')],
+            },
+        ),
+    ]
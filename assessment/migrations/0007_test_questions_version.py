@@ -0,0 +1,41 @@
+# Generated by Django 5.2.7 on 2026-10-18 08:52
+
+import hashlib
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def fill_questions_version(apps, schema_editor):
+    # Historical models don't have Test.save(), so hash the existing rows here
+    # (same as Test.hash_questions)
+    Test = apps.get_model('assessment', 'Test')
+    now = timezone.now()
+    for test in Test.objects.only('id', 'questions'):
+        serialized = json.dumps(test.questions, cls=DjangoJSONEncoder, ensure_ascii=False, sort_keys=True)
+        test.questions_version = hashlib.sha256(serialized.encode('utf-8')).hexdigest()
+        test.questions_updated_at = now
+        test.save(update_fields=['questions_version', 'questions_updated_at'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('assessment', '0006_recommendedtest'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='test',
+            name='questions_updated_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='test',
+            name='questions_version',
+            field=models.CharField(blank=True, editable=False, max_length=64),
+        ),
+        migrations.RunPython(fill_questions_version, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.7 on 2026-10-18 08:57
+
+import django.db.models.functions.text
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('assessment', '0007_test_questions_version'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='assessmentresult',
+            index=models.Index(fields=['user', 'created_at'], name='result_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='assessmentresult',
+            index=models.Index(fields=['user', 'test'], name='result_user_test_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='job',
+            index=models.Index(django.db.models.functions.text.Lower('name'), name='job_name_lower_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='test',
+            index=models.Index(condition=models.Q(('is_primary_assessment', True)), fields=['order'], name='test_primary_order_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='test',
+            index=models.Index(django.db.models.functions.text.Lower('name'), name='test_name_lower_idx'),
+        ),
+    ]
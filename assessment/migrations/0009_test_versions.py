@@ -0,0 +1,48 @@
+# Generated by Django 5.2.7 on 2026-10-18 09:05
+
+import assessment.models
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('assessment', '0008_hot_lookup_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TestVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('number', models.PositiveIntegerField()),
+                ('questions', models.JSONField(encoder=assessment.models.UnsafeJSONEncoder)),
+                ('system_prompt', models.TextField()),
+                ('content_hash', models.CharField(max_length=64)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('test', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='versions', to='assessment.test')),
+            ],
+            options={
+                'ordering': ['test', 'number'],
+            },
+        ),
+        migrations.AddField(
+            model_name='assessmentresult',
+            name='test_version',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.RESTRICT, related_name='results', to='assessment.testversion'),
+        ),
+        migrations.AddField(
+            model_name='test',
+            name='current_version',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='assessment.testversion'),
+        ),
+        migrations.AddConstraint(
+            model_name='testversion',
+            constraint=models.UniqueConstraint(fields=('test', 'number'), name='unique_test_version_number'),
+        ),
+        migrations.AddConstraint(
+            model_name='testversion',
+            constraint=models.UniqueConstraint(fields=('test', 'content_hash'), name='unique_test_version_content'),
+        ),
+    ]
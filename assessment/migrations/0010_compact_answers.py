@@ -0,0 +1,84 @@
+import hashlib
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import migrations
+
+BATCH_SIZE = 1000
+
+
+def in_batches(queryset):
+    """Lists of rows by primary key, so updating them doesn't disturb the iteration (SQLite)."""
+    last_pk = 0
+    while True:
+        batch = list(queryset.filter(pk__gt=last_pk).order_by('pk')[:BATCH_SIZE])
+        if not batch:
+            return
+        yield batch
+        last_pk = batch[-1].pk
+
+
+def hash_content(questions, system_prompt):
+    # Same as TestVersion.hash_content
+    serialized = json.dumps([questions, system_prompt], cls=DjangoJSONEncoder, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(serialized.encode('utf-8')).hexdigest()
+
+
+def compact_answers(apps, schema_editor):
+    Test = apps.get_model('assessment', 'Test')
+    TestVersion = apps.get_model('assessment', 'TestVersion')
+    AssessmentResult = apps.get_model('assessment', 'AssessmentResult')
+
+    for test in Test.objects.all():
+        version = TestVersion.objects.create(
+            test=test, number=1, questions=test.questions, system_prompt=test.system_prompt,
+            content_hash=hash_content(test.questions, test.system_prompt),
+        )
+        Test.objects.filter(pk=test.pk).update(current_version=version)
+
+        texts = {str(q.get('id')): q.get('question') for q in test.questions if isinstance(q, dict)}
+        results = AssessmentResult.objects.filter(test=test, test_version__isnull=True).only('id', 'answers')
+        for batch in in_batches(results):
+            compacted = []
+            for result in batch:
+                responses = result.answers.get('responses') if isinstance(result.answers, dict) else None
+                if not isinstance(responses, list) or result.answers.get('user_info'):
+                    continue
+                # Only rows answered against today's questions can be rebuilt from the
+                # snapshot; results of since-edited questions keep their rich answers
+                if any(texts.get(str(r.get('question_id'))) != r.get('question_text') for r in responses):
+                    continue
+                result.answers = {str(r['question_id']): r['answer'] for r in responses}
+                result.test_version = version
+                compacted.append(result)
+            AssessmentResult.objects.bulk_update(compacted, ['answers', 'test_version'])
+
+
+def expand_answers(apps, schema_editor):
+    AssessmentResult = apps.get_model('assessment', 'AssessmentResult')
+
+    results = AssessmentResult.objects.filter(test_version__isnull=False).select_related('test_version')
+    for batch in in_batches(results):
+        for result in batch:
+            questions = {str(q.get('id')): q for q in result.test_version.questions}
+            result.answers = {'user_info': {}, 'responses': [
+                {
+                    'question_id': questions[key].get('id') if key in questions else key,
+                    'question_text': questions[key].get('question') if key in questions else None,
+                    'answer': answer,
+                }
+                for key, answer in result.answers.items()
+            ]}
+            result.test_version = None
+        AssessmentResult.objects.bulk_update(batch, ['answers', 'test_version'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('assessment', '0009_test_versions'),
+    ]
+
+    operations = [
+        migrations.RunPython(compact_answers, expand_answers),
+    ]
@@ -0,0 +1,117 @@
+# Generated by Django 5.2.7 on 2026-10-18 09:13
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, F
+
+
+def collapse_drafts(apps, schema_editor):
+    """
+    Drafts used to be saved as a new result on every save. A result that was
+    never analyzed and never queued is one of those; keep the newest one per
+    (user, test) as the draft and delete the rest.
+    """
+    AssessmentResult = apps.get_model('assessment', 'AssessmentResult')
+    CustomUser = apps.get_model('account', 'CustomUser')
+    AssessmentCountBucket = apps.get_model('account', 'AssessmentCountBucket')
+
+    drafts = (AssessmentResult.objects
+              .filter(ai_analysis__isnull=True, analysis_error='', analysis_jobs__isnull=True)
+              .order_by('user_id', 'test_id', '-created_at', '-id')
+              .values_list('id', 'user_id', 'test_id'))
+
+    keep, delete, uncounted = [], [], {}
+    seen = set()
+    for result_id, user_id, test_id in drafts.iterator(chunk_size=2000):
+        if (user_id, test_id) in seen:
+            delete.append(result_id)
+        else:
+            seen.add((user_id, test_id))
+            keep.append(result_id)
+        # Drafts no longer count towards the rank, kept or not
+        uncounted[user_id] = uncounted.get(user_id, 0) + 1
+
+    for offset in range(0, len(keep), 1000):
+        AssessmentResult.objects.filter(pk__in=keep[offset:offset + 1000]).update(is_draft=True)
+    for offset in range(0, len(delete), 1000):
+        AssessmentResult.objects.filter(pk__in=delete[offset:offset + 1000]).delete()
+
+    if uncounted:
+        for user_id, n in uncounted.items():
+            CustomUser.objects.filter(pk=user_id).update(assessment_count=F('assessment_count') - n)
+        AssessmentCountBucket.objects.all().delete()
+        AssessmentCountBucket.objects.bulk_create([
+            AssessmentCountBucket(assessment_count=row['assessment_count'], users=row['users'])
+            for row in CustomUser.objects.order_by().values('assessment_count').annotate(users=Count('pk'))
+        ])
+
+
+def uncollapse_drafts(apps, schema_editor):
+    # The deleted duplicates are gone; count the remaining drafts again
+    AssessmentResult = apps.get_model('assessment', 'AssessmentResult')
+    CustomUser = apps.get_model('account', 'CustomUser')
+    AssessmentCountBucket = apps.get_model('account', 'AssessmentCountBucket')
+
+    counts = AssessmentResult.objects.filter(is_draft=True).order_by().values('user_id').annotate(n=Count('pk'))
+    for row in counts:
+        CustomUser.objects.filter(pk=row['user_id']).update(assessment_count=F('assessment_count') + row['n'])
+    AssessmentCountBucket.objects.all().delete()
+    AssessmentCountBucket.objects.bulk_create([
+        AssessmentCountBucket(assessment_count=row['assessment_count'], users=row['users'])
+        for row in CustomUser.objects.order_by().values('assessment_count').annotate(users=Count('pk'))
+    ])
+
+
+def _is_partitioned(schema_editor, table):
+    if schema_editor.connection.vendor != 'postgresql':
+        return False
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_partitioned_table WHERE partrelid = %s::regclass", [table])
+        return cursor.fetchone() is not None
+
+
+class AddDraftConstraint(migrations.AddConstraint):
+    """
+    On a results table already partitioned by `partition_results --convert`,
+    PostgreSQL refuses a unique index without the partition key, so it gets
+    a plain index on the same columns instead (what --convert itself does).
+    """
+
+    def _index(self):
+        return models.Index(fields=self.constraint.fields, condition=self.constraint.condition, name=self.constraint.name)
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        model = to_state.apps.get_model(app_label, self.model_name)
+        if self.allow_migrate_model(schema_editor.connection.alias, model) and _is_partitioned(schema_editor, model._meta.db_table):
+            schema_editor.add_index(model, self._index())
+        else:
+            super().database_forwards(app_label, schema_editor, from_state, to_state)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        model = to_state.apps.get_model(app_label, self.model_name)
+        if self.allow_migrate_model(schema_editor.connection.alias, model) and _is_partitioned(schema_editor, model._meta.db_table):
+            schema_editor.remove_index(model, self._index())
+        else:
+            super().database_backwards(app_label, schema_editor, from_state, to_state)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('assessment', '0010_compact_answers'),
+        ('account', '0005_otp_phone_created_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='assessmentresult',
+            name='is_draft',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.RunPython(collapse_drafts, uncollapse_drafts),
+        AddDraftConstraint(
+            model_name='assessmentresult',
+            constraint=models.UniqueConstraint(condition=models.Q(('is_draft', True)), fields=('user', 'test'), name='unique_draft_per_user_test'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.7 on 2026-10-18 09:28
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('assessment', '0011_single_draft'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnalysisUsage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('provider', models.CharField(max_length=20)),
+                ('model_name', models.CharField(max_length=100)),
+                ('latency_ms', models.PositiveIntegerField()),
+                ('prompt_tokens', models.PositiveIntegerField(blank=True, null=True)),
+                ('completion_tokens', models.PositiveIntegerField(blank=True, null=True)),
+                ('retries', models.PositiveSmallIntegerField(default=0)),
+                ('cache_hit', models.BooleanField(default=False)),
+                ('streamed', models.BooleanField(default=False)),
+                ('succeeded', models.BooleanField(default=True)),
+                ('cost', models.DecimalField(blank=True, decimal_places=6, max_digits=12, null=True)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('result', models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='analysis_usage', to='assessment.assessmentresult')),
+                ('test', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='analysis_usage', to='assessment.test')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['created_at', 'test'], name='usage_created_test_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-18 09:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('assessment', '0012_analysis_usage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='analysisusage',
+            name='hedged',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.7 on 2026-10-18 09:46
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('assessment', '0013_analysis_usage_hedged'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='job',
+            name='job_name_lower_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='test',
+            name='test_name_lower_idx',
+        ),
+    ]
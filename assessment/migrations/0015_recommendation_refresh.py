@@ -0,0 +1,20 @@
+# Generated by Django 5.2.7 on 2026-10-18 09:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('assessment', '0014_drop_name_lower_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecommendationRefresh',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('requested_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
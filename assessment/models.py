@@ -1,6 +1,8 @@
 from django.db import models
 from django.conf import settings
 from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+import hashlib
 import json
 
 # This encoder is still needed for our JSONFields
@@ -40,12 +42,99 @@ class Test(models.Model):
     
     order = models.PositiveIntegerField(default=0)
 
+    # Hash of `questions` and when it last changed, kept up to date by save().
+    # Used as the ETag of the questions API and the key of its cache.
+    questions_version = models.CharField(max_length=64, blank=True, editable=False)
+    questions_updated_at = models.DateTimeField(null=True, blank=True, editable=False)
+    # Snapshot of the current questions and prompt; new results point to it
+    current_version = models.ForeignKey('TestVersion', on_delete=models.SET_NULL, null=True, blank=True, editable=False, related_name='+')
+
     class Meta:
         ordering = ['order']
+        indexes = [
+            # The primary assessment lookup. Partial, because Django filters booleans
+            # as a bare `WHERE is_primary_assessment`, which SQLite can't match
+            # against a plain (is_primary_assessment, order) index
+            models.Index(fields=['order'], condition=models.Q(is_primary_assessment=True), name='test_primary_order_idx'),
+        ]
 
     def __str__(self):
         return self.name
 
+    @staticmethod
+    def hash_questions(questions):
+        serialized = json.dumps(questions, cls=DjangoJSONEncoder, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(serialized.encode('utf-8')).hexdigest()
+
+    def save(self, *args, **kwargs):
+        version = self.hash_questions(self.questions)
+        if version != self.questions_version:
+            self.questions_version = version
+            self.questions_updated_at = timezone.now()
+            update_fields = kwargs.get('update_fields')
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'questions_version', 'questions_updated_at'}
+        super().save(*args, **kwargs)
+        self._snapshot_version()
+
+    def _snapshot_version(self):
+        """Points current_version at a TestVersion with the current questions and prompt, creating it if needed."""
+        content_hash = TestVersion.hash_content(self.questions, self.system_prompt)
+        if self.current_version_id and self.current_version.content_hash == content_hash:
+            return
+
+        # Reverting an edit goes back to the old version instead of making a new one
+        version = self.versions.filter(content_hash=content_hash).first()
+        if version is None:
+            number = (self.versions.aggregate(models.Max('number'))['number__max'] or 0) + 1
+            version = TestVersion.objects.create(
+                test=self, number=number, content_hash=content_hash,
+                questions=self.questions, system_prompt=self.system_prompt,
+            )
+        self.current_version = version
+        Test.objects.filter(pk=self.pk).update(current_version=version)
+
+
+class TestVersion(models.Model):
+    """
+    Immutable snapshot of a test's questions and system prompt. Results keep
+    only {question_id: answer} and point to the version they answered, which
+    is enough to rebuild the full questions-and-answers form on read.
+    """
+    test = models.ForeignKey(Test, on_delete=models.CASCADE, related_name='versions')
+    number = models.PositiveIntegerField()
+    questions = models.JSONField(encoder=UnsafeJSONEncoder)
+    system_prompt = models.TextField()
+    content_hash = models.CharField(max_length=64)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['test', 'number']
+        constraints = [
+            models.UniqueConstraint(fields=['test', 'number'], name='unique_test_version_number'),
+            models.UniqueConstraint(fields=['test', 'content_hash'], name='unique_test_version_content'),
+        ]
+
+    def __str__(self):
+        return f"{self.test.name} v{self.number}"
+
+    @staticmethod
+    def hash_content(questions, system_prompt):
+        serialized = json.dumps([questions, system_prompt], cls=DjangoJSONEncoder, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(serialized.encode('utf-8')).hexdigest()
+
+    def rehydrate(self, compact_answers):
+        """{question_id: answer} -> the rich {'user_info', 'responses'} form the frontend submitted."""
+        responses = []
+        remaining = dict(compact_answers)
+        for question in self.questions:
+            key = str(question.get('id'))
+            if key in remaining:
+                responses.append({'question_id': question.get('id'), 'question_text': question.get('question'), 'answer': remaining.pop(key)})
+        # Answers to questions this version doesn't have (shouldn't happen, but don't lose them)
+        responses += [{'question_id': key, 'question_text': None, 'answer': answer} for key, answer in remaining.items()]
+        return {'user_info': {}, 'responses': responses}
+
 # --- UPGRADED MODEL ---
 
 class AssessmentResult(models.Model):
@@ -54,12 +143,186 @@ class AssessmentResult(models.Model):
     
     # NEW: Link to the specific Test that was taken
     test = models.ForeignKey(Test, on_delete=models.CASCADE, related_name="results")
+    # The questions and prompt the user actually answered. When set, `answers`
+    # is compact ({question_id: answer}); older rows keep the rich form.
+    test_version = models.ForeignKey(TestVersion, on_delete=models.RESTRICT, null=True, blank=True, related_name="results")
     
     answers = models.JSONField(encoder=UnsafeJSONEncoder)
     ai_analysis = models.JSONField(encoder=UnsafeJSONEncoder, null=True, blank=True)
+    # Why the last AI call failed; ai_analysis stays empty so the result can be re-run
+    analysis_error = models.TextField(blank=True)
+    # Answers still being filled in (autosaved); becomes a real result when analysis is requested
+    is_draft = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # History pages and the latest primary analysis: a user's results, newest first
+            models.Index(fields=['user', 'created_at'], name='result_user_created_idx'),
+            # A user's results of one test
+            models.Index(fields=['user', 'test'], name='result_user_test_idx'),
+        ]
+        constraints = [
+            # Autosave upserts this one row (see drafts.py)
+            models.UniqueConstraint(fields=['user', 'test'], condition=models.Q(is_draft=True), name='unique_draft_per_user_test'),
+        ]
+
     def __str__(self):
         return f"Result for {self.user.phone_number} on test '{self.test.name}'"
 
+    @staticmethod
+    def compact_answers(answers_data):
+        """
+        The submitted {'responses': [{question_id, question_text, answer}, ...]} -> {question_id: answer}.
+        A submission carrying anything else (a filled-in user_info) is kept in
+        the rich form, like the 0010 migration does. Raises ValueError for a
+        malformed one.
+        """
+        if not isinstance(answers_data, dict):
+            raise ValueError("Expected an object of answers")
+        if 'responses' not in answers_data:
+            return answers_data
+        responses = answers_data['responses']
+        if not isinstance(responses, list) or not all(
+                isinstance(item, dict) and 'question_id' in item and 'answer' in item for item in responses):
+            raise ValueError("Every response needs a question_id and an answer")
+        if any(value for key, value in answers_data.items() if key != 'responses'):
+            return answers_data
+        return {str(item['question_id']): item['answer'] for item in responses}
+
+    @property
+    def rich_answers(self):
+        """The answers with their question texts, as the frontend submitted them."""
+        if self.test_version_id is None or (isinstance(self.answers, dict) and 'responses' in self.answers):
+            return self.answers
+        return self.test_version.rehydrate(self.answers)
+
+    @property
+    def system_prompt(self):
+        """The prompt of the version the user answered (the test's current one for older rows)."""
+        if self.test_version_id is not None:
+            return self.test_version.system_prompt
+        return self.test.system_prompt
+
+
+
+class RecommendedTest(models.Model):
+    """
+    Materialized dashboard recommendation: a test whose job appears in the
+    user's latest analyzed primary assessment. Maintained by
+    recommendations.refresh_recommended_tests.
+    """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="recommended_tests")
+    test = models.ForeignKey(Test, on_delete=models.CASCADE, related_name="recommended_for")
+
+    class Meta:
+        constraints = [
+            # Also the index the dashboard looks users up by
+            models.UniqueConstraint(fields=['user', 'test'], name='unique_recommended_test'),
+        ]
+
+    def __str__(self):
+        return f"{self.test_id} recommended for user {self.user_id}"
+
+
+class RecommendationRefresh(models.Model):
+    """
+    A pending rebuild of every user's RecommendedTest rows, requested when a
+    test is linked to another job or a job is renamed or deleted. The
+    analysis worker (or backfill_recommended_tests) runs it and deletes it.
+    """
+    requested_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Recommendation refresh requested at {self.requested_at}"
+
+
+class AnalysisJob(models.Model):
+    """A queued AI analysis of one AssessmentResult, processed by the worker pool."""
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_DONE, 'Done'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    result = models.ForeignKey(AssessmentResult, on_delete=models.CASCADE, related_name="analysis_jobs")
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    # False when the user asked for a fresh analysis instead of a cached one
+    use_cache = models.BooleanField(default=True)
+    attempts = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['created_at']
+        indexes = [
+            # The worker claims the oldest pending job on every poll
+            models.Index(fields=['status', 'created_at']),
+        ]
+
+    def __str__(self):
+        return f"Analysis job #{self.pk} ({self.status}) for result {self.result_id}"
+
+
+class AnalysisUsage(models.Model):
+    """
+    Latency, tokens and cost of one AI analysis call (cache hits included),
+    for the usage report in the admin (see usage.py).
+    """
+    # No database constraint: results are archived with raw deletes and may
+    # live in a partitioned table, and the usage history should outlive them
+    result = models.ForeignKey(AssessmentResult, on_delete=models.SET_NULL, null=True, blank=True,
+                               db_constraint=False, related_name="analysis_usage")
+    test = models.ForeignKey(Test, on_delete=models.CASCADE, related_name="analysis_usage")
+    provider = models.CharField(max_length=20)
+    model_name = models.CharField(max_length=100)
+    latency_ms = models.PositiveIntegerField()
+    prompt_tokens = models.PositiveIntegerField(null=True, blank=True)
+    completion_tokens = models.PositiveIntegerField(null=True, blank=True)
+    retries = models.PositiveSmallIntegerField(default=0)
+    cache_hit = models.BooleanField(default=False)
+    streamed = models.BooleanField(default=False)
+    succeeded = models.BooleanField(default=True)
+    # A hedged request was raced against this one. The tokens are the answering
+    # call's, the cost covers both requests (see usage.py)
+    hedged = models.BooleanField(default=False)
+    # USD, from AI_TOKEN_PRICES at the time of the call; None for models without a price
+    cost = models.DecimalField(max_digits=12, decimal_places=6, null=True, blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            # The report reads a time window and groups it by test
+            models.Index(fields=['created_at', 'test'], name='usage_created_test_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.model_name} call for result {self.result_id} ({self.latency_ms} ms)"
+
+
+class AnalysisCacheEntry(models.Model):
+    """A stored AI analysis, keyed by a hash of (system prompt, model name, normalized answers)."""
+    key = models.CharField(max_length=64, unique=True)
+    model_name = models.CharField(max_length=100)
+    analysis = models.JSONField(encoder=UnsafeJSONEncoder)
+    hits = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(default=timezone.now)
+    last_used_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            # Size-bounded eviction drops the least recently used entries first
+            models.Index(fields=['last_used_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.model_name} analysis {self.key[:12]}"
+
 # The old Question and Choice models should be deleted.
\ No newline at end of file
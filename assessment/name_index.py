@@ -0,0 +1,110 @@
+# assessment/name_index.py
+"""
+In-memory index of Test names and related Job names, used to link the jobs
+the AI recommends to our tests without querying the database.
+
+Names are compared after Persian normalization (Arabic ي/ك, ZWNJ, diacritics,
+digits, extra spaces), so "برنامه‌نویس" and "برنامه  نويس" find the same test.
+The index is built from the cached test catalog (see catalog.py) and
+rebuilt whenever the catalog version changes, i.e. after a Job or Test is
+saved or deleted in any process.
+"""
+import bisect
+import re
+import threading
+
+from . import catalog
+
+_CHAR_MAP = str.maketrans({
+    'ي': 'ی', 'ى': 'ی', 'ك': 'ک', 'ة': 'ه', 'ۀ': 'ه', 'أ': 'ا', 'إ': 'ا', 'ٱ': 'ا',
+    '\u200c': ' ', '\u200d': ' ', '\u0640': '',  # ZWNJ, ZWJ, tatweel
+    **{persian: str(i) for i, persian in enumerate('۰۱۲۳۴۵۶۷۸۹')},
+    **{arabic: str(i) for i, arabic in enumerate('٠١٢٣٤٥٦٧٨٩')},
+})
+_DIACRITICS = re.compile('[\u064b-\u0652\u0670]')
+_SEPARATORS = re.compile(r'[\s\-_/،,.()]+')
+
+
+def normalize_name(text):
+    if not text:
+        return ''
+    text = _DIACRITICS.sub('', text.translate(_CHAR_MAP)).lower()
+    return ' '.join(_SEPARATORS.split(text)).strip()
+
+
+class NameIndex:
+    def __init__(self, tests):
+        """`tests` is an iterable of (test_id, test_name, related_job_name) in priority order."""
+        self.by_job_name = {}
+        self.by_test_name = {}
+        self.names = []  # (normalized test name, test id), in priority order
+        self.tokens = []  # sorted (token, position in self.names)
+
+        for test_id, test_name, job_name in tests:
+            name = normalize_name(test_name)
+            if job_name:
+                self.by_job_name.setdefault(normalize_name(job_name), test_id)
+            self.by_test_name.setdefault(name, test_id)
+            position = len(self.names)
+            self.names.append((name, test_id))
+            self.tokens.extend((token, position) for token in name.split())
+        self.tokens.sort()
+
+    def _prefix_matches(self, query_tokens):
+        """Positions of names in which every query token starts one of the name's tokens."""
+        first = query_tokens[0]
+        start = bisect.bisect_left(self.tokens, (first,))
+        candidates = set()
+        for token, position in self.tokens[start:]:
+            if not token.startswith(first):
+                break
+            candidates.add(position)
+
+        matches = []
+        for position in sorted(candidates):
+            name_tokens = self.names[position][0].split()
+            if all(any(t.startswith(q) for t in name_tokens) for q in query_tokens[1:]):
+                matches.append(position)
+        return matches
+
+    def find_test_id(self, job_name):
+        query = normalize_name(job_name)
+        if not query:
+            return None
+
+        if query in self.by_job_name:
+            return self.by_job_name[query]
+        if query in self.by_test_name:
+            return self.by_test_name[query]
+
+        matches = self._prefix_matches(query.split())
+        if matches:
+            return self.names[matches[0]][1]
+
+        # Same as the old name__icontains fallback
+        for name, test_id in self.names:
+            if query in name:
+                return test_id
+        return None
+
+
+_index = None
+_index_version = None
+_lock = threading.Lock()
+
+
+def get_index():
+    global _index, _index_version
+    version = catalog.get_version()
+    with _lock:
+        if _index is not None and _index_version == version:
+            return _index
+
+    index = NameIndex((t['id'], t['name'], t['related_job_name']) for t in catalog.get_catalog())
+    with _lock:
+        _index, _index_version = index, version
+    return index
+
+
+def find_related_test_id(job_name):
+    return get_index().find_test_id(job_name)
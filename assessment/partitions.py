@@ -0,0 +1,177 @@
+# assessment/partitions.py
+"""
+Monthly range partitioning of AssessmentResult on created_at (PostgreSQL only).
+
+`python manage.py partition_results --convert` turns the existing table into
+a partitioned one (needs a maintenance window: it copies every row), and
+`python manage.py partition_results` keeps partitions created a few months
+ahead; run it from cron. Rows outside every monthly partition land in the
+default partition, so inserts never fail because a partition is missing.
+
+PostgreSQL requires the partition key in every unique constraint, so the
+primary key becomes (id, created_at) and foreign keys *into* the results
+table (AnalysisJob.result) can't be enforced by the database anymore.
+Django still cascades deletes for them.
+"""
+from datetime import datetime
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import AssessmentResult
+
+TABLE = AssessmentResult._meta.db_table
+DEFAULT_PARTITION = f'{TABLE}_default'
+
+
+def month_start(value):
+    """The first instant of value's month (a date or datetime), timezone-aware."""
+    if isinstance(value, datetime) and timezone.is_aware(value):
+        value = timezone.localtime(value)
+    return timezone.make_aware(datetime(value.year, value.month, 1))
+
+
+def next_month(start):
+    return month_start(datetime(start.year + start.month // 12, start.month % 12 + 1, 1))
+
+
+def partition_name(start):
+    return f'{TABLE}_p{start:%Y_%m}'
+
+
+def is_supported():
+    return connection.vendor == 'postgresql'
+
+
+def is_partitioned():
+    if not is_supported():
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_partitioned_table WHERE partrelid = %s::regclass", [TABLE])
+        return cursor.fetchone() is not None
+
+
+def monthly_partitions():
+    """{month start: partition table name} of the attached monthly partitions."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = %s::regclass", [TABLE]
+        )
+        names = [row[0] for row in cursor.fetchall()]
+    partitions = {}
+    for name in names:
+        if name != DEFAULT_PARTITION:
+            year, month = name.rsplit('_p', 1)[1].split('_')
+            partitions[month_start(datetime(int(year), int(month), 1))] = name
+    return partitions
+
+
+def create_partition(start):
+    """Creates the partition of the month starting at `start` if it doesn't exist. Returns its name."""
+    name = partition_name(start)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'CREATE TABLE IF NOT EXISTS "{name}" PARTITION OF "{TABLE}" FOR VALUES FROM (%s) TO (%s)',
+            [start, next_month(start)],
+        )
+    return name
+
+
+def ensure_partitions(months_ahead=3):
+    """Creates the partitions of this month and the next `months_ahead` months. Returns the new names."""
+    existing = set(monthly_partitions().values())
+    start = month_start(timezone.now())
+    created = []
+    for _ in range(months_ahead + 1):
+        # A month that already has rows in the default partition can't get its own
+        # partition until they are moved; archive or convert those first
+        if partition_name(start) not in existing and not _default_has_rows(start):
+            created.append(create_partition(start))
+        start = next_month(start)
+    return created
+
+
+def _default_has_rows(start):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'SELECT 1 FROM "{DEFAULT_PARTITION}" WHERE created_at >= %s AND created_at < %s LIMIT 1',
+            [start, next_month(start)],
+        )
+        return cursor.fetchone() is not None
+
+
+def detach_partition(name, drop=True):
+    with connection.cursor() as cursor:
+        cursor.execute(f'ALTER TABLE "{TABLE}" DETACH PARTITION "{name}"')
+        if drop:
+            cursor.execute(f'DROP TABLE "{name}"')
+
+
+def convert(months_ahead=3):
+    """
+    Rebuilds the results table as a partitioned table with one partition per
+    month that has rows (plus `months_ahead` future months) and copies the
+    rows over, all in one transaction. Returns the number of partitions.
+    """
+    legacy = f'{TABLE}_unpartitioned'
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f'LOCK TABLE "{TABLE}" IN ACCESS EXCLUSIVE MODE')
+
+        # Index and foreign key definitions, to recreate them on the new table
+        cursor.execute(
+            "SELECT indexname, indexdef FROM pg_indexes WHERE tablename = %s "
+            "AND indexname NOT IN (SELECT conname FROM pg_constraint WHERE conrelid = %s::regclass AND contype IN ('p', 'u'))",
+            [TABLE, TABLE],
+        )
+        indexes = cursor.fetchall()
+        cursor.execute(
+            "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint WHERE conrelid = %s::regclass AND contype = 'f'",
+            [TABLE],
+        )
+        foreign_keys = cursor.fetchall()
+        # Foreign keys pointing at the results table (AnalysisJob.result)
+        cursor.execute(
+            "SELECT conrelid::regclass::text, conname FROM pg_constraint WHERE confrelid = %s::regclass AND contype = 'f'",
+            [TABLE],
+        )
+        for table, constraint in cursor.fetchall():
+            cursor.execute(f'ALTER TABLE {table} DROP CONSTRAINT "{constraint}"')
+
+        cursor.execute(f'ALTER TABLE "{TABLE}" RENAME TO "{legacy}"')
+        for index_name, _ in indexes:
+            cursor.execute(f'ALTER INDEX "{index_name}" RENAME TO "{index_name[:48]}_unpartitioned"')
+
+        cursor.execute(
+            f'CREATE TABLE "{TABLE}" (LIKE "{legacy}" INCLUDING DEFAULTS INCLUDING IDENTITY INCLUDING CONSTRAINTS, '
+            f'PRIMARY KEY (id, created_at)) PARTITION BY RANGE (created_at)'
+        )
+        for _, definition in indexes:
+            if definition.startswith('CREATE UNIQUE INDEX') and 'created_at' not in definition:
+                # Uniqueness without the partition key can't be enforced anymore; the one
+                # draft per (user, test) then rests on update_or_create alone
+                definition = definition.replace('CREATE UNIQUE INDEX', 'CREATE INDEX', 1)
+            cursor.execute(definition)  # still names the original table, which is now the new one
+        for constraint, definition in foreign_keys:
+            cursor.execute(f'ALTER TABLE "{TABLE}" ADD CONSTRAINT "{constraint}" {definition}')
+        cursor.execute(f'CREATE TABLE "{DEFAULT_PARTITION}" PARTITION OF "{TABLE}" DEFAULT')
+
+        cursor.execute(f'SELECT min(created_at), max(created_at) FROM "{legacy}"')
+        first, last = cursor.fetchone()
+        start = month_start(first or timezone.now())
+        end = next_month(month_start(max(last or timezone.now(), timezone.now())))
+        for _ in range(months_ahead):
+            end = next_month(end)
+        count = 0
+        while start < end:
+            create_partition(start)
+            start = next_month(start)
+            count += 1
+
+        cursor.execute(f'INSERT INTO "{TABLE}" SELECT * FROM "{legacy}"')
+        cursor.execute(
+            f"SELECT setval(pg_get_serial_sequence(%s, 'id'), coalesce(max(id), 0) + 1, false) FROM \"{TABLE}\"",
+            [TABLE],
+        )
+        cursor.execute(f'DROP TABLE "{legacy}"')
+    return count
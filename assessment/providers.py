@@ -0,0 +1,295 @@
+# assessment/providers.py
+"""
+AI provider backends.
+
+Every provider turns (system prompt, user message) into the raw response
+text, either at once (`generate`, which returns a Completion) or chunk by
+chunk (`stream`, which yields the text and finally the Usage if the
+provider reported one). Which one
+is used is chosen with the AI_PROVIDER setting; AI_HEDGE_PROVIDER names an
+optional second provider for hedged requests (see ai.get_ai_analysis).
+
+Each provider has its own AIGuard (rate limit, retries, circuit breaker)
+and LatencyTracker, so an incident at one provider doesn't trip the other.
+
+`agenerate` and `astream` are the async counterparts, used by the async
+views under ASGI. They use the provider's native async client, so a
+waiting analysis costs no thread.
+"""
+import asyncio
+import hashlib
+import json
+import random
+import threading
+import time
+import weakref
+from collections import namedtuple
+
+from asgiref.sync import sync_to_async
+from decouple import config
+from django.conf import settings
+
+from .resilience import AIGuard, CircuitBreaker, LatencyTracker, TokenBucket
+
+# Token counts as reported by the provider (None when it didn't say)
+Usage = namedtuple('Usage', ['prompt_tokens', 'completion_tokens'])
+Completion = namedtuple('Completion', ['text', 'usage'])
+
+
+class AIProvider:
+    name = None
+    model_name = None
+
+    def __init__(self):
+        self.guard = AIGuard(
+            limiter=TokenBucket(rate=settings.AI_RATE_LIMIT_PER_MINUTE / 60, capacity=settings.AI_RATE_LIMIT_BURST),
+            breaker=CircuitBreaker(
+                failure_threshold=settings.AI_CIRCUIT_FAILURE_THRESHOLD,
+                reset_timeout=settings.AI_CIRCUIT_RESET_TIMEOUT,
+            ),
+            timeout=settings.AI_REQUEST_TIMEOUT,
+            total_timeout=settings.AI_TOTAL_TIMEOUT,
+            max_retries=settings.AI_MAX_RETRIES,
+            base_delay=settings.AI_RETRY_BASE_DELAY,
+            max_delay=settings.AI_RETRY_MAX_DELAY,
+        )
+        self.latency = LatencyTracker()
+
+    def generate(self, system_prompt, user_message, timeout):
+        """Returns the complete response as a Completion."""
+        raise NotImplementedError
+
+    def stream(self, system_prompt, user_message, timeout):
+        """Yields the response text in chunks as it is generated, then its Usage (if known)."""
+        raise NotImplementedError
+
+    async def agenerate(self, system_prompt, user_message, timeout):
+        """generate() for async callers. Without a native async client it runs in a thread."""
+        return await sync_to_async(self.generate, thread_sensitive=False)(system_prompt, user_message, timeout)
+
+    async def astream(self, system_prompt, user_message, timeout):
+        """stream() for async callers. Without a native async client each chunk is fetched in a thread."""
+        chunks = self.stream(system_prompt, user_message, timeout)
+        next_chunk = sync_to_async(next, thread_sensitive=False)
+        while True:
+            chunk = await next_chunk(chunks, None)
+            if chunk is None:
+                return
+            yield chunk
+
+
+class GeminiProvider(AIProvider):
+    name = 'gemini'
+
+    def __init__(self):
+        super().__init__()
+        import google.generativeai as genai
+
+        # Configure the Google AI client with your secret key
+        genai.configure(api_key=config('GOOGLE_API_KEY'))
+        self.genai = genai
+        self.model_name = settings.GEMINI_MODEL
+
+    def _model(self, system_prompt):
+        return self.genai.GenerativeModel(
+            model_name=self.model_name,
+            system_instruction=system_prompt
+        )
+
+    @staticmethod
+    def _usage(response):
+        metadata = getattr(response, 'usage_metadata', None)
+        if not metadata or not metadata.prompt_token_count:
+            return None
+        return Usage(metadata.prompt_token_count, metadata.candidates_token_count)
+
+    def generate(self, system_prompt, user_message, timeout):
+        response = self._model(system_prompt).generate_content(user_message, request_options={'timeout': timeout})
+        return Completion(response.text, self._usage(response))
+
+    def stream(self, system_prompt, user_message, timeout):
+        response = self._model(system_prompt).generate_content(user_message, stream=True, request_options={'timeout': timeout})
+        usage = None
+        for chunk in response:
+            # Every chunk carries the running totals; the last one has the final counts
+            usage = self._usage(chunk) or usage
+            yield chunk.text
+        if usage:
+            yield usage
+
+    async def agenerate(self, system_prompt, user_message, timeout):
+        response = await self._model(system_prompt).generate_content_async(user_message, request_options={'timeout': timeout})
+        return Completion(response.text, self._usage(response))
+
+    async def astream(self, system_prompt, user_message, timeout):
+        response = await self._model(system_prompt).generate_content_async(
+            user_message, stream=True, request_options={'timeout': timeout}
+        )
+        usage = None
+        async for chunk in response:
+            usage = self._usage(chunk) or usage
+            yield chunk.text
+        if usage:
+            yield usage
+
+
+class OpenAIProvider(AIProvider):
+    """Any OpenAI-compatible chat completions API (OpenAI, Azure, vLLM, OpenRouter...)."""
+    name = 'openai'
+
+    def __init__(self):
+        super().__init__()
+        from openai import OpenAI
+
+        self.client = OpenAI(
+            api_key=config('OPENAI_API_KEY'),
+            base_url=settings.OPENAI_BASE_URL or None,
+            max_retries=0,  # AIGuard does the retrying
+        )
+        self.model_name = settings.OPENAI_MODEL
+        # httpx connection pools belong to the event loop that opened them, so one async client per loop
+        self._async_clients = weakref.WeakKeyDictionary()
+
+    def _async_client(self):
+        from openai import AsyncOpenAI
+
+        loop = asyncio.get_running_loop()
+        client = self._async_clients.get(loop)
+        if client is None:
+            client = self._async_clients[loop] = AsyncOpenAI(
+                api_key=self.client.api_key,
+                base_url=settings.OPENAI_BASE_URL or None,
+                max_retries=0,
+            )
+        return client
+
+    def _request(self, system_prompt, user_message, timeout, stream):
+        request = dict(
+            model=self.model_name,
+            messages=[
+                {'role': 'system', 'content': system_prompt},
+                {'role': 'user', 'content': user_message},
+            ],
+            response_format={'type': 'json_object'},
+            timeout=timeout,
+            stream=stream,
+        )
+        if stream and settings.OPENAI_STREAM_USAGE:
+            # Adds a last chunk with the token counts (and no choices)
+            request['stream_options'] = {'include_usage': True}
+        return request
+
+    @staticmethod
+    def _usage(response):
+        usage = getattr(response, 'usage', None)
+        return Usage(usage.prompt_tokens, usage.completion_tokens) if usage else None
+
+    def _create(self, system_prompt, user_message, timeout, stream):
+        return self.client.chat.completions.create(**self._request(system_prompt, user_message, timeout, stream))
+
+    def generate(self, system_prompt, user_message, timeout):
+        response = self._create(system_prompt, user_message, timeout, stream=False)
+        return Completion(response.choices[0].message.content, self._usage(response))
+
+    def stream(self, system_prompt, user_message, timeout):
+        for chunk in self._create(system_prompt, user_message, timeout, stream=True):
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+            elif self._usage(chunk):
+                yield self._usage(chunk)
+
+    async def agenerate(self, system_prompt, user_message, timeout):
+        request = self._request(system_prompt, user_message, timeout, stream=False)
+        response = await self._async_client().chat.completions.create(**request)
+        return Completion(response.choices[0].message.content, self._usage(response))
+
+    async def astream(self, system_prompt, user_message, timeout):
+        request = self._request(system_prompt, user_message, timeout, stream=True)
+        async for chunk in await self._async_client().chat.completions.create(**request):
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+            elif self._usage(chunk):
+                yield self._usage(chunk)
+
+
+class StubProvider(AIProvider):
+    """
+    Deterministic offline provider for development and load tests.
+    The same prompt and answers always give the same analysis; AI_STUB_LATENCY
+    simulates the provider's response time.
+    """
+    name = 'stub'
+    model_name = 'local-stub'
+
+    JOBS = ['برنامه نویس', 'تحلیلگر داده', 'طراح محصول', 'مدیر پروژه', 'معلم', 'حسابدار', 'پرستار', 'بازاریاب']
+
+    def _analysis(self, system_prompt, user_message):
+        seed = hashlib.sha256(f"{system_prompt}\n{user_message}".encode('utf-8')).hexdigest()
+        picker = random.Random(seed)
+        jobs = picker.sample(self.JOBS, 3)
+        return {
+            "analysis": f"تحلیل آزمایشی {seed[:8]}",
+            "recommended_jobs": [{"job": job, "reason": "پیشنهاد آزمایشی"} for job in jobs],
+            "development_points": ["مهارت آزمایشی اول", "مهارت آزمایشی دوم"],
+            "career_path": "مسیر شغلی آزمایشی",
+        }
+
+    def _completion(self, system_prompt, user_message):
+        text = json.dumps(self._analysis(system_prompt, user_message), ensure_ascii=False)
+        # Roughly four characters per token, so the usage report has something to show
+        return Completion(text, Usage((len(system_prompt) + len(user_message)) // 4 + 1, len(text) // 4 + 1))
+
+    def generate(self, system_prompt, user_message, timeout):
+        time.sleep(min(settings.AI_STUB_LATENCY, timeout))
+        return self._completion(system_prompt, user_message)
+
+    def stream(self, system_prompt, user_message, timeout):
+        text, usage = self._completion(system_prompt, user_message)
+        chunks = [text[i:i + 40] for i in range(0, len(text), 40)]
+        for chunk in chunks:
+            time.sleep(settings.AI_STUB_LATENCY / len(chunks))
+            yield chunk
+        yield usage
+
+    async def agenerate(self, system_prompt, user_message, timeout):
+        await asyncio.sleep(min(settings.AI_STUB_LATENCY, timeout))
+        return self._completion(system_prompt, user_message)
+
+    async def astream(self, system_prompt, user_message, timeout):
+        text, usage = self._completion(system_prompt, user_message)
+        chunks = [text[i:i + 40] for i in range(0, len(text), 40)]
+        for chunk in chunks:
+            await asyncio.sleep(settings.AI_STUB_LATENCY / len(chunks))
+            yield chunk
+        yield usage
+
+
+PROVIDERS = {
+    GeminiProvider.name: GeminiProvider,
+    OpenAIProvider.name: OpenAIProvider,
+    StubProvider.name: StubProvider,
+}
+
+_instances = {}
+_instances_lock = threading.Lock()
+
+
+def get_provider(name=None):
+    """Returns the (process-wide) provider called `name`, by default AI_PROVIDER."""
+    name = name or settings.AI_PROVIDER
+    with _instances_lock:
+        if name not in _instances:
+            if name not in PROVIDERS:
+                raise ValueError(f"Unknown AI provider '{name}', expected one of {sorted(PROVIDERS)}")
+            _instances[name] = PROVIDERS[name]()
+        return _instances[name]
+
+
+def get_hedge_provider():
+    """
+    The provider for hedged requests, or None when hedging is off. It may be
+    the primary provider itself, which simply races a duplicate request.
+    """
+    if not settings.AI_HEDGE_PROVIDER:
+        return None
+    return get_provider(settings.AI_HEDGE_PROVIDER)
@@ -0,0 +1,79 @@
+# assessment/question_cache.py
+"""
+Process-level cache of the questions API responses.
+
+Each test's questions are serialized to JSON bytes once per content
+version (Test.questions_version) and kept in memory. Within
+QUESTIONS_CACHE_TTL seconds the cached version is trusted without touching
+the database; after that one light query checks whether the version
+changed, and the questions are only re-read and re-encoded if it did.
+Saving or deleting a Test drops its entry in this process right away
+(see signals.py).
+"""
+import json
+import threading
+import time
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .models import Test
+
+QuestionsPayload = namedtuple('QuestionsPayload', ['test_id', 'version', 'updated_at', 'body'])
+
+_versions = {}  # test id -> (version, updated_at, checked at)
+_bodies = {}  # (test id, version) -> QuestionsPayload
+_lock = threading.Lock()
+
+
+def _serialize(questions):
+    return json.dumps(questions, cls=DjangoJSONEncoder, ensure_ascii=False).encode('utf-8')
+
+
+def get_questions_payload(test_id):
+    """The current QuestionsPayload of a test, or None if the test doesn't exist."""
+    now = time.monotonic()
+    with _lock:
+        known = _versions.get(test_id)
+        if known and now - known[2] < settings.QUESTIONS_CACHE_TTL:
+            payload = _bodies.get((test_id, known[0]))
+            if payload:
+                return payload
+
+    row = Test.objects.filter(pk=test_id).values('questions_version', 'questions_updated_at').first()
+    if row is None:
+        invalidate(test_id)
+        return None
+    version, updated_at = row['questions_version'], row['questions_updated_at']
+
+    with _lock:
+        payload = _bodies.get((test_id, version))
+    if payload is None:
+        # Read the version again with the questions, in case an edit landed in between
+        row = Test.objects.filter(pk=test_id).values('questions', 'questions_version', 'questions_updated_at').first()
+        if row is None:
+            invalidate(test_id)
+            return None
+        version, updated_at = row['questions_version'], row['questions_updated_at']
+        payload = QuestionsPayload(test_id, version, updated_at, _serialize(row['questions']))
+
+    with _lock:
+        # Only the latest version of each test is worth keeping
+        for key in [k for k in _bodies if k[0] == test_id and k[1] != version]:
+            del _bodies[key]
+        _bodies[(test_id, version)] = payload
+        _versions[test_id] = (version, updated_at, now)
+    return payload
+
+
+def invalidate(test_id=None):
+    """Forgets one test (or every test) so the next request re-checks the database."""
+    with _lock:
+        if test_id is None:
+            _versions.clear()
+            _bodies.clear()
+            return
+        _versions.pop(test_id, None)
+        for key in [k for k in _bodies if k[0] == test_id]:
+            del _bodies[key]
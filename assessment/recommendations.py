@@ -0,0 +1,106 @@
+# assessment/recommendations.py
+"""
+Per-user recommended tests for the dashboard.
+
+Instead of parsing the latest primary analysis on every dashboard call,
+the matching test ids are written to RecommendedTest whenever a primary
+analysis is saved, and the dashboard reads them with a single query. The
+tests themselves come from the cached catalog (see catalog.py). Linking a
+test to another job, renaming a job or deleting one requests a rebuild of
+everyone's rows (see signals.py), since the stored ids depend on those
+names. That is too slow for the admin's request, so the analysis worker
+runs it (with ANALYSIS_QUEUE_EAGER, it runs on commit).
+"""
+import logging
+
+from django.conf import settings
+from django.db import transaction
+
+from .catalog import get_catalog
+from .models import AssessmentResult, RecommendationRefresh, RecommendedTest
+
+logger = logging.getLogger(__name__)
+
+
+def recommended_test_ids(ai_analysis):
+    """Tests linked to the jobs recommended in `ai_analysis`."""
+    if not ai_analysis:
+        return []
+    job_names = [job['job'] for job in ai_analysis.get('recommended_jobs', []) if isinstance(job, dict) and job.get('job')]
+    if not job_names:
+        return []
+    job_names = set(job_names)
+    return [test['id'] for test in get_catalog() if test['related_job_name'] in job_names]
+
+
+def refresh_recommended_tests(user_id):
+    """Rebuilds the user's recommendations from their latest analyzed primary assessment."""
+    latest = (AssessmentResult.objects
+              .filter(user_id=user_id, test__is_primary_assessment=True, ai_analysis__isnull=False)
+              .order_by('-created_at')
+              .values_list('ai_analysis', flat=True)
+              .first())
+    test_ids = recommended_test_ids(latest)
+
+    with transaction.atomic():
+        RecommendedTest.objects.filter(user_id=user_id).delete()
+        RecommendedTest.objects.bulk_create([RecommendedTest(user_id=user_id, test_id=test_id) for test_id in test_ids])
+    return test_ids
+
+
+def refresh_all_recommended_tests():
+    """Rebuilds the recommendations of every user who has any. Returns the number of users."""
+    user_ids = set(AssessmentResult.objects
+                   .filter(test__is_primary_assessment=True, ai_analysis__isnull=False)
+                   .order_by()
+                   .values_list('user_id', flat=True)
+                   .distinct())
+    user_ids.update(RecommendedTest.objects.order_by().values_list('user_id', flat=True).distinct())
+    for user_id in user_ids:
+        refresh_recommended_tests(user_id)
+    return len(user_ids)
+
+
+def request_full_refresh():
+    """Asks the analysis worker to rebuild everyone's recommendations. Call after the change is committed."""
+    if settings.ANALYSIS_QUEUE_EAGER:
+        refresh_all_recommended_tests()
+    else:
+        RecommendationRefresh.objects.create()
+
+
+def run_requested_refresh():
+    """
+    Rebuilds everyone's recommendations if a refresh was requested. Returns
+    the number of users rebuilt, or None when there was nothing to do.
+    """
+    last = RecommendationRefresh.objects.order_by('-pk').values_list('pk', flat=True).first()
+    if last is None:
+        return None
+    # Deleting claims the requests, so concurrent workers don't both rebuild;
+    # one made while we rebuild stays for the next run
+    claimed, _ = RecommendationRefresh.objects.filter(pk__lte=last).delete()
+    if not claimed:
+        return None
+    try:
+        return refresh_all_recommended_tests()
+    except Exception:
+        RecommendationRefresh.objects.create()
+        raise
+
+
+def get_dashboard_tests(user):
+    """
+    Returns (recommended_tests, other_tests) as lists of dicts, from the
+    cached catalog plus one query for the user's recommended test ids.
+    """
+    recommended_ids = set(RecommendedTest.objects.filter(user=user).values_list('test_id', flat=True))
+
+    recommended_tests, other_tests = [], []
+    for test in get_catalog():
+        item = {'id': test['id'], 'name': test['name'], 'description': test['description']}
+        if test['id'] in recommended_ids:
+            recommended_tests.append(item)
+        elif not test['is_primary_assessment']:
+            other_tests.append(item)
+    return recommended_tests, other_tests
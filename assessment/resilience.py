@@ -0,0 +1,407 @@
+# assessment/resilience.py
+"""
+Protection around calls to the AI provider.
+
+- TokenBucket: caps how fast this process sends requests.
+- CircuitBreaker: after repeated provider failures, fails fast for a while
+  instead of letting every request wait for a timeout.
+- AIGuard: puts both together with per-call deadlines and jittered
+  exponential retries for transient errors.
+- hedged_call: races a second request against a slow first one, using
+  the p95 latency from a LatencyTracker as the trigger.
+
+The a-prefixed variants (AIGuard.acall, asingle_attempt, ahedged_call) do the
+same for async callers: they wait with asyncio.sleep instead of blocking the
+thread, so an ASGI process can keep many AI calls in flight at once. The
+breaker and the bucket are shared by sync and async callers.
+"""
+import asyncio
+import logging
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from contextlib import asynccontextmanager, contextmanager
+
+logger = logging.getLogger(__name__)
+
+
+class AIAnalysisError(Exception):
+    """No analysis could be produced for this request."""
+
+
+class AIUnavailableError(AIAnalysisError):
+    """The provider is unreachable, overloaded or too slow (after retries)."""
+
+
+class CircuitOpenError(AIUnavailableError):
+    """The circuit breaker is open; the provider was not called at all."""
+
+
+class RateLimitExceeded(AIUnavailableError):
+    """No request slot became free before the deadline."""
+
+
+class TokenBucket:
+    """Allows `rate` calls per second on average with bursts of up to `capacity`."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def _take(self, deadline):
+        """Takes a token if one is free. Returns 0 then, None if none will be free by `deadline`, else the seconds to wait."""
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            wait = (1 - self.tokens) / self.rate
+        if deadline is not None and now + wait > deadline:
+            return None
+        return wait
+
+    def acquire(self, timeout=None):
+        """Takes one token, waiting up to `timeout` seconds. Returns False if none became free."""
+        if not self.rate:
+            return True
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = self._take(deadline)
+            if wait is None:
+                return False
+            if not wait:
+                return True
+            time.sleep(wait)
+
+    async def aacquire(self, timeout=None):
+        """acquire() for async callers."""
+        if not self.rate:
+            return True
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = self._take(deadline)
+            if wait is None:
+                return False
+            if not wait:
+                return True
+            await asyncio.sleep(wait)
+
+
+class CircuitBreaker:
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+        self.lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self.lock:
+            return self._state(time.monotonic())
+
+    def _state(self, now):
+        if self.opened_at is None:
+            return self.CLOSED
+        if now - self.opened_at >= self.reset_timeout:
+            return self.HALF_OPEN
+        return self.OPEN
+
+    def retry_after(self):
+        """Seconds until the breaker lets a trial request through (0 if it is not open)."""
+        with self.lock:
+            if self.opened_at is None:
+                return 0
+            return max(0, self.reset_timeout - (time.monotonic() - self.opened_at))
+
+    def before_call(self):
+        """Raises CircuitOpenError unless the call may go ahead."""
+        with self.lock:
+            state = self._state(time.monotonic())
+            if state == self.OPEN:
+                raise CircuitOpenError("AI provider is unavailable, not calling it for now.")
+            if state == self.HALF_OPEN:
+                # Let exactly one trial request find out whether the provider recovered
+                if self.trial_running:
+                    raise CircuitOpenError("AI provider is unavailable, a trial request is in progress.")
+                self.trial_running = True
+
+    def release_trial(self):
+        """Gives up a half-open trial slot without reporting an outcome."""
+        with self.lock:
+            self.trial_running = False
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_running = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.trial_running = False
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    logger.warning("Opening AI circuit breaker after %s failures", self.failures)
+                self.opened_at = time.monotonic()
+
+
+def _retryable_types():
+    types = [TimeoutError, ConnectionError]
+    try:
+        from google.api_core import exceptions as google_exceptions
+        types += [
+            google_exceptions.TooManyRequests,
+            google_exceptions.ResourceExhausted,
+            google_exceptions.ServiceUnavailable,
+            google_exceptions.InternalServerError,
+            google_exceptions.DeadlineExceeded,
+            google_exceptions.GatewayTimeout,
+        ]
+    except ImportError:
+        pass
+    try:
+        import openai
+        types += [
+            openai.RateLimitError,
+            openai.APITimeoutError,
+            openai.APIConnectionError,
+            openai.InternalServerError,
+        ]
+    except ImportError:
+        pass
+    return tuple(types)
+
+
+_RETRYABLE = None
+
+
+def is_retryable(exc):
+    """Transient provider errors worth another attempt: timeouts, 429s and 5xxs."""
+    global _RETRYABLE
+    if _RETRYABLE is None:
+        _RETRYABLE = _retryable_types()
+    return isinstance(exc, _RETRYABLE)
+
+
+def backoff_delay(attempt, base_delay, max_delay):
+    """Exponential backoff with full jitter, so retrying workers don't stampede together."""
+    return random.uniform(0, min(max_delay, base_delay * (2 ** attempt)))
+
+
+class AIGuard:
+    def __init__(self, limiter, breaker, timeout, total_timeout, max_retries, base_delay, max_delay):
+        self.limiter = limiter
+        self.breaker = breaker
+        self.timeout = timeout
+        self.total_timeout = total_timeout
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def _start_attempt(self, deadline):
+        self.breaker.before_call()
+        remaining = deadline - time.monotonic()
+        if remaining <= 0 or not self.limiter.acquire(timeout=remaining):
+            self.breaker.release_trial()
+            raise RateLimitExceeded("Too many AI requests, no slot became free in time.")
+        return max(0.1, min(self.timeout, deadline - time.monotonic()))
+
+    async def _astart_attempt(self, deadline):
+        self.breaker.before_call()
+        remaining = deadline - time.monotonic()
+        if remaining <= 0 or not await self.limiter.aacquire(timeout=remaining):
+            self.breaker.release_trial()
+            raise RateLimitExceeded("Too many AI requests, no slot became free in time.")
+        return max(0.1, min(self.timeout, deadline - time.monotonic()))
+
+    def _record_failure(self, e, attempt, deadline):
+        """
+        Reports a failed attempt to the breaker. Returns the delay before the
+        next attempt, or raises when giving up (non-retryable errors unchanged).
+        """
+        if not is_retryable(e):
+            # The provider answered, it just didn't like the request
+            self.breaker.record_success()
+            raise e
+        self.breaker.record_failure()
+
+        delay = backoff_delay(attempt, self.base_delay, self.max_delay)
+        if attempt >= self.max_retries or time.monotonic() + delay >= deadline:
+            raise AIUnavailableError(f"AI provider failed after {attempt + 1} attempts: {e}") from e
+        logger.info("Retrying AI call in %.1fs after: %s", delay, e)
+        return delay
+
+    def call(self, fn):
+        """
+        Calls fn(timeout) with retries. `timeout` is the deadline in seconds
+        for that single attempt. Raises AIUnavailableError when the provider
+        keeps failing; non-retryable errors are re-raised unchanged.
+        """
+        deadline = time.monotonic() + self.total_timeout
+        attempt = 0
+        while True:
+            timeout = self._start_attempt(deadline)
+            try:
+                result = fn(timeout)
+            except Exception as e:
+                time.sleep(self._record_failure(e, attempt, deadline))
+                attempt += 1
+            else:
+                self.breaker.record_success()
+                return result
+
+    async def acall(self, fn):
+        """call() for async callers: fn(timeout) returns an awaitable."""
+        deadline = time.monotonic() + self.total_timeout
+        attempt = 0
+        while True:
+            timeout = await self._astart_attempt(deadline)
+            try:
+                result = await fn(timeout)
+            except asyncio.CancelledError:
+                # Cancelled by the caller (the hedge won, the client left); not the provider's fault
+                self.breaker.release_trial()
+                raise
+            except Exception as e:
+                await asyncio.sleep(self._record_failure(e, attempt, deadline))
+                attempt += 1
+            else:
+                self.breaker.record_success()
+                return result
+
+    @contextmanager
+    def single_attempt(self):
+        """
+        For calls that can't be retried transparently (streams). Yields the
+        timeout to use and reports the outcome to the circuit breaker.
+        """
+        timeout = self._start_attempt(time.monotonic() + self.timeout)
+        try:
+            yield timeout
+        except GeneratorExit:
+            # The client went away mid-stream; that says nothing about the provider
+            self.breaker.release_trial()
+            raise
+        except Exception as e:
+            if is_retryable(e):
+                self.breaker.record_failure()
+                raise AIUnavailableError(f"AI provider failed: {e}") from e
+            self.breaker.record_success()
+            raise
+        else:
+            self.breaker.record_success()
+
+    @asynccontextmanager
+    async def asingle_attempt(self):
+        """single_attempt() for async streams."""
+        timeout = await self._astart_attempt(time.monotonic() + self.timeout)
+        try:
+            yield timeout
+        except (GeneratorExit, asyncio.CancelledError):
+            self.breaker.release_trial()
+            raise
+        except Exception as e:
+            if is_retryable(e):
+                self.breaker.record_failure()
+                raise AIUnavailableError(f"AI provider failed: {e}") from e
+            self.breaker.record_success()
+            raise
+        else:
+            self.breaker.record_success()
+
+
+class LatencyTracker:
+    """Keeps the durations of the last `size` successful calls."""
+
+    def __init__(self, size=200):
+        self.samples = deque(maxlen=size)
+        self.lock = threading.Lock()
+
+    def record(self, seconds):
+        with self.lock:
+            self.samples.append(seconds)
+
+    def percentile(self, pct):
+        """The pct-th percentile in seconds, or None without enough samples to be meaningful."""
+        with self.lock:
+            if len(self.samples) < 20:
+                return None
+            ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+# Hedged requests run here so the caller can wait on whichever finishes first
+_hedge_executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix='ai-hedge')
+
+
+def hedged_call(primary, secondary, delay):
+    """
+    Runs primary(); if it hasn't finished after `delay` seconds, also runs
+    secondary() and returns whichever succeeds first. The slower call is
+    left to finish in the background and its result is ignored. If both
+    fail, the primary's error is raised.
+    """
+    first = _hedge_executor.submit(primary)
+    done, _ = wait([first], timeout=delay)
+    if done and first.exception() is None:
+        return first.result()
+
+    logger.info("AI call slower than %.1fs, sending hedged request", delay)
+    second = _hedge_executor.submit(secondary)
+    pending = {first, second}
+    errors = {}
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                return future.result()
+            errors[future] = future.exception()
+    raise errors[first]
+
+
+async def ahedged_call(primary, secondary, delay):
+    """hedged_call() for async callers: primary and secondary return awaitables."""
+    tasks = [asyncio.ensure_future(primary())]
+    first = tasks[0]
+    try:
+        done, _ = await asyncio.wait([first], timeout=delay)
+        if done and first.exception() is None:
+            return first.result()
+
+        logger.info("AI call slower than %.1fs, sending hedged request", delay)
+        tasks.append(asyncio.ensure_future(secondary()))
+        pending = set(tasks)
+        errors = {}
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    # Unlike threads, the slower request can simply be cancelled
+                    for other in pending:
+                        other.cancel()
+                    return task.result()
+                errors[task] = task.exception()
+        raise errors[first]
+    except asyncio.CancelledError:
+        # The caller went away (e.g. the client disconnected): don't leave the
+        # requests running and holding rate limit tokens
+        for task in tasks:
+            task.cancel()
+        raise
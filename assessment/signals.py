@@ -0,0 +1,73 @@
+# assessment/signals.py
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from account import ranking
+
+from . import catalog, question_cache
+from .models import AssessmentResult, Job, Test
+from .recommendations import refresh_recommended_tests, request_full_refresh
+
+
+@receiver([post_save, post_delete], sender=Job)
+@receiver([post_save, post_delete], sender=Test)
+def bump_catalog_version(sender, **kwargs):
+    # After the commit, so no process can cache the old rows under the new version
+    transaction.on_commit(catalog.bump_version)
+
+
+# Stored recommendations match tests by their related job's name. Registered
+# after bump_catalog_version, so an eager refresh reads the new catalog
+
+@receiver(pre_save, sender=Job)
+@receiver(pre_save, sender=Test)
+def remember_job_link(sender, instance, using, **kwargs):
+    field = 'name' if sender is Job else 'related_job_id'
+    if instance._state.adding:
+        # A new job has no tests yet; a new test only matters if it is linked
+        instance._job_link_changed = sender is Test and instance.related_job_id is not None
+    else:
+        old = sender._base_manager.using(using).filter(pk=instance.pk).values_list(field, flat=True).first()
+        instance._job_link_changed = old != getattr(instance, field)
+
+
+@receiver(post_save, sender=Job)
+@receiver(post_save, sender=Test)
+def refresh_recommendations_on_job_link(sender, instance, **kwargs):
+    if getattr(instance, '_job_link_changed', False):
+        transaction.on_commit(request_full_refresh)
+
+
+@receiver(post_delete, sender=Job)
+def refresh_recommendations_on_job_delete(sender, instance, **kwargs):
+    # Its tests were unlinked (SET_NULL) without any signal of their own
+    transaction.on_commit(request_full_refresh)
+
+
+@receiver([post_save, post_delete], sender=Test)
+def invalidate_question_cache(sender, instance, **kwargs):
+    test_id = instance.pk
+    transaction.on_commit(lambda: question_cache.invalidate(test_id))
+
+
+@receiver(post_delete, sender=AssessmentResult)
+def refresh_recommendations_on_delete(sender, instance, **kwargs):
+    # The deleted result may have been the one the dashboard recommendations came from
+    # Not instance.test: that would load the test of every row of a cascade delete
+    if instance.ai_analysis and Test.objects.filter(pk=instance.test_id, is_primary_assessment=True).exists():
+        refresh_recommended_tests(instance.user_id)
+
+
+# Drafts don't count until they are submitted (see drafts.submit_draft)
+
+@receiver(post_save, sender=AssessmentResult)
+def count_new_result(sender, instance, created, **kwargs):
+    if created and not instance.is_draft:
+        ranking.change_assessment_count(instance.user_id, 1)
+
+
+@receiver(post_delete, sender=AssessmentResult)
+def uncount_deleted_result(sender, instance, **kwargs):
+    if not instance.is_draft:
+        ranking.change_assessment_count(instance.user_id, -1)
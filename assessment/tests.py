@@ -1,3 +1,1253 @@
-from django.test import TestCase
+# assessment/tests.py
+import asyncio
+import importlib
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta
+from functools import partial
+from io import StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.apps import apps as django_apps
+from django.conf import settings
+from django.core.management import call_command
+from django.db import OperationalError, connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from account.models import CustomUser
+from account.ranking import reconcile
+from core import db_router
+from . import (ai, ai_cache, archive, catalog, drafts, jobs, name_index, partitions, providers, question_cache, recommendations,
+               resilience, usage)
+from .analysis import results_needing_analysis
+from .json_stream import IncrementalJSONParser
+from .models import AnalysisCacheEntry, AnalysisJob, AnalysisUsage, AssessmentResult, Job, RecommendationRefresh, RecommendedTest, Test
+
+logger = logging.getLogger(__name__)
+
+# Rows of AssessmentResult seeded for the query plan tests (users and tests scale with it)
+QUERY_PLAN_SEED_SIZE = int(os.environ.get('QUERY_PLAN_SEED_SIZE', 5000))
+
+# Endpoint budget tests. Query counts are always enforced. Wall time depends on the
+# machine, so a p95 over the committed baseline (perf_baseline.json) is only reported,
+# unless PERF_ENFORCE=1. An endpoint without a baseline fails; refresh it on the CI
+# machine with PERF_UPDATE_BASELINE=1.
+PERF_SEED_SIZE = int(os.environ.get('PERF_SEED_SIZE', 200))
+PERF_ITERATIONS = int(os.environ.get('PERF_ITERATIONS', 10))
+PERF_BASELINE = os.environ.get('PERF_BASELINE', os.path.join(settings.BASE_DIR, 'perf_baseline.json'))
+PERF_UPDATE_BASELINE = os.environ.get('PERF_UPDATE_BASELINE') == '1'
+PERF_ENFORCE = os.environ.get('PERF_ENFORCE') == '1'
+# An endpoint is too slow when its p95 exceeds baseline * PERF_TOLERANCE + PERF_SLACK_MS
+PERF_TOLERANCE = float(os.environ.get('PERF_TOLERANCE', 1.5))
+PERF_SLACK_MS = float(os.environ.get('PERF_SLACK_MS', 5))
+
+
+class QueryPlanAssertions:
+    """EXPLAIN-based checks that a query is answered from an index, on SQLite and PostgreSQL."""
+
+    @staticmethod
+    def analyze():
+        # Fresh planner statistics, as a production database would have
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def assertUsesIndex(self, queryset, table, index_name=None):
+        plan = queryset.explain()
+        if connection.vendor == 'postgresql':
+            self.assertNotIn(f'Seq Scan on {table}', plan, f"Sequential scan of {table}:\n{plan}")
+        else:
+            # "SCAN t" reads the whole table; "SCAN t USING INDEX i" only walks a (partial) index
+            full_scan = re.search(rf'\bSCAN {table}\b(?! USING (COVERING )?INDEX)', plan)
+            self.assertIsNone(full_scan, f"Full scan of {table}:\n{plan}")
+        if index_name:
+            self.assertIn(index_name, plan, f"{index_name} not used:\n{plan}")
+
+
+@skipUnless(connection.vendor in ('sqlite', 'postgresql'), "Query plans are only checked on SQLite and PostgreSQL.")
+class HotLookupIndexTests(QueryPlanAssertions, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        user_count = max(QUERY_PLAN_SEED_SIZE // 10, 10)
+        test_count = max(QUERY_PLAN_SEED_SIZE // 20, 10)
+
+        users = CustomUser.objects.bulk_create([
+            CustomUser(phone_number=f'09{i:09d}') for i in range(user_count)
+        ])
+        jobs = Job.objects.bulk_create([Job(name=f'Job {i}') for i in range(test_count)])
+        tests = Test.objects.bulk_create([
+            Test(name=f'Test {i}', questions=[], system_prompt='', order=i, related_job=jobs[i], is_primary_assessment=(i == 0))
+            for i in range(test_count)
+        ])
+        AssessmentResult.objects.bulk_create([
+            AssessmentResult(user=users[i % user_count], test=tests[i % test_count], answers={})
+            for i in range(QUERY_PLAN_SEED_SIZE)
+        ])
+        RecommendedTest.objects.bulk_create([
+            RecommendedTest(user=users[i % user_count], test=tests[i // user_count])
+            for i in range(user_count * 3)
+        ])
+        cls.user = users[user_count // 2]
+        cls.test = tests[test_count // 2]
+        cls.analyze()
+
+    def test_history_page(self):
+        # get_user_history_api
+        queryset = (AssessmentResult.objects
+                    .filter(user=self.user)
+                    .order_by('-created_at', '-id')
+                    .values('id', 'created_at', 'test__name', 'analysis_error'))[:21]
+        self.assertUsesIndex(queryset, 'assessment_assessmentresult', 'result_user_created_idx')
+
+    def test_latest_primary_analysis(self):
+        # recommendations.refresh_recommended_tests
+        queryset = (AssessmentResult.objects
+                    .filter(user=self.user, test__is_primary_assessment=True, ai_analysis__isnull=False)
+                    .order_by('-created_at')
+                    .values_list('ai_analysis', flat=True))[:1]
+        self.assertUsesIndex(queryset, 'assessment_assessmentresult', 'result_user_created_idx')
+
+    def test_results_of_one_test(self):
+        queryset = AssessmentResult.objects.filter(user=self.user, test=self.test)
+        self.assertUsesIndex(queryset, 'assessment_assessmentresult', 'result_user_test_idx')
+
+    def test_primary_test(self):
+        queryset = Test.objects.filter(is_primary_assessment=True).order_by('order')[:1]
+        self.assertUsesIndex(queryset, 'assessment_test', 'test_primary_order_idx')
+
+    def test_dashboard_recommendations(self):
+        # recommendations.get_dashboard_tests
+        queryset = RecommendedTest.objects.filter(user=self.user).values_list('test_id', flat=True)
+        # Backed by the unique_recommended_test constraint (SQLite names that index itself)
+        self.assertUsesIndex(queryset, 'assessment_recommendedtest')
+
+
+# --- Endpoint query-count and latency budgets ---
+
+# `path` and `data` may be callables taking the test case. Every call is
+# made logged in as the test case attribute named by `login` (None for an
+# anonymous visitor); `before` runs ahead of it. Neither is measured.
+Endpoint = namedtuple('Endpoint', ['name', 'method', 'path', 'max_queries', 'data', 'status', 'login', 'before'],
+                      defaults=[None, 200, 'user', None])
+
+
+def _percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def load_baseline():
+    try:
+        with open(PERF_BASELINE) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        if PERF_UPDATE_BASELINE:
+            return {}
+        raise
+
+
+def save_baseline(timings):
+    baseline = load_baseline()
+    baseline.update(timings)
+    with open(PERF_BASELINE, 'w') as f:
+        json.dump(baseline, f, indent=2, sort_keys=True)
+        f.write('\n')
+
+
+class EndpointBudgetMixin:
+    """
+    Calls every endpoint in `endpoints` PERF_ITERATIONS times (after one
+    warm-up call) and checks the most queries any call made against
+    `max_queries`, and its p95 wall time against the JSON baseline (a
+    failure with PERF_ENFORCE=1, otherwise a logged warning).
+    """
+    endpoints = []
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.baseline = load_baseline()
+        cls.timings = {}
+
+    @classmethod
+    def tearDownClass(cls):
+        if PERF_UPDATE_BASELINE and cls.timings:
+            save_baseline(cls.timings)
+        super().tearDownClass()
+
+    def setUp(self):
+        # Signals invalidate these on commit, which never happens inside a TestCase
+        catalog.bump_version()
+        question_cache.invalidate()
+
+    def _prepare(self, endpoint):
+        if endpoint.login:
+            self.client.force_login(getattr(self, endpoint.login))
+        else:
+            self.client.logout()
+        if endpoint.before:
+            endpoint.before(self)
+        path = endpoint.path(self) if callable(endpoint.path) else endpoint.path
+        data = endpoint.data(self) if callable(endpoint.data) else endpoint.data
+        return path, data
+
+    def _request(self, endpoint, path, data):
+        if endpoint.method in ('post', 'patch'):
+            response = getattr(self.client, endpoint.method)(path, json.dumps(data or {}), content_type='application/json')
+        else:
+            response = self.client.get(path)
+        if response.streaming:
+            b''.join(response.streaming_content)
+        return response
+
+    def test_endpoint_budgets(self):
+        for endpoint in self.endpoints:
+            with self.subTest(endpoint=endpoint.name):
+                # Warm-up: fills the caches a steady-state request would find
+                self._request(endpoint, *self._prepare(endpoint))
+
+                samples, max_queries = [], 0
+                for _ in range(PERF_ITERATIONS):
+                    path, data = self._prepare(endpoint)
+                    with CaptureQueriesContext(connection) as queries:
+                        started = time.perf_counter()
+                        response = self._request(endpoint, path, data)
+                        samples.append((time.perf_counter() - started) * 1000)
+                    self.assertEqual(response.status_code, endpoint.status)
+                    max_queries = max(max_queries, len(queries))
+
+                self.assertLessEqual(max_queries, endpoint.max_queries, f"{endpoint.name} made {max_queries} queries")
+
+                p50, p95 = _percentile(samples, 50), _percentile(samples, 95)
+                self.timings[endpoint.name] = {'p50_ms': round(p50, 2), 'p95_ms': round(p95, 2), 'queries': max_queries}
+                if PERF_UPDATE_BASELINE:
+                    continue
+                known = self.baseline.get(endpoint.name)
+                self.assertIsNotNone(known, f"No baseline for {endpoint.name}, record one with PERF_UPDATE_BASELINE=1")
+                limit = known['p95_ms'] * PERF_TOLERANCE + PERF_SLACK_MS
+                message = f"{endpoint.name} p95 {p95:.1f}ms, baseline {known['p95_ms']}ms"
+                if PERF_ENFORCE:
+                    self.assertLessEqual(p95, limit, message)
+                elif p95 > limit:
+                    logger.warning("Slower than the baseline: %s", message)
+
+
+def seed_perf_fixtures(size):
+    """A user with `size` results, size // 10 tests (one primary) and as many other users."""
+    test_count = max(size // 10, 3)
+    jobs = Job.objects.bulk_create([Job(name=f'Job {i}') for i in range(test_count)])
+    tests = [
+        Test.objects.create(
+            name=f'Test {i}', order=i, related_job=jobs[i], is_primary_assessment=(i == 0), system_prompt='prompt',
+            questions=[{'id': q, 'text': f'Question {q}', 'options': ['a', 'b', 'c', 'd']} for q in range(30)],
+        )
+        for i in range(test_count)
+    ]
+    others = CustomUser.objects.bulk_create([CustomUser(phone_number=f'0930{i:07d}') for i in range(size)])
+    user = CustomUser.objects.create_user(phone_number='09120000000', full_name='Perf User')
+    AssessmentResult.objects.bulk_create(
+        [AssessmentResult(user=user, test=tests[i % test_count], answers={'1': 'a'}) for i in range(size)]
+        + [AssessmentResult(user=other, test=tests[0], answers={'1': 'a'}) for other in others]
+    )
+    RecommendedTest.objects.bulk_create([RecommendedTest(user=user, test=test) for test in tests[1:4]])
+    return user, tests
+
+
+@override_settings(AI_PROVIDER='stub', AI_STUB_LATENCY=0, AI_HEDGE_PROVIDER='', AI_RATE_LIMIT_PER_MINUTE=0,
+                   ANALYSIS_QUEUE_EAGER=True, AI_CACHE_ENABLED=True)
+class AssessmentEndpointBudgetTests(EndpointBudgetMixin, TestCase):
+    # Submitting runs the whole (eager) analysis pipeline inside the request
+    endpoints = [
+        Endpoint('assessment_home', 'get', '/', max_queries=2),
+        Endpoint('api_dashboard', 'get', '/api/dashboard/', max_queries=3),
+        Endpoint('api_get_test_questions', 'get', lambda t: f'/api/tests/{t.test.id}/questions/', max_queries=2),
+        Endpoint('api_get_ai_analysis', 'post', lambda t: f'/api/tests/{t.test.id}/submit/', max_queries=26,
+                 data={'1': {'question': 'Question 1', 'answer': 'a'}}, status=202),
+        Endpoint('api_get_tests_list', 'get', '/api/tests/list/', max_queries=2),
+        Endpoint('api_get_user_history', 'get', '/api/history/', max_queries=3),
+        Endpoint('api_get_history_detail', 'get', lambda t: f'/api/history/{t.result.id}/', max_queries=3),
+        Endpoint('api_get_archived_history', 'get', '/api/history/archived/', max_queries=2),
+        Endpoint('api_save_draft', 'post', lambda t: f'/api/tests/{t.test.id}/save-draft/', max_queries=7,
+                 data={'1': {'question': 'Question 1', 'answer': 'a'}}),
+        # One UPDATE merging the changed answers into the draft
+        Endpoint('api_autosave_draft', 'patch', lambda t: f'/api/tests/{t.test.id}/draft/', max_queries=5,
+                 data={'2': 'c'}),
+        Endpoint('api_perform_analysis', 'post', lambda t: f'/api/tests/{t.test.id}/analyze/{t.new_result().id}/?refresh=1',
+                 max_queries=14, status=202),
+        Endpoint('api_stream_analysis', 'post', lambda t: f'/api/tests/{t.test.id}/analyze/{t.new_result().id}/stream/',
+                 max_queries=11),
+        Endpoint('api_analysis_job_status', 'get', lambda t: f'/api/analysis-jobs/{t.job.id}/', max_queries=3),
+    ]
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # Providers are built once per process; get a stub one with these settings
+        providers._instances.clear()
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user, tests = seed_perf_fixtures(PERF_SEED_SIZE)
+        cls.test = tests[0]
+        cls.result = AssessmentResult.objects.filter(user=cls.user).order_by('-id').first()
+        cls.job = AnalysisJob.objects.create(result=cls.result, status=AnalysisJob.STATUS_DONE)
+
+    def new_result(self):
+        return AssessmentResult.objects.create(user=self.user, test=self.test, answers={'1': {'question': 'Question 1', 'answer': 'b'}})
+
+
+@override_settings(AI_CACHE_MAX_ENTRIES=2)
+class AnalysisCacheTests(TestCase):
+    def store(self, key):
+        ai_cache.store_analysis(key, 'model', {'analysis': key})
+
+    @override_settings(AI_CACHE_PRUNE_RATE=0)
+    def test_writes_dont_prune_unless_sampled(self):
+        with CaptureQueriesContext(connection) as queries:
+            for key in 'abc':
+                self.store(key)
+        self.assertFalse([q for q in queries if 'COUNT(' in q['sql'] or q['sql'].startswith('DELETE')])
+        self.assertEqual(AnalysisCacheEntry.objects.count(), 3)
+
+        self.assertEqual(ai_cache.prune(), 1)
+        self.assertFalse(AnalysisCacheEntry.objects.filter(key='a').exists())
+
+    @override_settings(AI_CACHE_PRUNE_RATE=1)
+    def test_sampled_writes_prune(self):
+        for key in 'abc':
+            self.store(key)
+        self.assertEqual(AnalysisCacheEntry.objects.count(), 2)
+
+
+class CatalogTests(TestCase):
+    @override_settings(CATALOG_VERSION_TIMEOUT=300, CATALOG_LOCAL_TTL=0)
+    def test_version_expires_without_a_shared_cache(self):
+        catalog.bump_version()
+        version = catalog.get_version()
+        self.assertEqual(catalog.get_catalog(), [])
+        Test.objects.create(name='Edited in another process', system_prompt='prompt', questions=[])
+        self.assertEqual(catalog.get_catalog(), [])
+
+        # That process's bump never reaches this one's cache, but the version runs out
+        with mock.patch('time.time', return_value=time.time() + 301):
+            self.assertNotEqual(catalog.get_version(), version)
+            self.assertEqual([test['name'] for test in catalog.get_catalog()], ['Edited in another process'])
+
+
+class HistoryTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(phone_number='09120000000')
+        test = Test.objects.create(name='Test', system_prompt='prompt', questions=[])
+        self.results = AssessmentResult.objects.bulk_create([AssessmentResult(user=self.user, test=test, answers={}) for _ in range(5)])
+        self.client.force_login(self.user)
+
+    def test_pages_follow_the_cursor(self):
+        first = self.client.get('/api/history/', {'limit': 3}).json()
+        second = self.client.get('/api/history/', {'limit': 3, 'cursor': first['next_cursor']}).json()
+
+        ids = [row['id'] for row in first['history'] + second['history']]
+        self.assertEqual(ids, sorted((result.id for result in self.results), reverse=True))
+        self.assertIsNone(second['next_cursor'])
+
+    def test_failed_analyses_are_reported_as_failed(self):
+        AssessmentResult.objects.filter(pk=self.results[0].pk).update(analysis_error='timeout')
+        AssessmentResult.objects.filter(pk=self.results[1].pk).update(ai_analysis={'analysis': 'x'})
+
+        rows = {row['id']: row for row in self.client.get('/api/history/').json()['history']}
+        self.assertEqual(rows[self.results[0].id]['analysis_status'], 'failed')
+        self.assertEqual(rows[self.results[1].id]['analysis_status'], 'done')
+        self.assertEqual(rows[self.results[2].id]['analysis_status'], 'pending')
+        # What the history page's retry button analyzes it with
+        self.assertEqual(rows[self.results[0].id]['test_id'], self.results[0].test_id)
+
+    def test_invalid_limit(self):
+        for limit in ('0', '-1', 'x'):
+            self.assertEqual(self.client.get('/api/history/', {'limit': limit}).status_code, 400)
+
+
+class ArchiveTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        archive_settings = override_settings(RESULTS_ARCHIVE_DIR=directory.name, RESULTS_ARCHIVE_SHARDS=4)
+        archive_settings.enable()
+        self.addCleanup(archive_settings.disable)
+
+        self.user = CustomUser.objects.create_user(phone_number='09120000000')
+        self.other = CustomUser.objects.create_user(phone_number='09120000001')
+        self.test = Test.objects.create(name='Test', system_prompt='prompt', questions=[{'id': 1, 'question': 'Question 1'}])
+        self.old = []
+        for day, user in [(datetime(2020, 1, 5), self.user), (datetime(2020, 1, 20), self.other), (datetime(2020, 2, 3), self.user)]:
+            result = AssessmentResult.objects.create(user=user, test=self.test, test_version=self.test.current_version, answers={'1': 'a'})
+            AssessmentResult.objects.filter(pk=result.pk).update(created_at=timezone.make_aware(day))
+            self.old.append(result)
+        self.recent = AssessmentResult.objects.create(user=self.user, test=self.test, answers={'1': 'b'})
+        AnalysisJob.objects.create(result=self.old[0])
+
+    def archive_old_months(self):
+        months = archive.months_to_archive(timezone.make_aware(datetime(2021, 1, 1)))
+        return [archive.archive_month(month) for month in months]
+
+    def test_moves_old_months_out_of_the_database(self):
+        self.assertEqual(self.archive_old_months(), [2, 1])
+
+        self.assertEqual(list(AssessmentResult.objects.values_list('pk', flat=True)), [self.recent.pk])
+        self.assertFalse(AnalysisJob.objects.exists())
+        # Archiving isn't deleting: the rank counts stay, and reconcile agrees
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.assessment_count, 3)
+        self.assertEqual(reconcile(), 0)
+
+    def test_archived_results_are_readable(self):
+        self.archive_old_months()
+        rows = archive.archived_results(self.user.id)
+
+        self.assertEqual([row['id'] for row in rows], [self.old[2].pk, self.old[0].pk])
+        self.assertEqual(rows[0]['answers']['responses'][0]['question_text'], 'Question 1')
+
+        self.client.force_login(self.user)
+        history = self.client.get('/api/history/archived/').json()['history']
+        self.assertEqual([item['id'] for item in history], [self.old[2].pk, self.old[0].pk])
+        self.assertEqual(history[1]['date'], '2020/01/05')
+
+    def test_archived_history_is_paginated(self):
+        self.archive_old_months()
+        self.client.force_login(self.user)
+
+        first = self.client.get('/api/history/archived/', {'limit': 1}).json()
+        second = self.client.get('/api/history/archived/', {'limit': 1, 'cursor': first['next_cursor']}).json()
+        self.assertEqual([item['id'] for item in first['history'] + second['history']], [self.old[2].pk, self.old[0].pk])
+        self.assertIsNone(second['next_cursor'])
+        self.assertEqual(self.client.get('/api/history/archived/', {'limit': 0}).status_code, 400)
+
+    def test_rerun_after_a_crash_does_not_duplicate(self):
+        month = timezone.make_aware(datetime(2020, 1, 1))
+        with mock.patch.object(archive, '_delete_results', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                archive.archive_month(month)
+        self.assertEqual(AssessmentResult.objects.count(), 4)
+
+        self.assertEqual(archive.archive_month(month), 0)
+        self.assertEqual(AssessmentResult.objects.count(), 2)
+        self.assertEqual(len(archive.archived_results(self.user.id)), 1)
+        self.assertEqual(archive.archived_result_counts(), {self.user.id: 1, self.other.id: 1})
+
+
+@skipUnless(connection.vendor == 'postgresql', "Partitioning is only supported on PostgreSQL.")
+class PartitionTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(phone_number='09120000000')
+        self.test = Test.objects.create(name='Test', system_prompt='prompt', questions=[{'id': 1, 'question': 'Question 1'}])
+        self.january = timezone.make_aware(datetime(2020, 1, 1))
+        self.old = AssessmentResult.objects.create(user=self.user, test=self.test, answers={'1': 'a'})
+        AssessmentResult.objects.filter(pk=self.old.pk).update(created_at=self.january + timedelta(days=4))
+        self.recent = AssessmentResult.objects.create(user=self.user, test=self.test, answers={'1': 'b'})
+        AnalysisJob.objects.create(result=self.old)
+
+    def test_convert_keeps_the_rows(self):
+        partitions.convert(months_ahead=1)
+
+        self.assertTrue(partitions.is_partitioned())
+        months = partitions.monthly_partitions()
+        self.assertIn(self.january, months)
+        self.assertIn(partitions.month_start(timezone.now()), months)
+        self.assertEqual(sorted(AssessmentResult.objects.values_list('pk', flat=True)), [self.old.pk, self.recent.pk])
+        # New rows land in a partition and get fresh ids
+        self.assertGreater(AssessmentResult.objects.create(user=self.user, test=self.test, answers={}).pk, self.recent.pk)
+        self.assertEqual(partitions.ensure_partitions(months_ahead=1), [])
+
+    def test_archiving_a_partitioned_month_detaches_it(self):
+        partitions.convert(months_ahead=1)
+        with tempfile.TemporaryDirectory() as directory, override_settings(RESULTS_ARCHIVE_DIR=directory):
+            self.assertEqual(archive.archive_month(self.january), 1)
+            self.assertEqual([row['id'] for row in archive.archived_results(self.user.id)], [self.old.pk])
+
+        self.assertNotIn(self.january, partitions.monthly_partitions())
+        self.assertEqual(list(AssessmentResult.objects.values_list('pk', flat=True)), [self.recent.pk])
+        self.assertFalse(AnalysisJob.objects.exists())
+
+
+@override_settings(ANALYSIS_QUEUE_EAGER=False)
+class DraftTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(phone_number='09120000000')
+        self.test = Test.objects.create(name='Test', system_prompt='prompt',
+                                        questions=[{'id': 1, 'question': 'Question 1'}, {'id': 2, 'question': 'Question 2'}])
+        self.client.force_login(self.user)
+
+    def autosave(self, patch):
+        return self.client.patch(f'/api/tests/{self.test.id}/draft/', json.dumps(patch), content_type='application/json').json()
+
+    def test_autosaves_merge_into_one_draft(self):
+        first = self.autosave({'1': 'a'})
+        second = self.autosave({'2': 'b'})
+        third = self.autosave({'1': None, '2': 'c'})
+
+        self.assertEqual(first['result_id'], second['result_id'])
+        self.assertEqual(second['result_id'], third['result_id'])
+        draft = AssessmentResult.objects.get()
+        self.assertTrue(draft.is_draft)
+        self.assertEqual(draft.answers, {'2': 'c'})
+
+        full = {'user_info': {}, 'responses': [{'question_id': 1, 'question_text': 'Question 1', 'answer': 'x'}]}
+        saved = self.client.post(f'/api/tests/{self.test.id}/save-draft/', json.dumps(full), content_type='application/json').json()
+        self.assertEqual(saved['result_id'], first['result_id'])
+        self.assertEqual(AssessmentResult.objects.get().answers, {'1': 'x'})
+
+    def test_autosave_into_a_draft_with_user_info(self):
+        answers = {'user_info': {'age': 30}, 'responses': [{'question_id': 1, 'question_text': 'Question 1', 'answer': 'a'}]}
+        draft = AssessmentResult.objects.create(user=self.user, test=self.test, is_draft=True, answers=answers)
+
+        self.autosave({'1': None, '2': 'b'})
+        draft.refresh_from_db()
+        self.assertEqual(draft.answers, {'user_info': {'age': 30}, 'responses': [
+            {'question_id': '2', 'question_text': 'Question 2', 'answer': 'b'},
+        ]})
+        self.assertEqual(draft.rich_answers, draft.answers)
+
+    def test_drafts_count_once_submitted(self):
+        draft_id = self.autosave({'1': 'a'})['result_id']
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.assessment_count, 0)
+        self.assertEqual(self.client.get('/api/history/').json()['history'], [])
+
+        self.client.post(f'/api/tests/{self.test.id}/analyze/{draft_id}/')
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.assessment_count, 1)
+        self.assertFalse(AssessmentResult.objects.get(pk=draft_id).is_draft)
+
+        # The next autosave starts a new draft
+        self.assertNotEqual(self.autosave({'1': 'b'})['result_id'], draft_id)
+        self.assertEqual(reconcile(), 0)
+
+    def test_save_draft_without_a_unique_index(self):
+        draft_id = self.autosave({'1': 'a'})['result_id']
+        # What update_or_create raises on a partitioned table holding two drafts
+        with mock.patch.object(AssessmentResult.objects, 'update_or_create', side_effect=AssessmentResult.MultipleObjectsReturned):
+            draft = drafts.save_draft(self.user, self.test, {'1': 'x'})
+        self.assertEqual(draft.pk, draft_id)
+        self.assertEqual(AssessmentResult.objects.get().answers, {'1': 'x'})
+
+    def test_autosave_racing_a_submit_leaves_the_result_alone(self):
+        draft_id = self.autosave({'1': 'a'})['result_id']
+        merge = drafts._merge_into_draft
+
+        def submit_first(*args):
+            # The draft is submitted right after the autosave looked it up
+            drafts.submit_draft(AssessmentResult.objects.get(pk=draft_id))
+            return merge(*args)
+
+        with mock.patch.object(drafts, '_merge_into_draft', side_effect=submit_first):
+            new_id = self.autosave({'1': 'b'})['result_id']
+        self.assertNotEqual(new_id, draft_id)
+        self.assertEqual(AssessmentResult.objects.get(pk=draft_id).answers, {'1': 'a'})
+        self.assertEqual(AssessmentResult.objects.get(pk=new_id).answers, {'1': 'b'})
+
+
+@override_settings(AI_PROVIDER='stub', AI_STUB_LATENCY=0, AI_HEDGE_PROVIDER='', AI_RATE_LIMIT_PER_MINUTE=0,
+                   ANALYSIS_QUEUE_EAGER=True, AI_CACHE_ENABLED=False)
+class AsyncAnalysisTests(TestCase):
+    def setUp(self):
+        providers._instances.clear()
+        self.user = CustomUser.objects.create_user(phone_number='09120000000')
+        self.test = Test.objects.create(name='Test', system_prompt='prompt', questions=[{'id': 1, 'question': 'Question 1'}])
+        self.answers = {'user_info': {}, 'responses': [{'question_id': 1, 'question_text': 'Question 1', 'answer': 'a'}]}
+
+    async def test_submit_runs_the_analysis_in_the_event_loop(self):
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.post(f'/api/tests/{self.test.id}/submit/', self.answers, content_type='application/json')
+
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json()['job']['job_status'], AnalysisJob.STATUS_DONE)
+        result = await AssessmentResult.objects.aget(pk=response.json()['result_id'])
+        self.assertEqual(result.answers, {'1': 'a'})
+        self.assertIn('recommended_jobs', result.ai_analysis)
+
+    async def test_stream_is_an_async_iterator_under_asgi(self):
+        await self.async_client.aforce_login(self.user)
+        result = await AssessmentResult.objects.acreate(user=self.user, test=self.test, answers=self.answers)
+        response = await self.async_client.post(f'/api/tests/{self.test.id}/analyze/{result.id}/stream/')
+
+        self.assertTrue(response.is_async)
+        body = b''.join([chunk async for chunk in response.streaming_content]).decode()
+        self.assertIn('event: section', body)
+        self.assertIn('event: done', body)
+        await result.arefresh_from_db()
+        self.assertIsNotNone(result.ai_analysis)
+
+    @override_settings(AI_STUB_LATENCY=0.2)
+    async def test_analyses_wait_concurrently(self):
+        started = time.monotonic()
+        analyses = await asyncio.gather(*(
+            ai.aget_ai_analysis({'responses': [{'question_id': 1, 'answer': str(i)}]}, 'prompt') for i in range(20)
+        ))
+        # 20 calls of 0.2s each, all waiting at the same time
+        self.assertLess(time.monotonic() - started, 2)
+        self.assertEqual(len({analysis['analysis'] for analysis in analyses}), 20)
+
+    async def test_cancelled_hedged_call_cancels_both_requests(self):
+        cancelled = []
+
+        async def slow(name):
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.append(name)
+                raise
+
+        call = asyncio.ensure_future(resilience.ahedged_call(lambda: slow('primary'), lambda: slow('hedge'), 0.01))
+        await asyncio.sleep(0.05)
+        call.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await call
+        await asyncio.sleep(0)
+        self.assertEqual(sorted(cancelled), ['hedge', 'primary'])
+
+
+class ReplicaRoutingTests(TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(db_router, 'replica_configured', return_value=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.router = db_router.PrimaryReplicaRouter()
+
+    def test_only_read_only_views_read_from_the_replica(self):
+        read_only = db_router.use_replica(lambda request: self.router.db_for_read(AssessmentResult))
+
+        self.assertEqual(read_only(None), 'replica')
+        self.assertEqual(self.router.db_for_read(AssessmentResult), 'default')
+        self.assertEqual(db_router.use_replica(lambda request: self.router.db_for_write(AssessmentResult))(None), 'default')
+
+        token = db_router._pinned_to_primary.set(True)
+        self.addCleanup(db_router._pinned_to_primary.reset, token)
+        self.assertEqual(read_only(None), 'default')
+
+    def test_writes_pin_the_client_to_the_primary(self):
+        user = CustomUser.objects.create_user(phone_number='09120000000')
+        test = Test.objects.create(name='Test', system_prompt='prompt', questions=[{'id': 1, 'question': 'Question 1'}])
+        self.client.force_login(user)
+
+        self.assertNotIn(db_router.PIN_COOKIE, self.client.get('/api/history/').cookies)
+        response = self.client.patch(f'/api/tests/{test.id}/draft/', json.dumps({'1': 'a'}), content_type='application/json')
+        self.assertEqual(response.cookies[db_router.PIN_COOKIE]['max-age'], settings.DATABASE_REPLICA_PIN_SECONDS)
+
+
+# The stand-in replica gets none of the other tests' fixtures, so run this one on its own:
+# DATABASE_REPLICA_NAME=replica.sqlite3 python manage.py test assessment.tests.ReplicaDatabaseTests
+@skipUnless(db_router.replica_configured(), "Needs a replica database (DATABASE_REPLICA_NAME).")
+class ReplicaDatabaseTests(TestCase):
+    # Every configured alias: the runner sets up (and checks) whatever is named here, even when skipped
+    databases = set(settings.DATABASES)
+
+    def test_history_reads_the_replica_until_the_user_writes(self):
+        user = CustomUser.objects.create_user(phone_number='09120000000')
+        test = Test.objects.create(name='Test', system_prompt='prompt', questions=[{'id': 1, 'question': 'Question 1'}])
+        AssessmentResult.objects.create(user=user, test=test, answers={'1': 'a'})
+        self.client.force_login(user)
+
+        # Nothing replicates to the local stand-in, so the replica has no history
+        self.assertEqual(self.client.get('/api/history/').json()['history'], [])
+        self.client.cookies[db_router.PIN_COOKIE] = '1'
+        self.assertEqual(len(self.client.get('/api/history/').json()['history']), 1)
+
+    def test_shared_catalog_is_built_from_the_primary(self):
+        self.client.force_login(CustomUser.objects.create_user(phone_number='09120000000'))
+        with self.captureOnCommitCallbacks(execute=True):
+            Test.objects.create(name='New test', system_prompt='prompt', questions=[])
+
+        # Cached for every process under the new version, so it mustn't come from the lagging replica
+        names = [test['name'] for test in self.client.get('/api/tests/list/').json()['tests']]
+        self.assertEqual(names, ['New test'])
+
+
+@override_settings(AI_PROVIDER='stub', AI_STUB_LATENCY=0, AI_HEDGE_PROVIDER='', AI_RATE_LIMIT_PER_MINUTE=0,
+                   ANALYSIS_QUEUE_EAGER=True, AI_CACHE_ENABLED=False, METRICS_ALLOWED_IPS=['10.0.0.1'])
+class RequestMetricsTests(TestCase):
+    def setUp(self):
+        providers._instances.clear()
+        self.user = CustomUser.objects.create_user(phone_number='09120000000')
+        self.test = Test.objects.create(name='Test', system_prompt='prompt', questions=[{'id': 1, 'question': 'Question 1'}])
+        self.client.force_login(self.user)
+
+    def test_server_timing_header(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/history/')
+        self.assertRegex(response['Server-Timing'], rf'^app;dur=[\d.]+, db;dur=[\d.]+;desc="{len(queries)} queries"$')
+
+        response = self.client.post(f'/api/tests/{self.test.id}/submit/', {'1': 'a'}, content_type='application/json')
+        self.assertIn('ai;dur=', response['Server-Timing'])
+
+    def test_metrics_endpoint(self):
+        self.client.get('/api/history/')
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='10.0.0.1').status_code, 200)
+
+        CustomUser.objects.filter(pk=self.user.pk).update(is_staff=True)
+        body = self.client.get('/metrics').content.decode()
+        self.assertIn('# TYPE kafna_http_request_duration_seconds histogram', body)
+        self.assertRegex(body, r'kafna_http_requests_total\{view="api_get_user_history",method="GET",status="200"\} \d+')
+        self.assertIn('kafna_db_queries_per_request_bucket{view="api_get_user_history",le="+Inf"}', body)
+
+
+@override_settings(AI_PROVIDER='stub', AI_STUB_LATENCY=0, AI_HEDGE_PROVIDER='', ANALYSIS_QUEUE_EAGER=True,
+                   AI_CACHE_ENABLED=True, AI_TOKEN_PRICES={'local-stub': [1, 2]})
+class UsageTests(TestCase):
+    def setUp(self):
+        providers._instances.clear()
+        self.user = CustomUser.objects.create_user(phone_number='09120000000')
+        self.test = Test.objects.create(name='Test', system_prompt='prompt', questions=[{'id': 1, 'question': 'Question 1'}])
+        self.client.force_login(self.user)
+
+    def submit(self, answer):
+        response = self.client.post(f'/api/tests/{self.test.id}/submit/', {'1': answer}, content_type='application/json')
+        return AnalysisUsage.objects.get(result_id=response.json()['result_id'])
+
+    def test_analysis_records_usage(self):
+        call = self.submit('a')
+        self.assertEqual((call.test, call.provider, call.model_name), (self.test, 'stub', 'local-stub'))
+        self.assertFalse(call.cache_hit)
+        self.assertTrue(call.succeeded)
+        self.assertGreater(call.prompt_tokens, 0)
+        self.assertGreater(call.completion_tokens, 0)
+        self.assertEqual(call.cost, usage.estimate_cost('local-stub', call.prompt_tokens, call.completion_tokens))
+        self.assertGreater(call.cost, 0)
+
+        # Same answers again: served from the analysis cache, nothing was spent
+        cached = self.submit('a')
+        self.assertTrue(cached.cache_hit)
+        self.assertIsNone(cached.prompt_tokens)
+        self.assertEqual(cached.cost, 0)
+
+    def test_reanalyze_results_skips_drafts(self):
+        result = AssessmentResult.objects.create(user=self.user, test=self.test, answers={'1': 'a'})
+        draft = AssessmentResult.objects.create(user=self.user, test=self.test, answers={'1': 'b'}, is_draft=True)
+
+        self.assertEqual(list(results_needing_analysis()), [result])
+        # A dry run, since the analyses run in threads that can't see the test's transaction
+        out = StringIO()
+        call_command('reanalyze_results', dry_run=True, stdout=out)
+        self.assertIn('1 results need analysis.', out.getvalue())
+
+    def test_streamed_analysis_records_usage(self):
+        result = AssessmentResult.objects.create(user=self.user, test=self.test, answers={'1': 'b'})
+        response = self.client.post(f'/api/tests/{self.test.id}/analyze/{result.id}/stream/')
+        b''.join(response.streaming_content)
+
+        call = AnalysisUsage.objects.get(result=result)
+        self.assertTrue(call.streamed)
+        self.assertGreater(call.completion_tokens, 0)
+
+    @override_settings(AI_HEDGE_PROVIDER='stub', AI_HEDGE_DEFAULT_DELAY=0.01, AI_HEDGE_MIN_DELAY=0, AI_STUB_LATENCY=0.1,
+                       AI_CACHE_ENABLED=False)
+    def test_hedged_analysis_pays_for_both_requests(self):
+        call = self.submit('a')
+        self.assertTrue(call.hedged)
+        # The losing request is still running, so it is assumed to cost the same
+        self.assertEqual(call.cost, 2 * usage.estimate_cost('local-stub', call.prompt_tokens, call.completion_tokens))
+
+    def test_stream_usage_can_be_turned_off(self):
+        # Only builds the request, so the openai package isn't needed
+        request = partial(providers.OpenAIProvider._request, mock.Mock(model_name='gpt'), 'prompt', 'answers', 10, True)
+        self.assertEqual(request()['stream_options'], {'include_usage': True})
+        with override_settings(OPENAI_STREAM_USAGE=False):
+            self.assertNotIn('stream_options', request())
+
+    def test_report_percentiles_per_test(self):
+        other = Test.objects.create(name='Other', system_prompt='prompt', questions=[])
+        AnalysisUsage.objects.bulk_create(
+            [AnalysisUsage(test=self.test, provider='stub', model_name='local-stub', latency_ms=ms,
+                           prompt_tokens=100, completion_tokens=50, cost=1) for ms in range(10, 1010, 10)]
+            + [AnalysisUsage(test=self.test, provider='stub', model_name='local-stub', latency_ms=1, cache_hit=True, cost=0),
+               AnalysisUsage(test=other, provider='stub', model_name='local-stub', latency_ms=5000, succeeded=False)]
+        )
+
+        slowest, row = usage.usage_report()
+        # Failed calls don't count towards the latency, so Other has none and goes last
+        self.assertEqual((slowest['test_name'], slowest['p95_ms'], slowest['failures']), ('Test', 960, 0))
+        self.assertEqual(slowest['p50_ms'], 510)
+        self.assertEqual((slowest['calls'], slowest['avg_prompt_tokens'], slowest['total_tokens']), (101, 100, 15000))
+        self.assertEqual(slowest['cost'], 100)
+        self.assertEqual((row['test_name'], row['p95_ms'], row['failures']), ('Other', None, 1))
+
+        CustomUser.objects.filter(pk=self.user.pk).update(is_staff=True, is_superuser=True)
+        response = self.client.get('/admin/assessment/analysisusage/report/')
+        self.assertContains(response, '<td>960</td>')
+        self.assertContains(self.client.get('/admin/assessment/analysisusage/'), 'analysisusage/report/')
+
+
+@override_settings(ANALYSIS_QUEUE_EAGER=False, ANALYSIS_JOB_MAX_ATTEMPTS=2, ANALYSIS_JOB_TIMEOUT=60)
+class AnalysisJobTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(phone_number='09120000000')
+        self.test = Test.objects.create(name='Test', system_prompt='prompt', questions=[{'id': 1, 'question': 'Question 1'}])
+        self.result = AssessmentResult.objects.create(user=self.user, test=self.test, answers={'1': 'a'})
+
+    def test_enqueue_returns_the_active_job(self):
+        job = jobs.enqueue_analysis(self.result)
+        self.assertEqual(job.status, AnalysisJob.STATUS_PENDING)
+        self.assertEqual(jobs.enqueue_analysis(self.result), job)
+
+    def test_a_job_is_claimed_once(self):
+        first = jobs.enqueue_analysis(self.result)
+        second = jobs.enqueue_analysis(AssessmentResult.objects.create(user=self.user, test=self.test, answers={'1': 'b'}))
+
+        self.assertTrue(jobs._claim(first.pk))
+        self.assertFalse(jobs._claim(first.pk))
+        claimed = jobs.claim_next_job()
+        self.assertEqual(claimed, second)
+        self.assertEqual((claimed.status, claimed.attempts), (AnalysisJob.STATUS_RUNNING, 1))
+        self.assertIsNone(jobs.claim_next_job())
+
+    def test_worker_survives_database_errors(self):
+        stop = threading.Event()
+        job = jobs.enqueue_analysis(self.result)
+
+        def claim():
+            if not claim.calls:
+                claim.calls += 1
+                raise OperationalError('database is locked')
+            stop.set()
+            return job
+        claim.calls = 0
+
+        with mock.patch.object(jobs, 'claim_next_job', claim), mock.patch.object(jobs, 'run_job') as run, \
+                mock.patch.object(jobs, 'close_old_connections'), self.assertLogs('assessment.jobs', 'ERROR'):
+            jobs._worker_loop(stop, poll_interval=0)
+        run.assert_called_once_with(job)
+
+    def test_failed_runs_are_retried_then_given_up(self):
+        job = jobs.enqueue_analysis(self.result)
+        with mock.patch.object(jobs, 'analyze_result', side_effect=resilience.AIUnavailableError('down')), \
+                self.assertLogs('assessment.jobs', 'ERROR'):
+            for status in (AnalysisJob.STATUS_PENDING, AnalysisJob.STATUS_FAILED):
+                jobs.run_job(jobs.claim_next_job())
+                job.refresh_from_db()
+                self.assertEqual((job.status, job.error), (status, 'down'))
+        self.assertEqual(job.attempts, 2)
+        self.assertIsNotNone(job.finished_at)
+
+    def test_open_circuit_does_not_use_up_an_attempt(self):
+        job = jobs.enqueue_analysis(self.result)
+        with mock.patch.object(jobs, 'analyze_result', side_effect=resilience.CircuitOpenError('open')):
+            jobs.run_job(jobs.claim_next_job())
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (AnalysisJob.STATUS_PENDING, 0))
+
+    def test_successful_run(self):
+        jobs.enqueue_analysis(self.result)
+        with mock.patch.object(jobs, 'analyze_result') as analyze:
+            job = jobs.run_job(jobs.claim_next_job())
+        analyze.assert_called_once_with(job.result, use_cache=True)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.error), (AnalysisJob.STATUS_DONE, ''))
+
+    def test_stale_running_jobs_are_requeued(self):
+        job = jobs.enqueue_analysis(self.result)
+        jobs.claim_next_job()
+        self.assertEqual(jobs.requeue_stale_jobs(), 0)
+
+        AnalysisJob.objects.filter(pk=job.pk).update(started_at=timezone.now() - timedelta(seconds=61))
+        self.assertEqual(jobs.requeue_stale_jobs(), 1)
+        self.assertEqual(jobs.claim_next_job(), job)
+
+
+class IncrementalJSONParserTests(SimpleTestCase):
+    document = {
+        'analysis': 'He said "hi" \\ left {braces} and [brackets], then a é and م',
+        'recommended_jobs': [{'job': 'A, B', 'score': 1}, {'job': 'C]"', 'tags': ['x', 'y']}, 3, None],
+        'empty': [],
+        'mbti': {'type': 'INTJ'},
+    }
+
+    def parse(self, chunks):
+        parser = IncrementalJSONParser()
+        events = [event for chunk in chunks for event in parser.feed(chunk)]
+        return parser, events
+
+    def check(self, parser, events):
+        self.assertEqual(parser.result, self.document)
+        self.assertEqual([event.value for event in events if event.kind == 'item'], self.document['recommended_jobs'])
+        self.assertEqual([event.index for event in events if event.kind == 'item'], [0, 1, 2, 3])
+        self.assertEqual([event.key for event in events if event.kind == 'member'], list(self.document))
+
+    def test_any_split_gives_the_same_events(self):
+        text = '```json\n' + json.dumps(self.document, ensure_ascii=False, indent=1) + '\n```'
+        self.check(*self.parse([text]))
+        for size in (1, 2, 3, 7):
+            with self.subTest(chunk_size=size):
+                self.check(*self.parse([text[i:i + size] for i in range(0, len(text), size)]))
+
+    def test_split_inside_an_escape(self):
+        text = json.dumps(self.document)
+        split = text.index('\\"')
+        self.check(*self.parse([text[:split + 1], text[split + 1:]]))
+
+    def test_items_come_before_the_array_closes(self):
+        parser = IncrementalJSONParser()
+        events = parser.feed('{"analysis": "x", "recommended_jobs": [{"job": "A"}, {"jo')
+        self.assertEqual([(event.kind, event.key) for event in events], [('member', 'analysis'), ('item', 'recommended_jobs')])
+        with self.assertRaises(ValueError):
+            parser.result
+
+
+class FakeClock:
+    """Stands in for the time module in resilience: sleeping just moves the clock."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class ResilienceTests(SimpleTestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch.object(resilience, 'time', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def guard(self, max_retries=2):
+        return resilience.AIGuard(resilience.TokenBucket(0, 0), resilience.CircuitBreaker(3, 30), timeout=10,
+                                  total_timeout=60, max_retries=max_retries, base_delay=1, max_delay=4)
+
+    def test_token_bucket(self):
+        bucket = resilience.TokenBucket(rate=1, capacity=2)
+        self.assertTrue(bucket.acquire())
+        self.assertTrue(bucket.acquire())
+        # The next token is a second away
+        self.assertFalse(bucket.acquire(timeout=0.5))
+        self.assertTrue(bucket.acquire(timeout=1))
+        self.assertEqual(self.clock.now, 1001)
+        self.assertTrue(resilience.TokenBucket(rate=0, capacity=0).acquire(timeout=0))
+
+    def test_circuit_breaker_states(self):
+        breaker = resilience.CircuitBreaker(failure_threshold=2, reset_timeout=30)
+        breaker.record_failure()
+        self.assertEqual(breaker.state, breaker.CLOSED)
+        with self.assertLogs('assessment.resilience', 'WARNING'):
+            breaker.record_failure()
+        self.assertEqual(breaker.state, breaker.OPEN)
+        with self.assertRaises(resilience.CircuitOpenError):
+            breaker.before_call()
+        self.assertEqual(breaker.retry_after(), 30)
+
+        # Half open: a single trial request, which fails and opens it again
+        self.clock.sleep(30)
+        self.assertEqual(breaker.state, breaker.HALF_OPEN)
+        breaker.before_call()
+        with self.assertRaises(resilience.CircuitOpenError):
+            breaker.before_call()
+        breaker.record_failure()
+        self.assertEqual(breaker.state, breaker.OPEN)
+
+        self.clock.sleep(30)
+        breaker.before_call()
+        breaker.record_success()
+        self.assertEqual(breaker.state, breaker.CLOSED)
+        self.assertEqual(breaker.retry_after(), 0)
+
+    def test_guard_retries_transient_errors(self):
+        fn = mock.Mock(side_effect=[TimeoutError(), ConnectionError(), 'analysis'])
+        self.assertEqual(self.guard().call(fn), 'analysis')
+        self.assertEqual(fn.call_count, 3)
+        self.assertEqual(fn.call_args.args, (10,))
+
+    def test_guard_gives_up(self):
+        guard = self.guard(max_retries=1)
+        fn = mock.Mock(side_effect=TimeoutError())
+        with self.assertRaises(resilience.AIUnavailableError):
+            guard.call(fn)
+        self.assertEqual(fn.call_count, 2)
+        self.assertEqual(guard.breaker.failures, 2)
+
+        # A rejected request isn't retried, and the provider is fine as far as the breaker is concerned
+        fn = mock.Mock(side_effect=ValueError('bad request'))
+        with self.assertRaises(ValueError):
+            guard.call(fn)
+        self.assertEqual(fn.call_count, 1)
+        self.assertEqual(guard.breaker.failures, 0)
+
+
+class HedgedCallTests(SimpleTestCase):
+    def test_fast_primary_is_not_hedged(self):
+        secondary = mock.Mock(return_value='secondary')
+        self.assertEqual(resilience.hedged_call(lambda: 'primary', secondary, delay=1), 'primary')
+        secondary.assert_not_called()
+
+    def test_slow_primary_loses_to_the_hedge(self):
+        release = threading.Event()
+        self.addCleanup(release.set)
+
+        def slow_primary():
+            release.wait(5)
+            return 'primary'
+
+        self.assertEqual(resilience.hedged_call(slow_primary, lambda: 'secondary', delay=0.01), 'secondary')
+
+    def test_failed_primary_is_hedged_at_once(self):
+        def failing():
+            raise resilience.AIUnavailableError('primary')
+
+        started = time.monotonic()
+        self.assertEqual(resilience.hedged_call(failing, lambda: 'secondary', delay=5), 'secondary')
+        self.assertLess(time.monotonic() - started, 1)
+
+    def test_both_failing_raises_the_primary_error(self):
+        def failing(name):
+            def call():
+                time.sleep(0.02)
+                raise resilience.AIUnavailableError(name)
+            return call
+
+        with self.assertRaisesMessage(resilience.AIUnavailableError, 'primary'):
+            resilience.hedged_call(failing('primary'), failing('secondary'), delay=0.01)
+
+    def test_async_slow_primary_is_cancelled(self):
+        cancelled = []
+
+        async def slow_primary():
+            try:
+                await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                cancelled.append('primary')
+                raise
+
+        async def secondary():
+            return 'secondary'
+
+        async def race():
+            result = await resilience.ahedged_call(slow_primary, secondary, delay=0.01)
+            await asyncio.sleep(0)
+            return result
+
+        self.assertEqual(asyncio.run(race()), 'secondary')
+        self.assertEqual(cancelled, ['primary'])
+
+
+class NameIndexTests(SimpleTestCase):
+    def setUp(self):
+        self.index = name_index.NameIndex([
+            (1, 'برنامه‌نویس پایتون', 'توسعه دهنده بک اند'),
+            (2, 'برنامه نویس وب', None),
+            (3, 'طراح گرافیک', 'Graphic Designer'),
+            (4, 'مدیر پروژه ۲', None),
+        ])
+
+    def test_normalize_name(self):
+        self.assertEqual(name_index.normalize_name('برنامه‌نويس'), 'برنامه نویس')
+        self.assertEqual(name_index.normalize_name('  مُدیر  پروژه-۱۲ '), 'مدیر پروژه 12')
+        self.assertEqual(name_index.normalize_name('Graphic_Designer'), 'graphic designer')
+        self.assertEqual(name_index.normalize_name(None), '')
+
+    def test_exact_job_name_wins(self):
+        self.assertEqual(self.index.find_test_id('توسعه‌دهنده بک‌اند'), 1)
+        self.assertEqual(self.index.find_test_id('graphic designer'), 3)
+
+    def test_exact_test_name(self):
+        self.assertEqual(self.index.find_test_id('برنامه نويس وب'), 2)
+        self.assertEqual(self.index.find_test_id('مدیر پروژه 2'), 4)
+
+    def test_prefix_match_keeps_priority_order(self):
+        self.assertEqual(self.index.find_test_id('برنامه نو'), 1)
+        self.assertEqual(self.index.find_test_id('برنامه و'), 2)
+        self.assertEqual(self.index._prefix_matches(['برنامه']), [0, 1])
+
+    def test_substring_fallback_and_misses(self):
+        self.assertEqual(self.index.find_test_id('افیک'), 3)
+        self.assertIsNone(self.index.find_test_id('حسابدار'))
+        self.assertIsNone(self.index.find_test_id('  '))
+
+
+class TestVersionTests(TestCase):
+    questions = [{'id': 1, 'question': 'Question 1'}, {'id': 2, 'question': 'Question 2'}]
+
+    def setUp(self):
+        self.test = Test.objects.create(name='Test', questions=self.questions, system_prompt='Prompt')
+        self.user = CustomUser.objects.create_user(phone_number='09120000000')
+
+    def rich(self, *answers, texts=('Question 1', 'Question 2'), user_info=None):
+        return {'user_info': user_info or {}, 'responses': [
+            {'question_id': i, 'question_text': text, 'answer': answer}
+            for i, (text, answer) in enumerate(zip(texts, answers), start=1)
+        ]}
+
+    def test_save_snapshots_the_questions_and_prompt(self):
+        first = self.test.current_version
+        self.assertEqual((first.number, first.questions, first.system_prompt), (1, self.questions, 'Prompt'))
+
+        self.test.name = 'Renamed'
+        self.test.save()
+        self.assertEqual(self.test.versions.count(), 1)
+
+        self.test.system_prompt = 'New prompt'
+        self.test.save()
+        self.assertEqual(Test.objects.get(pk=self.test.pk).current_version.number, 2)
+
+        # Reverting goes back to the old snapshot
+        self.test.system_prompt = 'Prompt'
+        self.test.save()
+        self.assertEqual(Test.objects.get(pk=self.test.pk).current_version_id, first.pk)
+        self.assertEqual(self.test.versions.count(), 2)
+
+    def test_rich_answers_rehydrates_compact_answers(self):
+        result = AssessmentResult.objects.create(
+            user=self.user, test=self.test, test_version=self.test.current_version,
+            answers=AssessmentResult.compact_answers(self.rich('a', 'b')),
+        )
+        self.assertEqual(result.answers, {'1': 'a', '2': 'b'})
+        self.assertEqual(AssessmentResult.objects.get(pk=result.pk).rich_answers, self.rich('a', 'b'))
+
+        # Later edits of the test don't change what the user answered
+        self.test.questions = [{'id': 1, 'question': 'Edited'}]
+        self.test.save()
+        self.assertEqual(AssessmentResult.objects.get(pk=result.pk).rich_answers, self.rich('a', 'b'))
+
+    def test_compact_answers_keeps_extra_data_and_rejects_malformed_responses(self):
+        with_info = self.rich('a', user_info={'age': 30})
+        self.assertEqual(AssessmentResult.compact_answers(with_info), with_info)
+        for malformed in ([], {'responses': {}}, {'responses': [{'question_id': 1}]}, {'responses': [{'answer': 'a'}]}):
+            with self.subTest(malformed=malformed), self.assertRaises(ValueError):
+                AssessmentResult.compact_answers(malformed)
+
+        self.client.force_login(self.user)
+        response = self.client.post(f'/api/tests/{self.test.id}/submit/', {'responses': [{'answer': 'a'}]},
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(AssessmentResult.objects.exists())
+
+    def test_rich_answers_keeps_unknown_and_rich_rows(self):
+        result = AssessmentResult(test=self.test, test_version=self.test.current_version, answers={'2': 'b', '9': 'z'})
+        self.assertEqual(result.rich_answers['responses'], [
+            {'question_id': 2, 'question_text': 'Question 2', 'answer': 'b'},
+            {'question_id': '9', 'question_text': None, 'answer': 'z'},
+        ])
+        self.assertEqual(AssessmentResult(test=self.test, answers=self.rich('a')).rich_answers, self.rich('a'))
+
+    def test_compaction_migration(self):
+        migration = importlib.import_module('assessment.migrations.0010_compact_answers')
+        # The state right before 0010: rich answers and no snapshots yet
+        Test.objects.update(current_version=None)
+        self.test.versions.all().delete()
+        current = AssessmentResult.objects.create(user=self.user, test=self.test, answers=self.rich('a', 'b'))
+        edited = AssessmentResult.objects.create(user=self.user, test=self.test, answers=self.rich('a', texts=('Old question',)))
+        with_info = AssessmentResult.objects.create(user=self.user, test=self.test, answers=self.rich('a', user_info={'age': 30}))
+
+        migration.compact_answers(django_apps, None)
+        version = Test.objects.get(pk=self.test.pk).current_version
+        self.assertEqual((version.number, version.questions), (1, self.questions))
+        current.refresh_from_db()
+        self.assertEqual((current.answers, current.test_version_id), ({'1': 'a', '2': 'b'}, version.pk))
+        self.assertEqual(current.rich_answers, self.rich('a', 'b'))
+        for result in (edited, with_info):
+            self.assertEqual(AssessmentResult.objects.filter(pk=result.pk, test_version=None, answers=result.answers).count(), 1)
+
+        migration.expand_answers(django_apps, None)
+        current.refresh_from_db()
+        self.assertEqual((current.answers, current.test_version_id), (self.rich('a', 'b'), None))
+
+
+@override_settings(ANALYSIS_QUEUE_EAGER=False)
+class RecommendationSignalTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(phone_number='09120000000')
+        self.job = Job.objects.create(name='Job A')
+        primary = Test.objects.create(name='Primary', questions=[], is_primary_assessment=True)
+        self.test = Test.objects.create(name='Test', questions=[])
+        AssessmentResult.objects.create(user=self.user, test=primary, answers={},
+                                        ai_analysis={'recommended_jobs': [{'job': 'Job A'}]})
+
+    def recommended(self):
+        return list(RecommendedTest.objects.filter(user=self.user).values_list('test_id', flat=True))
+
+    def save(self, instance):
+        with self.captureOnCommitCallbacks(execute=True):
+            instance.save()
+        # What the analysis worker does next
+        recommendations.run_requested_refresh()
+
+    def test_linking_a_test_requests_a_refresh(self):
+        self.test.related_job = self.job
+        with self.captureOnCommitCallbacks(execute=True):
+            self.test.save()
+        self.assertEqual(self.recommended(), [])
+        self.assertTrue(RecommendationRefresh.objects.exists())
+
+        self.assertEqual(recommendations.run_requested_refresh(), 1)
+        self.assertEqual(self.recommended(), [self.test.pk])
+        self.assertFalse(RecommendationRefresh.objects.exists())
+        self.assertIsNone(recommendations.run_requested_refresh())
+
+        self.test.related_job = None
+        self.save(self.test)
+        self.assertEqual(self.recommended(), [])
+
+    def test_renaming_or_deleting_the_job(self):
+        self.test.related_job = self.job
+        self.save(self.test)
+
+        self.job.name = 'Job B'
+        self.save(self.job)
+        self.assertEqual(self.recommended(), [])
+
+        self.job.name = 'Job A'
+        self.save(self.job)
+        self.assertEqual(self.recommended(), [self.test.pk])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.job.delete()
+        recommendations.run_requested_refresh()
+        self.assertEqual(self.recommended(), [])
+
+    def test_deleting_the_primary_result(self):
+        self.test.related_job = self.job
+        self.save(self.test)
+        AssessmentResult.objects.create(user=self.user, test=self.test, answers={}, ai_analysis={'mbti': {}})
+
+        AssessmentResult.objects.filter(test=self.test).delete()
+        self.assertEqual(self.recommended(), [self.test.pk])
+        AssessmentResult.objects.filter(test__is_primary_assessment=True).delete()
+        self.assertEqual(self.recommended(), [])
+
+    def test_unrelated_edits_dont_request_a_refresh(self):
+        self.test.description = 'Edited'
+        self.save(self.test)
+        self.save(self.job)
+        self.assertFalse(RecommendationRefresh.objects.exists())
+
+    def test_failed_refresh_is_requested_again(self):
+        recommendations.request_full_refresh()
+        with mock.patch.object(recommendations, 'refresh_recommended_tests', side_effect=OperationalError), \
+                self.assertRaises(OperationalError):
+            recommendations.run_requested_refresh()
+        self.assertEqual(RecommendationRefresh.objects.count(), 1)
+
+    @override_settings(ANALYSIS_QUEUE_EAGER=True)
+    def test_eager_queue_refreshes_on_commit(self):
+        self.test.related_job = self.job
+        with self.captureOnCommitCallbacks(execute=True):
+            self.test.save()
+        self.assertEqual(self.recommended(), [self.test.pk])
+        self.assertFalse(RecommendationRefresh.objects.exists())
+
+
+class SyntheticDataTests(TestCase):
+    def test_rerun_reuses_the_tests(self):
+        options = {'users': 2, 'tests': 2, 'questions': 2, 'results': 5, 'stdout': StringIO()}
+        call_command('generate_synthetic_data', **options)
+        call_command('generate_synthetic_data', **options)
+
+        self.assertEqual(Test.objects.count(), 2)
+        self.assertEqual(Job.objects.count(), 2)
+        self.assertEqual(Test.objects.filter(is_primary_assessment=True).count(), 1)
+        self.assertEqual(AssessmentResult.objects.count(), 10)
@@ -7,8 +7,13 @@ from .views import (
      dashboard_api_view,
     get_tests_list_api,
     get_user_history_api,
+    get_history_detail_api,
     save_draft_view,
-    perform_analysis_view
+    perform_analysis_view,
+    analysis_job_status_api,
+    stream_analysis_view,
+    get_archived_history_api,
+    autosave_draft_view
 )
 
 urlpatterns = [
@@ -18,6 +23,11 @@ urlpatterns = [
     path('api/tests/<int:test_id>/submit/', get_ai_analysis_view, name='api_get_ai_analysis'),
     path('api/tests/list/', get_tests_list_api, name='api_get_tests_list'),
     path('api/history/', get_user_history_api, name='api_get_user_history'),
+    path('api/history/archived/', get_archived_history_api, name='api_get_archived_history'),
+    path('api/history/<int:result_id>/', get_history_detail_api, name='api_get_history_detail'),
     path('api/tests/<int:test_id>/save-draft/', save_draft_view, name='api_save_draft'),
+    path('api/tests/<int:test_id>/draft/', autosave_draft_view, name='api_autosave_draft'),
     path('api/tests/<int:test_id>/analyze/<int:result_id>/', perform_analysis_view, name='api_perform_analysis'),
+    path('api/tests/<int:test_id>/analyze/<int:result_id>/stream/', stream_analysis_view, name='api_stream_analysis'),
+    path('api/analysis-jobs/<int:job_id>/', analysis_job_status_api, name='api_analysis_job_status'),
 ]
\ No newline at end of file
@@ -0,0 +1,139 @@
+# assessment/usage.py
+"""
+Accounting of AI analysis calls.
+
+Every analysis (queued, eager, streamed or from reanalyze_results) stores
+an AnalysisUsage row with what ai.AICallStats measured, priced with
+AI_TOKEN_PRICES. `usage_report` sums up the last AI_USAGE_REPORT_DAYS per
+test for the admin, so the slowest and most expensive prompts stand out.
+"""
+import logging
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import AnalysisUsage, Test
+
+logger = logging.getLogger(__name__)
+
+
+def estimate_cost(model_name, prompt_tokens, completion_tokens):
+    """USD for one call, or None when the model has no price or the tokens are unknown."""
+    prices = settings.AI_TOKEN_PRICES.get(model_name)
+    if prices is None or prompt_tokens is None:
+        return None
+    prompt_price, completion_price = (Decimal(str(price)) for price in prices)
+    return (prompt_price * prompt_tokens + completion_price * (completion_tokens or 0)) / 1_000_000
+
+
+def _cost(stats):
+    if stats.cache_hit:
+        # A cache hit didn't call the provider at all
+        return Decimal(0)
+    cost = estimate_cost(stats.model_name, stats.prompt_tokens, stats.completion_tokens)
+    for call in stats.unused_calls:
+        # A losing hedged request is paid for too. If it hasn't reported its
+        # tokens yet, it had the same prompt, so assume about the same counts
+        reported = call.prompt_tokens is not None
+        extra = estimate_cost(call.model_name,
+                              call.prompt_tokens if reported else stats.prompt_tokens,
+                              call.completion_tokens if reported else stats.completion_tokens)
+        if extra is not None:
+            cost = (cost or 0) + extra
+    return cost
+
+
+def _build(result, stats):
+    return AnalysisUsage(
+        result=result,
+        test_id=result.test_id,
+        provider=stats.provider,
+        model_name=stats.model_name,
+        latency_ms=round(stats.latency * 1000),
+        prompt_tokens=stats.prompt_tokens,
+        completion_tokens=stats.completion_tokens,
+        retries=stats.retries,
+        cache_hit=stats.cache_hit,
+        streamed=stats.streamed,
+        succeeded=stats.succeeded,
+        hedged=stats.hedged,
+        cost=_cost(stats),
+    )
+
+
+def record_usage(result, stats):
+    """Stores the usage of one analysis of `result`. Never raises: accounting mustn't fail an analysis."""
+    try:
+        _build(result, stats).save()
+    except Exception:
+        logger.exception("Couldn't record AI usage for result %s", result.pk)
+
+
+async def arecord_usage(result, stats):
+    try:
+        await _build(result, stats).asave()
+    except Exception:
+        logger.exception("Couldn't record AI usage for result %s", result.pk)
+
+
+def _percentile(ordered, pct):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))] if ordered else None
+
+
+def usage_report(days=None):
+    """
+    One row per test with calls in the last `days` (AI_USAGE_REPORT_DAYS),
+    slowest p95 first. Latency percentiles only count successful calls that
+    reached the provider; cache hits would make every prompt look fast.
+    """
+    since = timezone.now() - timedelta(days=days or settings.AI_USAGE_REPORT_DAYS)
+    rows = (AnalysisUsage.objects
+            .filter(created_at__gte=since)
+            .order_by()
+            .values_list('test_id', 'latency_ms', 'prompt_tokens', 'completion_tokens', 'cost', 'cache_hit', 'succeeded',
+                         'retries', 'hedged'))
+
+    stats = defaultdict(lambda: {'calls': 0, 'cache_hits': 0, 'failures': 0, 'retries': 0, 'hedged': 0, 'latencies': [],
+                                 'prompt_tokens': 0, 'completion_tokens': 0, 'metered_calls': 0, 'cost': Decimal(0)})
+    for test_id, latency_ms, prompt_tokens, completion_tokens, cost, cache_hit, succeeded, retries, hedged in rows.iterator():
+        test = stats[test_id]
+        test['calls'] += 1
+        test['retries'] += retries
+        test['hedged'] += hedged
+        if cache_hit:
+            test['cache_hits'] += 1
+        elif not succeeded:
+            test['failures'] += 1
+        else:
+            test['latencies'].append(latency_ms)
+        if prompt_tokens is not None:
+            test['metered_calls'] += 1
+            test['prompt_tokens'] += prompt_tokens
+            test['completion_tokens'] += completion_tokens or 0
+        test['cost'] += cost or 0
+
+    names = dict(Test.objects.filter(pk__in=stats).values_list('pk', 'name'))
+    report = []
+    for test_id, test in stats.items():
+        latencies = sorted(test['latencies'])
+        metered = test['metered_calls']
+        report.append({
+            'test_id': test_id,
+            'test_name': names.get(test_id, f'#{test_id}'),
+            'calls': test['calls'],
+            'cache_hit_rate': test['cache_hits'] / test['calls'],
+            'failures': test['failures'],
+            'retries': test['retries'],
+            'hedged': test['hedged'],
+            'p50_ms': _percentile(latencies, 50),
+            'p95_ms': _percentile(latencies, 95),
+            'avg_prompt_tokens': round(test['prompt_tokens'] / metered) if metered else None,
+            'avg_completion_tokens': round(test['completion_tokens'] / metered) if metered else None,
+            'total_tokens': test['prompt_tokens'] + test['completion_tokens'],
+            'cost': test['cost'],
+        })
+    report.sort(key=lambda row: (row['p95_ms'] is None, -(row['p95_ms'] or 0)))
+    return report
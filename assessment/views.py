@@ -1,10 +1,31 @@
+import base64
+import binascii
+import hashlib
 import json
-from django.http import JsonResponse
-from django.shortcuts import render, get_object_or_404
+import logging
+from datetime import datetime
+from itertools import islice
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.db.models import BooleanField, Case, Q, Value, When
+from django.conf import settings
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+from django.shortcuts import render, get_object_or_404, aget_object_or_404
 from django.views.decorators.csrf import ensure_csrf_cookie
 from django.contrib.auth.decorators import login_required
-from .models import Test, AssessmentResult
-from .ai import get_ai_analysis
+from core.db_router import use_replica
+from .models import Test, AssessmentResult, AnalysisJob
+from .jobs import aenqueue_analysis
+from .analysis import astream_analyze_result, stream_analyze_result
+from .recommendations import get_dashboard_tests
+from .question_cache import get_questions_payload
+from .catalog import get_primary_test_id, get_tests_list
+from .archive import archived_results
+from .drafts import patch_draft, save_draft, submit_draft
+
+logger = logging.getLogger(__name__)
 
 @ensure_csrf_cookie
 def assessment_view(request):
@@ -12,9 +33,9 @@ def assessment_view(request):
     
     if request.user.is_authenticated:
         context['initial_page'] = 'home'
-        primary_test = Test.objects.filter(is_primary_assessment=True).first()
-        if primary_test:
-            context['start_test_id'] = primary_test.id
+        primary_test_id = get_primary_test_id()
+        if primary_test_id:
+            context['start_test_id'] = primary_test_id
     else:
         context['initial_page'] = 'user-info'
 
@@ -22,71 +43,59 @@ def assessment_view(request):
 
 @login_required
 def get_test_questions_api(request, test_id):
-    test = get_object_or_404(Test, pk=test_id)
-    return JsonResponse(test.questions, safe=False)
+    """The test's questions, served from the in-memory cache. Supports If-None-Match / If-Modified-Since."""
+    payload = get_questions_payload(test_id)
+    if payload is None:
+        raise Http404("No Test matches the given query.")
 
-def find_related_test_id(job_name):
-    if not job_name:
-        return None
-    
-    job_name = job_name.strip()
-    
-    test = Test.objects.filter(related_job__name__iexact=job_name).first()
-    if test:
-        return test.id
-
-    test = Test.objects.filter(name__iexact=job_name).first()
-    if test:
-        return test.id
-
-    test = Test.objects.filter(name__icontains=job_name).first()
-    if test:
-        return test.id
-        
-    return None
-
-def link_jobs_to_analysis(ai_analysis):
-    if 'recommended_jobs' in ai_analysis:
-        for job_item in ai_analysis['recommended_jobs']:
-            job_name = job_item.get('job', '')
-            linked_id = find_related_test_id(job_name)
-            if linked_id:
-                job_item['test_id'] = linked_id
+    etag = quote_etag(f"{payload.test_id}-{payload.version[:32]}")
+    last_modified = int(payload.updated_at.timestamp()) if payload.updated_at else None
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = HttpResponse(payload.body, content_type='application/json')
+
+    response['ETag'] = etag
+    if last_modified:
+        response['Last-Modified'] = http_date(last_modified)
+    # Questions are behind login, so only the user's browser may keep them
+    patch_cache_control(response, private=True, max_age=settings.QUESTIONS_BROWSER_MAX_AGE, must_revalidate=True)
+    return response
+
+def _job_payload(job):
+    return {'id': job.id, 'result_id': job.result_id, 'job_status': job.status}
+
+# The submit and analyze views are async: under ASGI an eager analysis awaits
+# the AI without holding a thread (see jobs.aenqueue_analysis)
 
 @login_required
-def get_ai_analysis_view(request, test_id):
-    test = get_object_or_404(Test, pk=test_id)
+async def get_ai_analysis_view(request, test_id):
+    test = await aget_object_or_404(Test.objects.select_related('current_version'), pk=test_id)
     
     if request.method == 'POST':
         try:
             answers_data = json.loads(request.body)
-            ai_analysis = get_ai_analysis(answers_data, test.system_prompt)
-            
-            link_jobs_to_analysis(ai_analysis)
 
-            AssessmentResult.objects.create(
-                user=request.user,
+            result = await AssessmentResult.objects.acreate(
+                user=await request.auser(),
                 test=test,
-                answers=answers_data,
-                ai_analysis=ai_analysis,
-                sources=test.sources
+                test_version=test.current_version,
+                answers=AssessmentResult.compact_answers(answers_data),
+                ai_analysis=None
             )
+            job = await aenqueue_analysis(result)
             
-            return JsonResponse({'status': 'success', 'analysis': ai_analysis, 'sources': test.sources})
+            return JsonResponse({'status': 'success', 'result_id': result.id, 'job': _job_payload(job)}, status=202)
         except json.JSONDecodeError:
             return JsonResponse({'status': 'error', 'message': 'Invalid JSON'}, status=400)
+        except ValueError as e:
+            return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
     return JsonResponse({'status': 'error', 'message': 'Only POST requests allowed'}, status=405)
 
 @login_required
+@use_replica
 def dashboard_api_view(request):
-    primary_result = AssessmentResult.objects.filter(user=request.user, test__is_primary_assessment=True).order_by('-created_at').first()
-    
-    recommended_tests = []
-    if primary_result and primary_result.ai_analysis:
-        recommended_job_names = [job['job'] for job in primary_result.ai_analysis.get('recommended_jobs', [])]
-        recommended_tests = list(Test.objects.filter(related_job__name__in=recommended_job_names).values('id', 'name', 'description'))
-
-    other_tests = list(Test.objects.filter(is_primary_assessment=False).exclude(id__in=[t['id'] for t in recommended_tests]).values('id', 'name', 'description'))
+    # Recommendations are materialized when the primary analysis is saved (see recommendations.py)
+    recommended_tests, other_tests = get_dashboard_tests(request.user)
 
     data = {
         'recommended_tests': recommended_tests,
@@ -95,38 +104,135 @@ def dashboard_api_view(request):
     return JsonResponse(data)
 
 @login_required
+@use_replica
 def get_tests_list_api(request):
-    tests = Test.objects.filter(is_primary_assessment=False).values('id', 'name', 'description', 'sources')
-    return JsonResponse({'status': 'success', 'tests': list(tests)})
+    return JsonResponse({'status': 'success', 'tests': get_tests_list()})
+
+HISTORY_PAGE_SIZE = 20
+HISTORY_MAX_PAGE_SIZE = 100
+
+def _encode_history_cursor(created_at, result_id):
+    raw = f"{created_at.isoformat()}|{result_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+def _decode_history_cursor(cursor):
+    created_at, result_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+    return datetime.fromisoformat(created_at), int(result_id)
+
+def _history_limit(request):
+    limit = min(int(request.GET.get('limit', HISTORY_PAGE_SIZE)), HISTORY_MAX_PAGE_SIZE)
+    if limit < 1:
+        raise ValueError(limit)
+    return limit
+
+def _analysis_status(has_analysis, analysis_error):
+    if has_analysis:
+        return 'done'
+    return 'failed' if analysis_error else 'pending'
 
 @login_required
+@use_replica
 def get_user_history_api(request):
+    """
+    One page of the user's results, newest first, without the heavy answers
+    and analysis JSON (those come from get_history_detail_api).
+    Pass the returned next_cursor as ?cursor= to get the following page.
+    """
     try:
-        results = AssessmentResult.objects.filter(user=request.user).select_related('test').order_by('-created_at')
-        
-        history_data = []
-        for r in results:
-            sources = []
-            
-            if hasattr(r, 'sources') and r.sources:
-                sources = r.sources
-            elif hasattr(r.test, 'sources') and r.test.sources:
-                sources = r.test.sources
-            
-            history_data.append({
-                'id': r.id,
-                'test_name': r.test.name,
-                'date': r.created_at.strftime('%Y/%m/%d'),
-                'time': r.created_at.strftime('%H:%M'),
-                'answers': r.answers,
-                'analysis': r.ai_analysis,
-                'sources': sources
-            })
+        limit = _history_limit(request)
+        results = (AssessmentResult.objects
+                   .filter(user=request.user, is_draft=False)
+                   .annotate(has_analysis=Case(When(ai_analysis__isnull=True, then=Value(False)), default=Value(True), output_field=BooleanField()))
+                   .order_by('-created_at', '-id')
+                   .values('id', 'created_at', 'test_id', 'test__name', 'has_analysis', 'analysis_error'))
+
+        cursor = request.GET.get('cursor')
+        if cursor:
+            # Keyset pagination: continue right after the last row of the previous page
+            created_at, result_id = _decode_history_cursor(cursor)
+            results = results.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=result_id))
+
+        rows = list(results[:limit + 1])
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = _encode_history_cursor(rows[-1]['created_at'], rows[-1]['id'])
+
+        history_data = [{
+            'id': r['id'],
+            'test_id': r['test_id'],
+            'test_name': r['test__name'],
+            'date': r['created_at'].strftime('%Y/%m/%d'),
+            'time': r['created_at'].strftime('%H:%M'),
+            'analysis_status': _analysis_status(r['has_analysis'], r['analysis_error']),
+        } for r in rows]
             
-        return JsonResponse({'status': 'success', 'history': history_data})
+        return JsonResponse({'status': 'success', 'history': history_data, 'next_cursor': next_cursor})
+    except (ValueError, UnicodeDecodeError, binascii.Error):
+        return JsonResponse({'status': 'error', 'message': 'Invalid cursor or limit.'}, status=400)
     except Exception as e:
         return JsonResponse({'status': 'error', 'message': str(e)}, status=500)
 
+@login_required
+@use_replica
+def get_history_detail_api(request, result_id):
+    """Full answers and analysis of one result. Supports If-None-Match."""
+    r = get_object_or_404(AssessmentResult.objects.select_related('test', 'test_version'), pk=result_id, user=request.user)
+
+    response = JsonResponse({'status': 'success', 'result': {
+        'id': r.id,
+        'test_name': r.test.name,
+        'date': r.created_at.strftime('%Y/%m/%d'),
+        'time': r.created_at.strftime('%H:%M'),
+        'answers': r.rich_answers,
+        'analysis': r.ai_analysis,
+        'analysis_status': _analysis_status(r.ai_analysis is not None, r.analysis_error),
+        'sources': r.test.sources or [],
+    }})
+
+    etag = quote_etag(hashlib.md5(response.content).hexdigest())
+    response['ETag'] = etag
+    # The analysis can still change (pending -> done), so always revalidate
+    response['Cache-Control'] = 'private, no-cache'
+    return get_conditional_response(request, etag=etag, response=response)
+
+@login_required
+def get_archived_history_api(request):
+    """
+    One page of the user's archived results (moved out of the database by
+    archive_results), read from the archive files. Paginated like
+    get_user_history_api, with the same next_cursor.
+    """
+    try:
+        limit = _history_limit(request)
+        # DjangoJSONEncoder stored created_at as an ISO string
+        rows = ((datetime.fromisoformat(r['created_at']), r) for r in archived_results(request.user.id) if not r.get('is_draft'))
+
+        cursor = request.GET.get('cursor')
+        if cursor:
+            after = _decode_history_cursor(cursor)
+            rows = ((created_at, r) for created_at, r in rows if (created_at, r['id']) < after)
+
+        page = list(islice(rows, limit + 1))
+        next_cursor = None
+        if len(page) > limit:
+            page = page[:limit]
+            created_at, last = page[-1]
+            next_cursor = _encode_history_cursor(created_at, last['id'])
+    except (ValueError, TypeError, UnicodeDecodeError, binascii.Error):
+        return JsonResponse({'status': 'error', 'message': 'Invalid cursor or limit.'}, status=400)
+
+    results = [{
+        'id': r['id'],
+        'test_name': r['test_name'],
+        'date': r['created_at'][:10].replace('-', '/'),
+        'time': r['created_at'][11:16],
+        'answers': r['answers'],
+        'analysis': r['ai_analysis'],
+        'analysis_status': _analysis_status(r['ai_analysis'] is not None, r['analysis_error']),
+    } for _, r in page]
+    return JsonResponse({'status': 'success', 'history': results, 'next_cursor': next_cursor})
+
 @login_required
 def save_draft_view(request, test_id):
     if request.method == 'POST':
@@ -134,12 +240,7 @@ def save_draft_view(request, test_id):
         try:
             answers_data = json.loads(request.body)
             
-            result = AssessmentResult.objects.create(
-                user=request.user,
-                test=test,
-                answers=answers_data,
-                ai_analysis=None
-            )
+            result = save_draft(request.user, test, answers_data)
             
             return JsonResponse({'status': 'success', 'result_id': result.id})
         except Exception as e:
@@ -147,20 +248,107 @@ def save_draft_view(request, test_id):
     return JsonResponse({'status': 'error'}, status=405)
 
 @login_required
-def perform_analysis_view(request, test_id, result_id):
+def autosave_draft_view(request, test_id):
+    """PATCH with only the changed answers, {question_id: answer}; null clears an answer."""
+    if request.method != 'PATCH':
+        return JsonResponse({'status': 'error'}, status=405)
+    test = get_object_or_404(Test, pk=test_id)
+    try:
+        patch = json.loads(request.body)
+    except json.JSONDecodeError:
+        return JsonResponse({'status': 'error', 'message': 'Invalid JSON'}, status=400)
+    if not isinstance(patch, dict):
+        return JsonResponse({'status': 'error', 'message': 'Expected an object of answers'}, status=400)
+
+    draft_id = patch_draft(request.user, test, patch)
+    return JsonResponse({'status': 'success', 'result_id': draft_id})
+
+@login_required
+async def perform_analysis_view(request, test_id, result_id):
     if request.method == 'POST':
         try:
-            result = get_object_or_404(AssessmentResult, pk=result_id, user=request.user)
-            test = result.test
-            
-            ai_analysis = get_ai_analysis(result.answers, test.system_prompt)
-            link_jobs_to_analysis(ai_analysis)
-            
-            result.ai_analysis = ai_analysis
-            result.sources = test.sources
-            result.save()
+            user = await request.auser()
+            result = await aget_object_or_404(AssessmentResult.objects.select_related('test', 'test_version'), pk=result_id, user=user)
+            await sync_to_async(submit_draft)(result)
+            # ?refresh=1 skips the analysis cache and asks the AI again
+            use_cache = request.GET.get('refresh') != '1'
+            job = await aenqueue_analysis(result, use_cache=use_cache)
             
-            return JsonResponse({'status': 'success', 'analysis': ai_analysis, 'sources': test.sources})
+            return JsonResponse({'status': 'success', 'result_id': result.id, 'job': _job_payload(job)}, status=202)
         except Exception as e:
             return JsonResponse({'status': 'error', 'message': str(e)}, status=500)
-    return JsonResponse({'status': 'error'}, status=405)
\ No newline at end of file
+    return JsonResponse({'status': 'error'}, status=405)
+
+def _sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def _analysis_event_stream(result, use_cache):
+    """
+    Server-Sent Events for a streaming analysis:
+      section - a top-level field of the analysis is complete
+      item    - one entry of a list field (e.g. a recommended job) is complete
+      done    - the full analysis, already saved on the result
+      error   - the AI call failed; nothing was saved
+    """
+    try:
+        for event in stream_analyze_result(result, use_cache=use_cache):
+            if event.kind == 'member':
+                yield _sse_event('section', {'key': event.key, 'value': event.value})
+            else:
+                yield _sse_event('item', {'key': event.key, 'index': event.index, 'value': event.value})
+
+        yield _sse_event('done', {'result_id': result.id, 'analysis': result.ai_analysis, 'sources': result.test.sources})
+    except Exception as e:
+        logger.exception("Streamed analysis of result %s failed", result.id)
+        yield _sse_event('error', {'message': str(e)})
+
+async def _aanalysis_event_stream(result, use_cache):
+    """_analysis_event_stream as an async generator, for ASGI."""
+    try:
+        async for event in astream_analyze_result(result, use_cache=use_cache):
+            if event.kind == 'member':
+                yield _sse_event('section', {'key': event.key, 'value': event.value})
+            else:
+                yield _sse_event('item', {'key': event.key, 'index': event.index, 'value': event.value})
+
+        yield _sse_event('done', {'result_id': result.id, 'analysis': result.ai_analysis, 'sources': result.test.sources})
+    except Exception as e:
+        logger.exception("Streamed analysis of result %s failed", result.id)
+        yield _sse_event('error', {'message': str(e)})
+
+@login_required
+def stream_analysis_view(request, test_id, result_id):
+    """
+    Like perform_analysis_view, but runs the analysis in the request and
+    streams it back over SSE so the first sections show up within a second.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'status': 'error'}, status=405)
+
+    result = get_object_or_404(AssessmentResult.objects.select_related('test', 'test_version'), pk=result_id, user=request.user)
+    submit_draft(result)
+    use_cache = request.GET.get('refresh') != '1'
+
+    # Django buffers a sync iterator completely under ASGI (and an async one under
+    # WSGI), so give each server the kind it can stream
+    event_stream = _aanalysis_event_stream if isinstance(request, ASGIRequest) else _analysis_event_stream
+    response = StreamingHttpResponse(event_stream(result, use_cache), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # Don't let nginx buffer the stream
+    return response
+
+@login_required
+def analysis_job_status_api(request, job_id):
+    """
+    Polled by the frontend after submit. Returns the job state and, once the
+    job is done, the analysis itself.
+    """
+    job = get_object_or_404(AnalysisJob.objects.select_related('result__test', 'result__test_version'), pk=job_id, result__user=request.user)
+    
+    data = {'status': 'success', 'job': _job_payload(job)}
+    if job.status == AnalysisJob.STATUS_DONE:
+        data['analysis'] = job.result.ai_analysis
+        data['sources'] = job.result.test.sources
+    elif job.status == AnalysisJob.STATUS_FAILED:
+        data['message'] = job.error
+    return JsonResponse(data)
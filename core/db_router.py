@@ -0,0 +1,106 @@
+# core/db_router.py
+"""
+Primary/replica routing.
+
+When a 'replica' database is configured, views decorated with @use_replica
+(history, dashboard, tests list, rank) read from it; everything else, and
+every write, goes to the primary ('default').
+
+A replica lags behind the primary, so a user who just submitted a test
+could see an old history. To avoid that, PrimaryPinMiddleware sets a short
+cookie after every successful write request, and while it is there that
+client's reads stay on the primary too (read-your-writes). The cookie
+lives DATABASE_REPLICA_PIN_SECONDS, which should be more than the usual
+replication lag.
+
+To try it locally, point DATABASE_REPLICA_NAME at a second SQLite file
+(`python manage.py migrate --database=replica` creates its tables). It
+receives no writes, so reads served from it show up as missing data.
+"""
+import contextvars
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+PRIMARY = 'default'
+REPLICA = 'replica'
+PIN_COOKIE = 'db_primary'
+
+# Set for the duration of a @use_replica view
+_read_from_replica = contextvars.ContextVar('read_from_replica', default=False)
+# Set by PrimaryPinMiddleware while the client's recent write may not have replicated yet
+_pinned_to_primary = contextvars.ContextVar('pinned_to_primary', default=False)
+
+
+def replica_configured():
+    return REPLICA in settings.DATABASES
+
+
+class PrimaryReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if _read_from_replica.get() and not _pinned_to_primary.get() and replica_configured():
+            return REPLICA
+        return PRIMARY
+
+    def db_for_write(self, model, **hints):
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Both databases hold the same data
+        return True
+
+
+def use_replica(view):
+    """Lets the reads of a read-only view go to the replica (sync and async views)."""
+    if iscoroutinefunction(view):
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            token = _read_from_replica.set(True)
+            try:
+                return await view(request, *args, **kwargs)
+            finally:
+                _read_from_replica.reset(token)
+    else:
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            token = _read_from_replica.set(True)
+            try:
+                return view(request, *args, **kwargs)
+            finally:
+                _read_from_replica.reset(token)
+    return wrapper
+
+
+class PrimaryPinMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = _pinned_to_primary.set(PIN_COOKIE in request.COOKIES)
+        try:
+            response = self.get_response(request)
+        finally:
+            _pinned_to_primary.reset(token)
+        return self.process_response(request, response)
+
+    async def __acall__(self, request):
+        token = _pinned_to_primary.set(PIN_COOKIE in request.COOKIES)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _pinned_to_primary.reset(token)
+        return self.process_response(request, response)
+
+    def process_response(self, request, response):
+        if replica_configured() and request.method not in ('GET', 'HEAD', 'OPTIONS') and response.status_code < 400:
+            response.set_cookie(PIN_COOKIE, '1', max_age=settings.DATABASE_REPLICA_PIN_SECONDS,
+                                httponly=True, samesite='Lax')
+        return response
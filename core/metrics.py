@@ -0,0 +1,231 @@
+# core/metrics.py
+"""
+Request timing and Prometheus metrics.
+
+RequestMetricsMiddleware times every request. While it runs, database
+queries (through an execute wrapper on every connection), AI calls and
+SMS sends (through `timed()`) are added to the request's timings. The
+totals are sent back in a Server-Timing header, which the browser's
+network tab shows, and go into the histograms served at /metrics in
+Prometheus text format.
+
+The histograms live in the process. With several server processes each one
+reports its own, so give every process its own scrape target, or add the
+numbers up in Prometheus. /metrics is open to staff users and the
+addresses in METRICS_ALLOWED_IPS, which is empty unless the operator opts
+in (REMOTE_ADDR is the proxy's address when behind one, so never list the
+proxy there).
+"""
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse, HttpResponseForbidden
+
+# Seconds
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labels):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels[label]) for label in self.labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            values = dict(self.values)
+        for key, value in sorted(values.items()):
+            yield self.name, dict(zip(self.labels, key)), value
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels, buckets=DURATION_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = buckets
+        self.values = {}  # labels -> [count per bucket..., +Inf count, sum]
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[label]) for label in self.labels)
+        with self.lock:
+            counts = self.values.setdefault(key, [0] * (len(self.buckets) + 2))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            counts[-2] += 1
+            counts[-1] += value
+
+    def samples(self):
+        with self.lock:
+            values = {key: list(counts) for key, counts in self.values.items()}
+        for key, counts in sorted(values.items()):
+            labels = dict(zip(self.labels, key))
+            for bound, count in zip(self.buckets, counts):
+                yield f'{self.name}_bucket', {**labels, 'le': str(bound)}, count
+            yield f'{self.name}_bucket', {**labels, 'le': '+Inf'}, counts[-2]
+            yield f'{self.name}_count', labels, counts[-2]
+            yield f'{self.name}_sum', labels, counts[-1]
+
+
+REQUEST_DURATION = Histogram('kafna_http_request_duration_seconds', "Time spent handling a request.", ['view', 'method'])
+REQUESTS = Counter('kafna_http_requests_total', "Requests handled, by response status.", ['view', 'method', 'status'])
+REQUEST_QUERIES = Histogram('kafna_db_queries_per_request', "Database queries made by one request.", ['view'],
+                            buckets=QUERY_COUNT_BUCKETS)
+REQUEST_DB_DURATION = Histogram('kafna_db_duration_seconds', "Time one request spent in database queries.", ['view'])
+# Measured wherever the call happens, in a request or in a worker
+CALL_DURATION = {
+    'ai': Histogram('kafna_ai_call_duration_seconds', "AI provider calls, including retries.", ['provider', 'outcome']),
+    'sms': Histogram('kafna_sms_send_duration_seconds', "SMS gateway calls.", ['provider', 'outcome']),
+}
+REGISTRY = [REQUEST_DURATION, REQUESTS, REQUEST_QUERIES, REQUEST_DB_DURATION, *CALL_DURATION.values()]
+
+
+class RequestTimings:
+    def __init__(self):
+        self.queries = 0
+        self.durations = {'db': 0.0, 'ai': 0.0, 'sms': 0.0}
+
+    def add(self, kind, seconds):
+        self.durations[kind] += seconds
+
+    def server_timing(self, total):
+        """The Server-Timing header value (durations in milliseconds)."""
+        parts = [f'app;dur={total * 1000:.1f}', f'db;dur={self.durations["db"] * 1000:.1f};desc="{self.queries} queries"']
+        parts += [f'{kind};dur={self.durations[kind] * 1000:.1f}' for kind in ('ai', 'sms') if self.durations[kind]]
+        return ', '.join(parts)
+
+
+_current = contextvars.ContextVar('request_timings', default=None)
+
+
+@contextmanager
+def timed(kind, provider):
+    """Times an outgoing 'ai' or 'sms' call, for the current request and the histograms."""
+    started = time.perf_counter()
+    outcome = 'error'
+    try:
+        yield
+        outcome = 'ok'
+    finally:
+        elapsed = time.perf_counter() - started
+        CALL_DURATION[kind].observe(elapsed, provider=provider, outcome=outcome)
+        timings = _current.get()
+        if timings is not None:
+            timings.add(kind, elapsed)
+
+
+def _record_query(execute, sql, params, many, context):
+    timings = _current.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings.queries += 1
+        timings.add('db', time.perf_counter() - started)
+
+
+def instrument(connection, **kwargs):
+    if _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record_query)
+
+
+# Connections opened later (other threads, reconnects) get the wrapper when they connect
+connection_created.connect(instrument)
+
+
+def _view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match else 'unmatched'
+
+
+class RequestMetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        for connection in connections.all():
+            instrument(connection)
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        timings = RequestTimings()
+        token = _current.set(timings)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, timings, time.perf_counter() - started)
+
+    async def __acall__(self, request):
+        timings = RequestTimings()
+        token = _current.set(timings)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, timings, time.perf_counter() - started)
+
+    def finish(self, request, response, timings, elapsed):
+        view = _view_name(request)
+        REQUEST_DURATION.observe(elapsed, view=view, method=request.method)
+        REQUESTS.inc(view=view, method=request.method, status=response.status_code)
+        REQUEST_QUERIES.observe(timings.queries, view=view)
+        REQUEST_DB_DURATION.observe(timings.durations['db'], view=view)
+        # For streamed responses this covers the time until the first byte
+        response['Server-Timing'] = timings.server_timing(elapsed)
+        return response
+
+
+def _number(value):
+    return str(value) if isinstance(value, int) else repr(float(value))
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def render():
+    """All metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f'# HELP {metric.name} {metric.documentation}')
+        lines.append(f'# TYPE {metric.name} {metric.kind}')
+        for name, labels, value in metric.samples():
+            label_text = ','.join(f'{key}="{_escape(val)}"' for key, val in labels.items())
+            lines.append(f'{name}{{{label_text}}} {_number(value)}' if label_text else f'{name} {_number(value)}')
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_view(request):
+    user = getattr(request, 'user', None)
+    if not (request.META.get('REMOTE_ADDR') in settings.METRICS_ALLOWED_IPS or (user and user.is_staff)):
+        return HttpResponseForbidden()
+    return HttpResponse(render(), content_type='text/plain; version=0.0.4; charset=utf-8')
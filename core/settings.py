@@ -9,6 +9,7 @@ https://docs.djangoproject.com/en/5.2/topics/settings/
 For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
+import json
 import os
 from pathlib import Path
 from decouple import config
@@ -43,11 +44,14 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so its timings cover the whole request (see core/metrics.py)
+    'core.metrics.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'core.db_router.PrimaryPinMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -75,13 +79,41 @@ WSGI_APPLICATION = 'core.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
+# Keep connections open between requests (seconds, 0 = close after each request)
+# and check them before reuse. Under ASGI use 0 and the pool below instead.
+DB_CONN_MAX_AGE = config('DB_CONN_MAX_AGE', default=60, cast=int)
+DB_CONN_HEALTH_CHECKS = config('DB_CONN_HEALTH_CHECKS', default=True, cast=bool)
+# PostgreSQL connection pool per process (psycopg 3 with its pool extra, see requirements.txt); 0 = no pool
+DB_POOL_MAX_SIZE = config('DB_POOL_MAX_SIZE', default=0, cast=int)
+DB_POOL_MIN_SIZE = config('DB_POOL_MIN_SIZE', default=2, cast=int)
+DB_POOL_TIMEOUT = config('DB_POOL_TIMEOUT', default=10, cast=float)  # seconds to wait for a free connection
+
+
+def _connection_settings():
+    if DB_POOL_MAX_SIZE and config('DATABASE') == 'POSTGRESQL':
+        # Pooled connections go back to the pool instead of being kept per thread
+        return {
+            'CONN_MAX_AGE': 0,
+            'OPTIONS': {'pool': {'min_size': DB_POOL_MIN_SIZE, 'max_size': DB_POOL_MAX_SIZE, 'timeout': DB_POOL_TIMEOUT}},
+        }
+    return {'CONN_MAX_AGE': DB_CONN_MAX_AGE, 'CONN_HEALTH_CHECKS': DB_CONN_HEALTH_CHECKS}
+
+
 if config('DATABASE') == 'SQLITE':
     DATABASES = {
         'default': {
             'ENGINE': 'django.db.backends.sqlite3',
             'NAME': BASE_DIR / 'db.sqlite3',
+            **_connection_settings(),
         }
     }
+    # A second SQLite file standing in for a read replica, to try the routing locally
+    if config('DATABASE_REPLICA_NAME', default=''):
+        DATABASES['replica'] = {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / config('DATABASE_REPLICA_NAME'),
+            **_connection_settings(),
+        }
 elif config('DATABASE') == 'POSTGRESQL':
     DATABASES = {
         'default': {
@@ -91,8 +123,23 @@ elif config('DATABASE') == 'POSTGRESQL':
             'PASSWORD': config('DATABASE_PASSWORD'),
             'HOST': config('DATABASE_HOST'),
             'PORT': config('DATABASE_PORT'),
+            **_connection_settings(),
         }
     }
+    # Streaming replica of the same database; empty = all reads go to the primary
+    if config('DATABASE_REPLICA_HOST', default=''):
+        DATABASES['replica'] = {
+            **DATABASES['default'],
+            'HOST': config('DATABASE_REPLICA_HOST'),
+            'PORT': config('DATABASE_REPLICA_PORT', default=config('DATABASE_PORT')),
+            **_connection_settings(),
+            'TEST': {'MIRROR': 'default'},
+        }
+
+# Read-only views read from the replica when there is one (see core/db_router.py)
+DATABASE_ROUTERS = ['core.db_router.PrimaryReplicaRouter']
+# After a write, the client reads from the primary for this long (replication lag margin)
+DATABASE_REPLICA_PIN_SECONDS = config('DATABASE_REPLICA_PIN_SECONDS', default=10, cast=int)
 
 
 # Password validation
@@ -131,6 +178,145 @@ SESSION_COOKIE_AGE = 2592000
 
 SESSION_EXPIRES_AT_BROWSER_CLOSE = False
 
+# Background AI analysis queue (see assessment/jobs.py)
+# Run the workers with: python manage.py run_analysis_worker
+
+ANALYSIS_WORKER_CONCURRENCY = config('ANALYSIS_WORKER_CONCURRENCY', default=4, cast=int)
+ANALYSIS_WORKER_POLL_INTERVAL = config('ANALYSIS_WORKER_POLL_INTERVAL', default=1.0, cast=float)
+ANALYSIS_JOB_MAX_ATTEMPTS = config('ANALYSIS_JOB_MAX_ATTEMPTS', default=3, cast=int)
+# Seconds a job may stay "running" before it is assumed lost and requeued
+ANALYSIS_JOB_TIMEOUT = config('ANALYSIS_JOB_TIMEOUT', default=300, cast=int)
+# Process jobs inline in the request (no worker needed), for local development
+ANALYSIS_QUEUE_EAGER = config('ANALYSIS_QUEUE_EAGER', default=False, cast=bool)
+
+# Persistent cache of AI analyses (see assessment/ai_cache.py)
+
+AI_CACHE_ENABLED = config('AI_CACHE_ENABLED', default=True, cast=bool)
+AI_CACHE_TTL = config('AI_CACHE_TTL', default=60 * 60 * 24 * 7, cast=int)  # seconds
+AI_CACHE_MAX_ENTRIES = config('AI_CACHE_MAX_ENTRIES', default=10000, cast=int)
+# Share of cache writes that also prune the table (0 = only prune_analysis_cache does)
+AI_CACHE_PRUNE_RATE = config('AI_CACHE_PRUNE_RATE', default=0.01, cast=float)
+
+# 'smsir' sends real OTP messages; 'fake' only logs them (development, load tests)
+SMS_BACKEND = config('SMS_BACKEND', default='smsir')
+# Messages the fake backend keeps in memory, so long load tests don't grow it forever
+SMS_FAKE_KEEP = config('SMS_FAKE_KEEP', default=1000, cast=int)
+
+# SMS outbox (see account/sms_outbox.py)
+# Run the senders with: python manage.py run_sms_worker
+
+SMS_WORKER_CONCURRENCY = config('SMS_WORKER_CONCURRENCY', default=4, cast=int)
+SMS_WORKER_POLL_INTERVAL = config('SMS_WORKER_POLL_INTERVAL', default=0.5, cast=float)
+SMS_POOL_SIZE = config('SMS_POOL_SIZE', default=SMS_WORKER_CONCURRENCY, cast=int)  # keep-alive connections to the gateway
+SMS_CONNECT_TIMEOUT = config('SMS_CONNECT_TIMEOUT', default=3.0, cast=float)  # seconds
+SMS_READ_TIMEOUT = config('SMS_READ_TIMEOUT', default=10.0, cast=float)  # seconds
+SMS_MAX_ATTEMPTS = config('SMS_MAX_ATTEMPTS', default=3, cast=int)
+SMS_RETRY_BASE_DELAY = config('SMS_RETRY_BASE_DELAY', default=2.0, cast=float)  # seconds, doubled per attempt
+SMS_RETRY_MAX_DELAY = config('SMS_RETRY_MAX_DELAY', default=30.0, cast=float)
+# Seconds a message may stay "sending" before it is assumed lost and requeued
+SMS_SEND_TIMEOUT = config('SMS_SEND_TIMEOUT', default=60, cast=int)
+# Send in the request (no worker needed), for local development
+SMS_QUEUE_EAGER = config('SMS_QUEUE_EAGER', default=False, cast=bool)
+
+# Shared cache (the test catalog lives here, see assessment/catalog.py).
+# Use e.g. django.core.cache.backends.redis.RedisCache with redis://... in
+# production so every process sees the same catalog version.
+CACHES = {
+    'default': {
+        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('CACHE_LOCATION', default=''),
+    }
+}
+
+# Sessions are read on every logged-in request. cached_db serves them from
+# the cache and only falls back to django_session on a miss; it needs a
+# cache shared by all processes (a per-process locmem cache would keep a
+# logged-out session alive in the other processes), so without one the
+# default stays the plain database backend.
+# Delete expired rows from cron with: python manage.py purge_sessions
+_SHARED_CACHE = not CACHES['default']['BACKEND'].endswith(('LocMemCache', 'DummyCache'))
+SESSION_ENGINE = config('SESSION_ENGINE', default='django.contrib.sessions.backends.cached_db' if _SHARED_CACHE
+                        else 'django.contrib.sessions.backends.db')  # db | cached_db | cache
+SESSION_CACHE_ALIAS = config('SESSION_CACHE_ALIAS', default='default')
+
+# Login codes (see account/otp.py). 'cache' needs a CACHES backend shared by
+# all processes: with a per-process one a code issued by one worker can't be
+# verified by another, and the cooldown and attempt limits would only count
+# per process. So like sessions, it defaults to the database without one.
+OTP_STORE = config('OTP_STORE', default='cache' if _SHARED_CACHE else 'db')  # cache | db
+OTP_CACHE_ALIAS = config('OTP_CACHE_ALIAS', default='default')
+OTP_TTL = config('OTP_TTL', default=120, cast=int)  # seconds a code stays valid
+OTP_MAX_ATTEMPTS = config('OTP_MAX_ATTEMPTS', default=5, cast=int)  # wrong guesses per code
+OTP_RESEND_COOLDOWN = config('OTP_RESEND_COOLDOWN', default=60, cast=int)  # seconds between codes per number
+
+# Seconds a process trusts its own copy of the catalog version before asking
+# the shared cache again, i.e. how long admin edits take to show everywhere
+CATALOG_LOCAL_TTL = config('CATALOG_LOCAL_TTL', default=5, cast=int)
+CATALOG_CACHE_TIMEOUT = config('CATALOG_CACHE_TIMEOUT', default=60 * 60 * 24, cast=int)
+# Seconds before the catalog version expires and every process rebuilds (0 = never).
+# Without a shared cache each process has its own version and a bump only
+# reaches the process that handled the admin edit, so the others are capped
+# to this much staleness instead
+CATALOG_VERSION_TIMEOUT = config('CATALOG_VERSION_TIMEOUT', default=0 if _SHARED_CACHE else 300, cast=int)
+
+# Seconds the questions API trusts its in-memory copy of a test's questions
+# before checking the version in the database again, and how long browsers
+# may reuse them without revalidating
+QUESTIONS_CACHE_TTL = config('QUESTIONS_CACHE_TTL', default=60, cast=int)
+QUESTIONS_BROWSER_MAX_AGE = config('QUESTIONS_BROWSER_MAX_AGE', default=0, cast=int)
+
+# Archive of old assessment results (see assessment/archive.py)
+# Run it with: python manage.py archive_results
+
+RESULTS_ARCHIVE_DIR = config('RESULTS_ARCHIVE_DIR', default=str(BASE_DIR / 'archive'))
+RESULTS_ARCHIVE_AFTER_MONTHS = config('RESULTS_ARCHIVE_AFTER_MONTHS', default=12, cast=int)
+RESULTS_ARCHIVE_SHARDS = config('RESULTS_ARCHIVE_SHARDS', default=16, cast=int)  # files per month, by user id
+
+# AI provider backends (see assessment/providers.py)
+
+AI_PROVIDER = config('AI_PROVIDER', default='gemini')  # gemini | openai | stub
+# Optional second provider raced against slow requests; empty disables hedging
+AI_HEDGE_PROVIDER = config('AI_HEDGE_PROVIDER', default='')
+AI_HEDGE_PERCENTILE = config('AI_HEDGE_PERCENTILE', default=95, cast=int)
+AI_HEDGE_MIN_DELAY = config('AI_HEDGE_MIN_DELAY', default=2.0, cast=float)  # seconds
+AI_HEDGE_DEFAULT_DELAY = config('AI_HEDGE_DEFAULT_DELAY', default=10.0, cast=float)  # until enough latency samples exist
+GEMINI_MODEL = config('GEMINI_MODEL', default='gemini-2.5-flash')
+OPENAI_MODEL = config('OPENAI_MODEL', default='gpt-4o-mini')
+OPENAI_BASE_URL = config('OPENAI_BASE_URL', default='')
+# Ask for token counts at the end of streamed responses. Some OpenAI-compatible
+# servers reject stream_options with a 400; turn it off for those (streamed
+# analyses are then recorded without tokens or cost)
+OPENAI_STREAM_USAGE = config('OPENAI_STREAM_USAGE', default=True, cast=bool)
+AI_STUB_LATENCY = config('AI_STUB_LATENCY', default=0.0, cast=float)  # seconds
+
+# AI usage accounting (see assessment/usage.py)
+# USD per million [prompt, completion] tokens by model name, as a JSON object; models without a price get no cost
+AI_TOKEN_PRICES = config(
+    'AI_TOKEN_PRICES',
+    default='{"gemini-2.5-flash": [0.30, 2.50], "gpt-4o-mini": [0.15, 0.60], "local-stub": [0, 0]}',
+    cast=json.loads,
+)
+AI_USAGE_REPORT_DAYS = config('AI_USAGE_REPORT_DAYS', default=30, cast=int)  # window of the admin report
+
+# Protection around the AI provider (see assessment/resilience.py)
+
+AI_RATE_LIMIT_PER_MINUTE = config('AI_RATE_LIMIT_PER_MINUTE', default=60, cast=int)  # per process, 0 = unlimited
+AI_RATE_LIMIT_BURST = config('AI_RATE_LIMIT_BURST', default=10, cast=int)
+AI_REQUEST_TIMEOUT = config('AI_REQUEST_TIMEOUT', default=60, cast=float)  # seconds, per attempt
+AI_TOTAL_TIMEOUT = config('AI_TOTAL_TIMEOUT', default=120, cast=float)  # seconds, including retries
+AI_MAX_RETRIES = config('AI_MAX_RETRIES', default=3, cast=int)
+AI_RETRY_BASE_DELAY = config('AI_RETRY_BASE_DELAY', default=1.0, cast=float)
+AI_RETRY_MAX_DELAY = config('AI_RETRY_MAX_DELAY', default=20.0, cast=float)
+AI_CIRCUIT_FAILURE_THRESHOLD = config('AI_CIRCUIT_FAILURE_THRESHOLD', default=5, cast=int)
+AI_CIRCUIT_RESET_TIMEOUT = config('AI_CIRCUIT_RESET_TIMEOUT', default=30, cast=float)  # seconds
+
+# Request timing and Prometheus metrics (see core/metrics.py)
+# /metrics is served to staff users and to these addresses (comma separated).
+# Empty by default: behind a reverse proxy every request comes from the
+# proxy's address (usually 127.0.0.1), so list your Prometheus server only
+# if it reaches the app directly, not through the proxy.
+METRICS_ALLOWED_IPS = config('METRICS_ALLOWED_IPS', default='', cast=lambda v: [s.strip() for s in v.split(',') if s.strip()])
+
 # Static files (CSS, JavaScript, Images)
 # https://docs.djangoproject.com/en/5.2/howto/static-files/
 